@@ -0,0 +1,287 @@
+import asyncio
+import hashlib
+import os
+import secrets
+from datetime import datetime, timedelta, date
+from aiohttp import web
+from bson.objectid import ObjectId
+from bson.errors import InvalidId
+from pymongo.errors import PyMongoError
+from auth import verify_password
+from db import users_col, leaves_col, api_tokens_col
+from modules import attachments, punches, leave_ledger, absence_calendar
+from modules import monitoring
+from modules.punch_queue import get_punch_queue
+from modules.write_buffer import get_write_buffer
+from modules.tenancy import DEFAULT_TENANT, tenant_context
+
+# Headless HTTP API for kiosks and the mobile app. Runs alongside the Streamlit UI:
+#   python api.py            (listens on API_HOST:API_PORT, default 0.0.0.0:8080)
+# It shares the pooled MongoClient from db.py; blocking pymongo calls run in worker threads.
+# Each request runs inside its token's tenant context (asyncio.to_thread carries it along).
+# Prometheus metrics cover every tenant, so /metrics is only served on a separate
+# internal listener (METRICS_HOST:METRICS_PORT, default 127.0.0.1:9100).
+
+TOKEN_TTL_HOURS = int(os.getenv("API_TOKEN_TTL_HOURS", "12"))
+REVIEWER_ROLES = ["admin", "hr", "manager"]
+MAX_SUMMARY_DAYS = 366
+
+
+def _hash_token(token):
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def _json_error(status, message):
+    return web.json_response({"error": message}, status=status)
+
+
+async def _json_body(request):
+    """The request's JSON object, or None when the body is not a JSON object."""
+    try:
+        body = await request.json()
+    except ValueError:  # includes JSONDecodeError
+        return None
+    return body if isinstance(body, dict) else None
+
+
+def _serialize(value):
+    """Makes Mongo documents JSON friendly (ObjectId / datetime -> str)."""
+    if isinstance(value, dict):
+        return {k: _serialize(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_serialize(v) for v in value]
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+# --- Authentication ---
+def _login(tenant_id, username, password):
+    with tenant_context(tenant_id):
+        return _login_for_tenant(tenant_id, username, password)
+
+
+def _login_for_tenant(tenant_id, username, password):
+    user = users_col.find_one({"username": username.lower()}, {"password_hash": 1, "employee_id": 1, "role": 1, "username": 1})
+    if not user or not verify_password(password, user["password_hash"]):
+        return None
+    token = secrets.token_urlsafe(32)
+    api_tokens_col.insert_one({
+        "token_hash": _hash_token(token),
+        "tenant_id": tenant_id,
+        "employee_id": user["employee_id"],
+        "username": user["username"],
+        "role": user["role"],
+        "created_at": datetime.now(),
+        "expires_at": datetime.utcnow() + timedelta(hours=TOKEN_TTL_HOURS)
+    })
+    return {"token": token, "employee_id": user["employee_id"], "role": user["role"], "expires_in": TOKEN_TTL_HOURS * 3600}
+
+
+def _lookup_token(token, scope=None):
+    """A live token; download links (scope "attachment") are never valid as bearer tokens."""
+    return api_tokens_col.find_one(
+        {"token_hash": _hash_token(token), "expires_at": {"$gt": datetime.utcnow()}, "scope": scope},
+        {"employee_id": 1, "role": 1, "username": 1, "tenant_id": 1, "file_id": 1}
+    )
+
+
+@web.middleware
+async def auth_middleware(request, handler):
+    # Attachment downloads carry their own single-file token in the link
+    if request.path in ("/api/login", "/api/health") or request.path.startswith("/api/attachments/"):
+        return await handler(request)
+    header = request.headers.get("Authorization", "")
+    if not header.startswith("Bearer "):
+        return _json_error(401, "Missing bearer token.")
+    session = await asyncio.to_thread(_lookup_token, header[len("Bearer "):])
+    if not session:
+        return _json_error(401, "Invalid or expired token.")
+    request["user"] = session
+    with tenant_context(session.get("tenant_id") or DEFAULT_TENANT):
+        return await handler(request)
+
+
+# --- Handlers ---
+async def health(request):
+    return web.json_response({"status": "ok"})
+
+
+async def login(request):
+    body = await _json_body(request)
+    if body is None or not all(isinstance(body.get(field), str) for field in ("username", "password")):
+        return _json_error(400, "A JSON body with username and password is required.")
+    tenant_id = body.get("tenant") or DEFAULT_TENANT
+    if not isinstance(tenant_id, str):
+        return _json_error(400, "tenant must be a string.")
+    result = await asyncio.to_thread(_login, tenant_id, body["username"], body["password"])
+    if not result:
+        return _json_error(401, "Invalid username or password.")
+    return web.json_response(result)
+
+
+async def punch_in(request):
+    ok, result = await asyncio.to_thread(punches.punch_in, request["user"]["employee_id"], None, "api")
+    if not ok:
+        return _json_error(409, result)
+    return web.json_response(_serialize(result), status=201)
+
+
+async def punch_out(request):
+    ok, result = await asyncio.to_thread(punches.punch_out, request["user"]["employee_id"], None, "api")
+    if not ok:
+        return _json_error(409, result)
+    return web.json_response({"worked_hours": result})
+
+
+async def submit_leave(request):
+    body = await _json_body(request)
+    if body is None:
+        return _json_error(400, "A JSON object body is required.")
+    try:
+        start_date = date.fromisoformat(body["start_date"])
+        end_date = date.fromisoformat(body["end_date"])
+        leave_type = body["leave_type"]
+        reason = body["reason"].strip()
+    except (KeyError, ValueError, TypeError, AttributeError):
+        return _json_error(400, "leave_type, start_date, end_date (YYYY-MM-DD) and reason are required.")
+    if not reason or start_date > end_date:
+        return _json_error(400, "Please provide a reason and a start date before the end date.")
+    if not isinstance(leave_type, str) or leave_type.lower() not in leave_ledger.LEAVE_TYPES:
+        return _json_error(400, f"leave_type must be one of: {', '.join(leave_ledger.LEAVE_TYPES)}.")
+    day_types = ("full day", "first half", "second half")
+    if any(str(body.get(field, "full day")).lower() not in day_types for field in ("start_day_type", "end_day_type")):
+        return _json_error(400, f"start_day_type and end_day_type must be one of: {', '.join(day_types)}.")
+
+    employee_id = request["user"]["employee_id"]
+    try:
+        leave = await asyncio.to_thread(
+            leave_ledger.submit_leave, employee_id, leave_type, start_date, end_date,
+            body.get("start_day_type", "full day"), body.get("end_day_type", "full day"), reason
+        )
+    except leave_ledger.LeaveOverlapError as e:
+        return _json_error(409, str(e))
+    # The leave is already journaled: a failing coverage check must not turn it into a 500 (and a retry)
+    shortfalls = []
+    if get_write_buffer().online:
+        try:
+            shortfalls = await asyncio.to_thread(absence_calendar.coverage_shortfalls, employee_id, start_date, end_date)
+        except PyMongoError:
+            pass
+    leave["coverage_warnings"] = [{"date": day.isoformat(), "coverage": round(coverage, 2)} for day, coverage in shortfalls]
+    return web.json_response(_serialize(leave), status=201)
+
+
+async def review_leave(request):
+    if request["user"]["role"] not in REVIEWER_ROLES:
+        return _json_error(403, "Only HR, managers and admins can review leaves.")
+    try:
+        leave_id = ObjectId(request.match_info["leave_id"])
+    except InvalidId:
+        return _json_error(404, "Leave not found.")
+    leave = await asyncio.to_thread(leaves_col.find_one, {"_id": leave_id}, {"_id": 1})
+    if not leave:
+        return _json_error(404, "Leave not found.")
+    action = leave_ledger.approve_leave if request.match_info["action"] == "approve" else leave_ledger.reject_leave
+    try:
+        reviewed = await asyncio.to_thread(action, leave_id, request["user"]["employee_id"])
+    except leave_ledger.SelfReviewError as e:
+        return _json_error(403, str(e))
+    if not reviewed:
+        return _json_error(409, "Leave is not pending.")
+    return web.json_response({"leave_id": str(leave_id), "status": f"{request.match_info['action']}d"})
+
+
+async def download_attachment(request):
+    """Streams a leave attachment from GridFS chunk by chunk (links come from attachments.create_download_link)."""
+    link = await asyncio.to_thread(_lookup_token, request.query.get("token", ""), "attachment")
+    if not link or str(link["file_id"]) != request.match_info["file_id"]:
+        return _json_error(403, "This download link is invalid or has expired.")
+    with tenant_context(link.get("tenant_id") or DEFAULT_TENANT):
+        try:
+            grid_out = await asyncio.to_thread(attachments.open_attachment, link["file_id"])
+        except FileNotFoundError:
+            return _json_error(404, "Attachment not found.")
+        response = web.StreamResponse(headers={
+            "Content-Type": grid_out.metadata.get("content_type") or "application/octet-stream",
+            "Content-Disposition": f'attachment; filename="{grid_out.filename.replace(chr(34), "")}"'
+        })
+        response.content_length = grid_out.length
+        await response.prepare(request)
+        try:
+            while True:
+                chunk = await asyncio.to_thread(grid_out.readchunk)
+                if not chunk:
+                    break
+                await response.write(chunk)
+        finally:
+            grid_out.close()
+        await response.write_eof()
+        return response
+
+
+async def attendance_summary(request):
+    employee_id = request.match_info["employee_id"]
+    user = request["user"]
+    if employee_id != user["employee_id"] and user["role"] not in REVIEWER_ROLES:
+        return _json_error(403, "You can only view your own attendance.")
+    try:
+        days = int(request.query.get("days", "30"))
+    except ValueError:
+        return _json_error(400, "days must be a whole number.")
+    if not 1 <= days <= MAX_SUMMARY_DAYS:
+        return _json_error(400, f"days must be between 1 and {MAX_SUMMARY_DAYS}.")
+    summary = await asyncio.to_thread(punches.attendance_summary, employee_id, days)
+    return web.json_response(summary)
+
+
+async def punch_queue_metrics(request):
+    if request["user"]["role"] not in REVIEWER_ROLES:
+        return _json_error(403, "Only HR, managers and admins can view metrics.")
+    return web.json_response(get_punch_queue().metrics())
+
+
+async def prometheus_metrics(request):
+    return web.Response(text=monitoring.prometheus_text(), content_type="text/plain")
+
+
+def create_app():
+    app = web.Application(middlewares=[auth_middleware])
+    app.add_routes([
+        web.get("/api/health", health),
+        web.post("/api/login", login),
+        web.post("/api/punch/in", punch_in),
+        web.post("/api/punch/out", punch_out),
+        web.post("/api/leaves", submit_leave),
+        web.post(r"/api/leaves/{leave_id}/{action:approve|reject}", review_leave),
+        web.get("/api/employees/{employee_id}/attendance-summary", attendance_summary),
+        web.get("/api/attachments/{file_id}", download_attachment),
+        web.get("/api/metrics/punch-queue", punch_queue_metrics),
+    ])
+    return app
+
+
+def create_metrics_app():
+    """Prometheus endpoint for the internal listener only (no tenant scoping, no auth)."""
+    app = web.Application()
+    app.add_routes([web.get("/metrics", prometheus_metrics)])
+    return app
+
+
+async def serve():
+    listeners = [
+        (create_app(), os.getenv("API_HOST", "0.0.0.0"), int(os.getenv("API_PORT", "8080"))),
+        (create_metrics_app(), os.getenv("METRICS_HOST", "127.0.0.1"), int(os.getenv("METRICS_PORT", "9100"))),
+    ]
+    for app, host, port in listeners:
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        print(f"Listening on http://{host}:{port}")
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    asyncio.run(serve())
@@ -0,0 +1,99 @@
+import asyncio
+import os
+import sys
+import time
+import aiohttp
+
+# Simple load test for the headless API (api.py).
+# Usage: python api_load_test.py [base_url] [concurrency] [requests_per_worker] [tenant]
+# Logs in the dummy employee accounts of `tenant` (default TENANT_ID or "default"),
+# then runs two kinds of workers side by side and reports throughput and latency
+# percentiles per endpoint:
+#   - kiosk workers alternate punch in / punch out (the write path), one account each
+#   - the other workers hammer the attendance-summary endpoint (the read path)
+# A 409 on a punch (e.g. "Already punched in" after a previous run) is counted as
+# rejected, not as an error.
+
+BASE_URL = sys.argv[1] if len(sys.argv) > 1 else "http://localhost:8080"
+CONCURRENCY = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+REQUESTS_PER_WORKER = int(sys.argv[3]) if len(sys.argv) > 3 else 100
+TENANT = sys.argv[4] if len(sys.argv) > 4 else os.getenv("TENANT_ID", "default")
+ACCOUNTS = ["emily.jones", "david.chen", "sophia.patel", "ben.carter", "olivia.wong"]
+PASSWORD = "password123"
+
+
+async def _timed(session, method, url, headers, stats, rejected_status=None):
+    started = time.perf_counter()
+    status = None
+    try:
+        async with session.request(method, url, headers=headers) as response:
+            await response.read()
+            status = response.status
+    except aiohttp.ClientError as e:
+        stats["errors"].append(str(e))
+    stats["latencies"].append(time.perf_counter() - started)
+    if status == rejected_status:
+        stats["rejected"] += 1
+    elif status is not None and status >= 300:
+        stats["errors"].append(status)
+
+
+async def punch_worker(session, headers, stats):
+    """A kiosk: punch in, punch out, repeat (one account per worker, so requests never race)."""
+    for n in range(REQUESTS_PER_WORKER):
+        action = "in" if n % 2 == 0 else "out"
+        await _timed(session, "POST", f"{BASE_URL}/api/punch/{action}", headers, stats, rejected_status=409)
+
+
+async def read_worker(session, auth, stats):
+    url = f"{BASE_URL}/api/employees/{auth['employee_id']}/attendance-summary"
+    headers = {"Authorization": f"Bearer {auth['token']}"}
+    for _ in range(REQUESTS_PER_WORKER):
+        await _timed(session, "GET", url, headers, stats)
+
+
+async def login(session, username):
+    body = {"tenant": TENANT, "username": username, "password": PASSWORD}
+    async with session.post(f"{BASE_URL}/api/login", json=body) as response:
+        return await response.json() if response.status == 200 else None
+
+
+def report(name, stats, elapsed):
+    latencies = sorted(stats["latencies"])
+    if not latencies:
+        return
+
+    def pct(p):
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000
+
+    print(f"{name}: {len(latencies)} requests, {len(stats['errors'])} errors, {stats['rejected']} rejected, "
+          f"{len(latencies) / elapsed:.1f} req/s, p50 {pct(0.50):.1f} ms  p95 {pct(0.95):.1f} ms  p99 {pct(0.99):.1f} ms")
+
+
+async def run_load_test():
+    async with aiohttp.ClientSession() as session:
+        sessions = [auth for auth in await asyncio.gather(*(login(session, u) for u in ACCOUNTS)) if auth]
+        if not sessions:
+            print(f"❌ Login failed for tenant '{TENANT}'. Run create_dummy_users.py first.")
+            return
+
+        punch_stats = {"latencies": [], "errors": [], "rejected": 0}
+        read_stats = {"latencies": [], "errors": [], "rejected": 0}
+        kiosks = min(len(sessions), max(1, CONCURRENCY // 2))
+        workers = [
+            punch_worker(session, {"Authorization": f"Bearer {auth['token']}"}, punch_stats)
+            for auth in sessions[:kiosks]
+        ]
+        workers += [read_worker(session, sessions[i % len(sessions)], read_stats) for i in range(CONCURRENCY - kiosks)]
+
+        started = time.perf_counter()
+        await asyncio.gather(*workers)
+        elapsed = time.perf_counter() - started
+
+    print(f"Tenant: {TENANT}  Concurrency: {CONCURRENCY} ({kiosks} kiosks)")
+    report("Punch in/out", punch_stats, elapsed)
+    report("Attendance summary", read_stats, elapsed)
+
+
+if __name__ == "__main__":
+    asyncio.run(run_load_test())
@@ -1,11 +1,15 @@
+import importlib
 import streamlit as st
 from db import users_col
 from auth import verify_password, hash_password
+from modules.employee_search import with_search_keys
+from modules.tenancy import DEFAULT_TENANT
 from datetime import datetime
-from streamlit_option_menu import option_menu  # Import the new menu component
 
-# Import all modules
-from modules import attendance, leaves, employee_dashboard, admin_hr_dashboard, profile_page
+# Only what the login page needs is imported up front. Page modules (and with them
+# pandas / Plotly) are imported on first navigation, and db.py connects to the
+# cluster in the background, so the login form renders without waiting on either.
+# Track time-to-login-form with benchmark_startup.py.
 
 # --- PAGE CONFIGURATION ---
 st.set_page_config(
@@ -15,10 +19,15 @@ st.set_page_config(
 )
 
 # --- FUNCTION TO LOAD CSS & FONT AWESOME ICONS ---
-def load_css_and_icons(file_name):
-    """Loads a local CSS file and the Font Awesome icon library."""
+@st.cache_resource
+def read_css(file_name):
+    """Reads the stylesheet once per process instead of on every rerun."""
     with open(file_name) as f:
-        st.markdown(f'<style>{f.read()}</style>', unsafe_allow_html=True)
+        return f'<style>{f.read()}</style>'
+
+def load_css_and_icons(file_name):
+    """Injects the local CSS file and the Font Awesome icon library."""
+    st.markdown(read_css(file_name), unsafe_allow_html=True)
     st.markdown('<link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.5.1/css/all.min.css">', unsafe_allow_html=True)
 
 # Load the custom styles
@@ -28,26 +37,40 @@ load_css_and_icons("style.css")
 if 'logged_in' not in st.session_state: st.session_state.logged_in = False
 if 'user_info' not in st.session_state: st.session_state.user_info = None
 
-def login_user(username, password):
-    """Authenticates user and updates session state."""
+def login_user(tenant_id, username, password):
+    """Authenticates user within their company and updates session state."""
+    # Every collection query below is scoped to the session's tenant
+    st.session_state.tenant_id = tenant_id
     user_data = users_col.find_one({"username": username})
     if user_data and verify_password(password, user_data['password_hash']):
         st.session_state.logged_in = True
         st.session_state.user_info = {
             "username": user_data['username'],
             "role": user_data['role'],
-            "employee_id": user_data['employee_id']
+            "employee_id": user_data['employee_id'],
+            "tenant_id": tenant_id
         }
         st.rerun()
     else:
-        st.error("❌ Invalid username or password")
+        st.session_state.pop("tenant_id", None)
+        st.error("❌ Invalid company ID, username or password")
 
 def logout_user():
     """Logs out user by clearing session state."""
     st.session_state.logged_in = False
     st.session_state.user_info = None
+    st.session_state.pop("tenant_id", None)
     st.rerun()
 
+def company_id_input():
+    """Company ID field, prefilled from ?tenant=... so each company can share its own login link."""
+    default = st.query_params.get("tenant") or DEFAULT_TENANT
+    return st.text_input("Company ID", value=default, placeholder="Enter your company ID").strip().lower()
+
+def load_page(name):
+    """Imports a page module on first navigation (later reruns reuse the loaded module)."""
+    return importlib.import_module(f"modules.{name}")
+
 # --- LOGIN / SIGN UP LANDING PAGE ---
 if not st.session_state.logged_in:
     st.markdown('<h1 class="gradient-text" style="text-align: center;">Streamline Your Workforce Management</h1>', unsafe_allow_html=True)
@@ -59,27 +82,30 @@ if not st.session_state.logged_in:
 
         if choice == "Login":
             with st.form("login_form"):
+                tenant_id = company_id_input()
                 username = st.text_input("Username", placeholder="Enter your username").lower()
                 password = st.text_input("Password", type="password", placeholder="Enter your password")
                 if st.form_submit_button("Login", use_container_width=True):
-                    login_user(username, password)
+                    login_user(tenant_id, username, password)
         else:  # Sign Up
             with st.form("signup_form", clear_on_submit=True):
+                new_tenant_id = company_id_input()
                 new_username = st.text_input("Username", placeholder="Choose a username").lower()
                 new_full_name = st.text_input("Full Name", placeholder="Enter your full name")
                 new_email = st.text_input("Email", placeholder="Enter your email")
                 new_password = st.text_input("Password", type="password", placeholder="Create a strong password")
                 new_employee_id = st.text_input("Employee ID", placeholder="Enter your unique employee ID")
                 if st.form_submit_button("Create Account", use_container_width=True):
-                    if not all([new_username, new_full_name, new_email, new_password, new_employee_id]):
+                    if not all([new_tenant_id, new_username, new_full_name, new_email, new_password, new_employee_id]):
                         st.error("Please fill out all fields.")
                     else:
+                        st.session_state.tenant_id = new_tenant_id
                         hashed_pass = hash_password(new_password)
-                        users_col.insert_one({
+                        users_col.insert_one(with_search_keys({
                             "username": new_username, "full_name": new_full_name, "email": new_email,
                             "password_hash": hashed_pass, "employee_id": new_employee_id,
                             "role": "employee", "join_date": datetime.now()
-                        })
+                        }))
                         st.success("Account created! Please switch to the Login tab.")
         st.markdown('</div>', unsafe_allow_html=True)
 
@@ -93,6 +119,7 @@ if not st.session_state.logged_in:
 
 # --- MAIN APPLICATION AFTER LOGIN ---
 else:
+    from streamlit_option_menu import option_menu
     user = st.session_state.user_info
     
     # --- NEW: Sidebar Navigation with streamlit-option-menu ---
@@ -122,12 +149,12 @@ else:
     # --- DYNAMIC PAGE ROUTING (This logic remains the same) ---
     if page == "Dashboard":
         if user['role'] == 'employee':
-            employee_dashboard.show_employee_dashboard()
+            load_page("employee_dashboard").show_employee_dashboard()
         elif user['role'] in ['admin', 'hr', 'manager']:
-            admin_hr_dashboard.show_admin_hr_dashboard()
+            load_page("admin_hr_dashboard").show_admin_hr_dashboard()
     elif page == "Attendance":
-        attendance.show_attendance_page()
+        load_page("attendance").show_attendance_page()
     elif page == "Leave Management":
-        leaves.show_leaves_page()
+        load_page("leaves").show_leaves_page()
     elif page == "My Profile":
-        profile_page.show_profile_page()
\ No newline at end of file
+        load_page("profile_page").show_profile_page()
\ No newline at end of file
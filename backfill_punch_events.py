@@ -0,0 +1,15 @@
+from db import all_tenants
+from modules.punch_events import backfill_from_attendance
+from modules.tenancy import tenant_context
+
+# One-off backfill: creates raw punch events for attendance records written
+# before punches were stored in the `punch_events` time-series collection.
+# Runs for every tenant, each in its own (shared or dedicated) database.
+# Safe to interrupt and re-run; finished records are flagged `from_events`.
+#   python backfill_punch_events.py
+
+if __name__ == "__main__":
+    for tenant_id in all_tenants():
+        with tenant_context(tenant_id):
+            done = backfill_from_attendance(progress=lambda message: print(f"[{tenant_id}] {message}"))
+        print(f"✅ [{tenant_id}] {done} attendance records backfilled")
@@ -0,0 +1,34 @@
+import argparse
+from modules.backup import run_backup, run_restore, list_runs
+
+# Command-line backup / restore.
+#   python backup_db.py backup                  # full backup
+#   python backup_db.py backup --incremental    # only documents added since the last run
+#   python backup_db.py list
+#   python backup_db.py restore <run_id> [--drop]
+
+def main():
+    parser = argparse.ArgumentParser(description="HRMS database backup and restore")
+    sub = parser.add_subparsers(dest="command", required=True)
+    backup = sub.add_parser("backup")
+    backup.add_argument("--incremental", action="store_true")
+    sub.add_parser("list")
+    restore = sub.add_parser("restore")
+    restore.add_argument("run_id")
+    restore.add_argument("--drop", action="store_true", help="Drop collections before restoring the full run")
+    args = parser.parse_args()
+
+    if args.command == "backup":
+        manifest = run_backup(args.incremental, progress=print)
+        print(f"✅ {manifest['type'].capitalize()} backup {manifest['run_id']}: {manifest['total_docs']} docs, "
+              f"{manifest['total_bytes'] / 1024 / 1024:.1f} MB in {manifest['seconds']}s "
+              f"({manifest['docs_per_second']} docs/s, {manifest['mb_per_second']} MB/s)")
+    elif args.command == "list":
+        for manifest in list_runs():
+            print(f"{manifest['run_id']}  {manifest['type']:<11}  {manifest.get('total_docs', '?')} docs")
+    else:
+        totals = run_restore(args.run_id, args.drop, progress=print)
+        print(f"✅ Restored {sum(totals.values())} documents into {len(totals)} collections.")
+
+if __name__ == "__main__":
+    main()
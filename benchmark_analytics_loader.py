@@ -0,0 +1,90 @@
+import json
+import random
+import resource
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+
+# Compares the dashboards' old loading path (pd.DataFrame(list(cursor)) followed by
+# to_datetime / to_numeric) with the typed columnar loader (modules/analytics_loader.py)
+# on synthetic attendance records. Each path runs in a fresh process so peak RSS is
+# not polluted by the other one.
+# Usage: python benchmark_analytics_loader.py [employees] [days]
+# Uses a temporary collection and drops it afterwards.
+
+EMPLOYEES = int(sys.argv[1]) if len(sys.argv) > 1 and not sys.argv[1].startswith("--") else 500
+DAYS = int(sys.argv[2]) if len(sys.argv) > 2 and not sys.argv[2].startswith("--") else 180
+COLLECTION = "bench_attendance_frames"
+SCHEMA_FIELDS = ["date", "status", "worked_hours"]
+
+
+def synthetic_records():
+    start = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=DAYS)
+    for day in range(DAYS):
+        date = start + timedelta(days=day)
+        for n in range(EMPLOYEES):
+            status = random.choices(["present", "absent", "on_leave"], weights=[90, 5, 5])[0]
+            record = {"employee_id": f"EMP{n:05d}", "date": date, "status": status}
+            if status == "present":
+                record["worked_hours"] = round(random.uniform(6, 10), 2)
+            yield record
+
+
+def _load_legacy(collection):
+    import pandas as pd
+    df = pd.DataFrame(list(collection.find({}, {field: 1 for field in SCHEMA_FIELDS})))
+    df["date"] = pd.to_datetime(df["date"]).dt.normalize()
+    df["worked_hours"] = pd.to_numeric(df["worked_hours"], errors="coerce").fillna(0)
+    return df
+
+
+def _load_columnar(collection):
+    from modules.analytics_loader import find_frame
+    df = find_frame(collection, {}, {"date": datetime, "status": str, "worked_hours": float})
+    df["date"] = df["date"].dt.normalize()
+    df["worked_hours"] = df["worked_hours"].fillna(0)
+    return df
+
+
+def measure_once(path):
+    """Runs in the child process: prints one JSON line with load time and peak RSS growth."""
+    import pandas  # noqa: F401 - imported before the baseline so only the load is measured
+    from db import tenant_collection
+    import modules.analytics_loader  # noqa: F401
+    collection = tenant_collection(COLLECTION)
+    baseline_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.perf_counter()
+    df = (_load_columnar if path == "columnar" else _load_legacy)(collection)
+    seconds = time.perf_counter() - started
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps({"rows": len(df), "seconds": seconds, "peak_mb": (peak_kb - baseline_kb) / 1024}))
+
+
+def run_benchmark():
+    from db import tenant_collection
+    from modules.analytics_loader import aggregate_pandas_all
+    collection = tenant_collection(COLLECTION)
+    collection.raw().drop()
+    records = list(synthetic_records())
+    for i in range(0, len(records), 10000):
+        collection.insert_many(records[i:i + 10000], ordered=False)
+    print(f"Synthetic attendance records: {len(records)} ({EMPLOYEES} employees x {DAYS} days)")
+    if aggregate_pandas_all is None:
+        print("⚠️ pymongoarrow is not installed: the columnar path uses its document fallback.")
+    try:
+        for path in ("legacy", "columnar"):
+            output = subprocess.run(
+                [sys.executable, __file__, "--once", path], capture_output=True, text=True, check=True
+            ).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            print(f"{path:>9}: {result['rows']} rows in {result['seconds']:.2f}s, peak memory +{result['peak_mb']:.0f} MB")
+    finally:
+        collection.raw().drop()
+
+
+if __name__ == "__main__":
+    if "--once" in sys.argv:
+        measure_once(sys.argv[sys.argv.index("--once") + 1])
+    else:
+        run_benchmark()
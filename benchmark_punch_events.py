@@ -0,0 +1,82 @@
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+from db import db
+
+# Compares storage size and aggregation latency of raw punch events in a regular
+# collection vs. a time-series collection, on synthetic data.
+# Usage: python benchmark_punch_events.py [employees] [days]
+# Uses temporary collections and drops them afterwards.
+
+EMPLOYEES = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+DAYS = int(sys.argv[2]) if len(sys.argv) > 2 else 180
+REGULAR, TIMESERIES = "bench_punch_events_regular", "bench_punch_events_ts"
+
+
+def synthetic_events():
+    start = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=DAYS)
+    for day in range(DAYS):
+        base = start + timedelta(days=day)
+        if base.weekday() >= 5:
+            continue
+        for n in range(EMPLOYEES):
+            employee_id = f"EMP{n:05d}"
+            t_in = base + timedelta(hours=9, minutes=random.randint(-30, 45))
+            lunch = base + timedelta(hours=13, minutes=random.randint(0, 20))
+            back = lunch + timedelta(minutes=random.randint(30, 60))
+            t_out = base + timedelta(hours=18, minutes=random.randint(-30, 60))
+            for event_type, ts in (("in", t_in), ("out", lunch), ("in", back), ("out", t_out)):
+                yield {"employee_id": employee_id, "type": event_type, "ts": ts, "source": "bench"}
+
+
+def load(collection, events, batch_size=10000):
+    for i in range(0, len(events), batch_size):
+        collection.insert_many([dict(e) for e in events[i:i + batch_size]], ordered=False)
+
+
+def time_aggregation(collection, employee_id, since, repeats=20):
+    pipeline = [
+        {"$match": {"employee_id": employee_id, "ts": {"$gte": since}}},
+        {"$group": {
+            "_id": {"$dateTrunc": {"date": "$ts", "unit": "week"}},
+            "net_ms": {"$sum": {"$cond": [
+                {"$eq": ["$type", "out"]}, {"$toLong": "$ts"}, {"$multiply": [-1, {"$toLong": "$ts"}]}
+            ]}}
+        }}
+    ]
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        list(collection.aggregate(pipeline))
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return timings[len(timings) // 2]
+
+
+def run_benchmark():
+    for name in (REGULAR, TIMESERIES):
+        db.drop_collection(name)
+    db.create_collection(TIMESERIES, timeseries={"timeField": "ts", "metaField": "employee_id", "granularity": "minutes"})
+    db[REGULAR].create_index([("employee_id", 1), ("ts", 1)])
+    db[TIMESERIES].create_index([("employee_id", 1), ("ts", 1)])
+
+    events = list(synthetic_events())
+    print(f"Synthetic events: {len(events)} ({EMPLOYEES} employees x {DAYS} days)")
+    try:
+        since = datetime.now() - timedelta(days=60)
+        for name in (REGULAR, TIMESERIES):
+            started = time.perf_counter()
+            load(db[name], events)
+            load_s = time.perf_counter() - started
+            stats = db.command("collStats", name)
+            median_ms = time_aggregation(db[name], "EMP00042", since)
+            print(f"{name}: load {load_s:.1f}s  storage {stats.get('storageSize', 0) / 1e6:.1f} MB  "
+                  f"indexes {stats.get('totalIndexSize', 0) / 1e6:.1f} MB  weekly-hours p50 {median_ms:.1f} ms")
+    finally:
+        for name in (REGULAR, TIMESERIES):
+            db.drop_collection(name)
+
+
+if __name__ == "__main__":
+    run_benchmark()
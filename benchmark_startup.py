@@ -0,0 +1,58 @@
+import json
+import subprocess
+import sys
+import time
+
+# Measures time-to-login-form: a fresh interpreter (cold imports, like a new
+# Streamlit server process) runs app.py headless with Streamlit's AppTest until
+# the login / sign-up form is on the page. Also reports which heavy libraries
+# were imported on the way, which should be none of them.
+# Usage: python benchmark_startup.py [runs]    (default 5)
+# Needs the usual .env / MONGO_URI, but not a reachable cluster.
+
+RUNS = int(sys.argv[1]) if len(sys.argv) > 1 and sys.argv[1] != "--once" else 5
+HEAVY_MODULES = ["pandas", "plotly", "requests", "streamlit_option_menu", "modules.admin_hr_dashboard", "modules.attendance"]
+
+
+def measure_once():
+    """Runs in the child process: prints one JSON line with the timing and loaded heavy modules."""
+    started = time.perf_counter()
+    from streamlit.testing.v1 import AppTest
+    framework_s = time.perf_counter() - started
+    app = AppTest.from_file("app.py", default_timeout=60)
+    app.run()
+    total_s = time.perf_counter() - started
+    has_form = any(widget.label == "Username" for widget in app.text_input)
+    print(json.dumps({
+        "total_ms": total_s * 1000,
+        "app_ms": (total_s - framework_s) * 1000,
+        "form": has_form,
+        "heavy": [name for name in HEAVY_MODULES if name in sys.modules]
+    }))
+
+
+def _median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def run_benchmark():
+    results = []
+    for _ in range(RUNS):
+        output = subprocess.run([sys.executable, __file__, "--once"], capture_output=True, text=True, check=True).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+    if not all(r["form"] for r in results):
+        print("❌ The login form did not render.")
+    print(f"Time to login form over {RUNS} cold starts: "
+          f"p50 {_median([r['total_ms'] for r in results]):.0f} ms "
+          f"(app script p50 {_median([r['app_ms'] for r in results]):.0f} ms, "
+          f"max {max(r['app_ms'] for r in results):.0f} ms)")
+    heavy = sorted({name for r in results for name in r["heavy"]})
+    print(f"Heavy modules loaded before login: {', '.join(heavy) if heavy else 'none ✅'}")
+
+
+if __name__ == "__main__":
+    if "--once" in sys.argv:
+        measure_once()
+    else:
+        run_benchmark()
@@ -0,0 +1,16 @@
+from db import all_tenants, ensure_indexes, get_tenant_database
+from modules.search import backfill_chat_messages
+from modules.tenancy import tenant_context
+
+# One-off backfill for full-text search: copies the messages of chat threads
+# (hot and archived) sent before search existed into `chat_messages`, one
+# document per message. Leave reasons and announcements need no backfill, their
+# text indexes are built by ensure_indexes(). Safe to interrupt and re-run.
+#   python build_search_index.py
+
+if __name__ == "__main__":
+    for tenant_id in all_tenants():
+        ensure_indexes(get_tenant_database(tenant_id))
+        with tenant_context(tenant_id):
+            indexed = backfill_chat_messages(progress=lambda message: print(f"[{tenant_id}] {message}"))
+        print(f"✅ [{tenant_id}] Search index built: " + ", ".join(f"{count} {name} threads" for name, count in indexed.items()))
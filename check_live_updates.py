@@ -0,0 +1,41 @@
+import time
+from datetime import datetime
+from db import chats_col, current_database
+from modules.communication import LiveUpdateHub
+from modules.tenancy import current_tenant
+
+# Smoke test for chat/announcement live updates.
+# Run against a local single-node replica set, e.g.:
+#   mongod --replSet rs0 --dbpath /tmp/rs0 &
+#   mongosh --eval "rs.initiate()"
+#   MONGO_URI="mongodb://localhost:27017/?replicaSet=rs0" python check_live_updates.py
+# Against a standalone mongod the hub falls back to polling.
+
+def check_live_updates(timeout=15):
+    hub = LiveUpdateHub(current_database())
+    hub.start()
+    time.sleep(2)
+    print(f"Listener mode: {hub.mode}")
+
+    topic = f"{current_tenant()}:chat:LIVE_TEST_B"
+    before = hub.version(topic)
+    now = datetime.now()
+    result = chats_col.insert_one({
+        "participants": ["LIVE_TEST_A", "LIVE_TEST_B"],
+        "messages": [{"sender_id": "LIVE_TEST_A", "message": "ping", "timestamp": now}],
+        "created_at": now, "last_message_at": now
+    })
+    try:
+        started = time.time()
+        while time.time() - started < timeout:
+            if hub.version(topic) > before:
+                print(f"✅ Event delivered in {time.time() - started:.2f}s")
+                return True
+            time.sleep(0.05)
+        print("❌ No event received before timeout.")
+        return False
+    finally:
+        chats_col.delete_one({"_id": result.inserted_id})
+
+if __name__ == "__main__":
+    check_live_updates()
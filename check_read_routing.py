@@ -0,0 +1,60 @@
+import time
+from datetime import datetime
+from db import ANALYTICAL, TRANSACTIONAL, ANALYTICS_MAX_STALENESS_SECONDS, current_database, read_freshness, reads, tenant_collection
+
+# Smoke test for read routing. Run against a local three-node replica set, e.g.:
+#   for i in 0 1 2; do mongod --replSet rs0 --port 2701$i --dbpath /tmp/rs$i --fork --logpath /tmp/rs$i.log; done
+#   mongosh --port 27010 --eval 'rs.initiate({_id: "rs0", members: [
+#     {_id: 0, host: "localhost:27010"}, {_id: 1, host: "localhost:27011"}, {_id: 2, host: "localhost:27012"}]})'
+#   MONGO_URI="mongodb://localhost:27010,localhost:27011,localhost:27012/?replicaSet=rs0" python check_read_routing.py
+# Transactional reads must hit the primary and see the write immediately; analytical
+# reads should be served by a secondary and catch up within the staleness bound.
+
+def _served_by(collection, query):
+    cursor = collection.find(query)
+    docs = list(cursor)
+    return docs, cursor.address
+
+
+def check_read_routing(timeout=10):
+    client = current_database().client
+    scratch = tenant_collection("read_routing_check")
+    marker = {"check": "read_routing", "at": datetime.now()}
+    scratch.insert_one(marker)
+    ok = True
+    try:
+        primary = client.primary
+        print(f"Primary: {primary}, secondaries: {sorted(client.secondaries)}")
+        print(f"Analytical maxStalenessSeconds: {ANALYTICS_MAX_STALENESS_SECONDS}")
+
+        docs, address = _served_by(reads(scratch, TRANSACTIONAL), {"_id": marker["_id"]})
+        if docs and address == primary:
+            print(f"✅ Transactional read served by the primary {address} and saw the write")
+        else:
+            print(f"❌ Transactional read served by {address}, saw write: {bool(docs)}")
+            ok = False
+
+        started = time.time()
+        while True:
+            docs, address = _served_by(reads(scratch, ANALYTICAL), {"_id": marker["_id"]})
+            if docs or time.time() - started > timeout:
+                break
+            time.sleep(0.05)
+        if address == primary and client.secondaries:
+            print(f"❌ Analytical read went to the primary {address} although secondaries are available")
+            ok = False
+        elif docs:
+            role = "secondary" if address != primary else "primary (no secondaries)"
+            print(f"✅ Analytical read served by {role} {address}, write visible after {time.time() - started:.2f}s")
+        else:
+            print(f"⚠️ Analytical read served by {address}, write not replicated within {timeout}s")
+
+        freshness = read_freshness(ANALYTICAL)
+        if freshness:
+            print(f"Freshness: member {freshness['member']}, lag {freshness['lag_seconds']:.1f}s")
+        return ok
+    finally:
+        scratch.delete_one({"_id": marker["_id"]})
+
+if __name__ == "__main__":
+    check_read_routing()
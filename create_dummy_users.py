@@ -1,5 +1,6 @@
 from db import users_col
 from auth import hash_password
+from modules.employee_search import with_search_keys
 from datetime import datetime, timedelta
 
 # List of all the dummy users with rich profile data
@@ -66,7 +67,7 @@ def setup_dummy_accounts():
         user_doc = user_data.copy()
         del user_doc["password"]
         user_doc["password_hash"] = hashed_pass
-        users_col.insert_one(user_doc)
+        users_col.insert_one(with_search_keys(user_doc))
         print(f"✅ User '{user_data['username']}' created successfully!")
     print("\nDummy account setup complete.")
 
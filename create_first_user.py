@@ -1,5 +1,6 @@
 from db import users_col
 from auth import hash_password
+from modules.employee_search import with_search_keys
 
 # --- !! CUSTOMIZE YOUR ADMIN DETAILS HERE !! ---
 username = "admin"
@@ -36,7 +37,7 @@ def create_admin_user():
     }
     
     # Insert the new user into the 'users' collection
-    users_col.insert_one(user_document)
+    users_col.insert_one(with_search_keys(user_document))
     print(f"✅ Admin user '{username}' created successfully!")
     print("You can now run 'streamlit run app.py' and log in.")
 
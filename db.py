@@ -1,8 +1,16 @@
 import os
 import sys
+import threading
+import time
+import gridfs
+from datetime import datetime, timedelta
 from pymongo import MongoClient
+from pymongo.read_preferences import Primary, SecondaryPreferred
+from pymongo.errors import OperationFailure, CollectionInvalid, PyMongoError
 from dotenv import load_dotenv
 from urllib.parse import quote_plus  # <-- Import this
+from modules.monitoring import command_listener
+from modules.tenancy import TenantCollection, current_tenant
 
 load_dotenv()
 
@@ -12,32 +20,338 @@ MONGO_PASS = os.getenv("MONGO_PASS")
 MONGO_CLUSTER = os.getenv("MONGO_CLUSTER")
 DB_NAME = "hrms_db"
 
+# --- Optional full URI override (e.g. a local replica set: mongodb://localhost:27017/?replicaSet=rs0) ---
+MONGO_URI = os.getenv("MONGO_URI")
+
 # --- Escape username and password ---
-if not all([MONGO_USER, MONGO_PASS, MONGO_CLUSTER]):
-    print("FATAL: Missing MongoDB environment variables (MONGO_USER, MONGO_PASS, MONGO_CLUSTER).")
-    sys.exit(1)
+if not MONGO_URI:
+    if not all([MONGO_USER, MONGO_PASS, MONGO_CLUSTER]):
+        print("FATAL: Missing MongoDB environment variables (MONGO_USER, MONGO_PASS, MONGO_CLUSTER).")
+        sys.exit(1)
+    MONGO_URI = f"mongodb+srv://{quote_plus(MONGO_USER)}:{quote_plus(MONGO_PASS)}@{MONGO_CLUSTER}/?retryWrites=true&w=majority"
+
+def _make_client(uri):
+    # connect=False defers SRV lookup and sockets to first use
+    return MongoClient(
+        uri,
+        maxPoolSize=int(os.getenv("MONGO_MAX_POOL_SIZE", "100")),
+        serverSelectionTimeoutMS=int(os.getenv("MONGO_TIMEOUT_MS", "5000")),
+        connect=False,
+        event_listeners=[command_listener]
+    )
+
+# Creating the client does no network I/O, so importing this module is instant and
+# the login form renders while the cluster is still being reached. The startup ping
+# and index checks run on a background thread (see _connect at the end of the file).
+db = _make_client(MONGO_URI)[DB_NAME]
+_connected = threading.Event()
+_online = False
+
+def db_online(wait=True):
+    """
+    True once the cluster answered the startup ping. If it is unreachable the app
+    runs in offline mode: punches and leave submissions are journaled locally
+    (see modules/write_buffer.py) and replayed once the database is back.
+    `wait` blocks until the background connect finished (at most the server
+    selection timeout).
+    """
+    if wait:
+        _connected.wait()
+    return _online
+
+# --- Tenant routing ---
+# Tenants share `hrms_db` by default. A tenant document in the control collection
+# `tenants` can isolate a large customer onto its own database, optionally on its
+# own cluster: {"_id": "acme", "database": "hrms_acme", "mongo_uri_env": "ACME_MONGO_URI"}
+# (the URI itself stays in the environment, never in the database).
+tenants_col = db["tenants"]
+ROUTE_CACHE_SECONDS = 60
+_routes = {}
+_dedicated_clients = {}
+_routes_lock = threading.Lock()
+
+def get_tenant_database(tenant_id):
+    """Returns the database holding a tenant's data (cached for a minute)."""
+    cached = _routes.get(tenant_id)
+    if cached and time.time() - cached[1] < ROUTE_CACHE_SECONDS:
+        return cached[0]
+    try:
+        route = tenants_col.find_one({"_id": tenant_id}, {"database": 1, "mongo_uri_env": 1}) or {}
+    except PyMongoError:
+        route = {}
+    database = db
+    if route.get("database"):
+        client = db.client
+        uri_env = route.get("mongo_uri_env")
+        if uri_env and os.getenv(uri_env):
+            with _routes_lock:
+                if uri_env not in _dedicated_clients:
+                    _dedicated_clients[uri_env] = _make_client(os.environ[uri_env])
+                client = _dedicated_clients[uri_env]
+        database = client[route["database"]]
+        if db_online():
+            ensure_indexes(database)
+    _routes[tenant_id] = (database, time.time())
+    return database
+
+def all_tenants():
+    """Every tenant id: registered tenants plus those found in the shared database."""
+    return sorted(set(tenants_col.distinct("_id")) | set(db["users"].distinct("tenant_id")))
+
+def tenant_databases():
+    """
+    Every database holding tenant data, as [(database, [tenant ids])]: the shared
+    database first (it also holds the control collections), then dedicated ones.
+    """
+    groups = {(id(db.client), db.name): (db, [])}
+    for tenant_id in all_tenants():
+        database = get_tenant_database(tenant_id)
+        groups.setdefault((id(database.client), database.name), (database, []))[1].append(tenant_id)
+    return list(groups.values())
 
-MONGO_URI = f"mongodb+srv://{quote_plus(MONGO_USER)}:{quote_plus(MONGO_PASS)}@{MONGO_CLUSTER}/?retryWrites=true&w=majority"
+def current_database():
+    """The database of the tenant the caller is acting for."""
+    return get_tenant_database(current_tenant())
 
-def get_db_connection():
+def start_session():
+    """Client session on the current tenant's cluster (for transactions)."""
+    return current_database().client.start_session()
+
+# --- Read routing ---
+# Reads are tagged by workload. TRANSACTIONAL reads (punches, leaves, anything a user
+# acts on right after writing) always go to the primary, so users read their own
+# writes. ANALYTICAL reads (dashboards, reports) go to a secondary that is at most
+# ANALYTICS_MAX_STALENESS_SECONDS behind, falling back to the primary when none is,
+# so heavy aggregations don't compete with punch writes.
+TRANSACTIONAL = "transactional"
+ANALYTICAL = "analytical"
+# MongoDB rejects maxStalenessSeconds below 90 (heartbeat + idle write period)
+ANALYTICS_MAX_STALENESS_SECONDS = max(90, int(os.getenv("ANALYTICS_MAX_STALENESS_SECONDS", "120")))
+READ_PREFERENCES = {
+    TRANSACTIONAL: Primary(),
+    ANALYTICAL: SecondaryPreferred(max_staleness=ANALYTICS_MAX_STALENESS_SECONDS)
+}
+
+def reads(collection, workload=TRANSACTIONAL):
+    """The handle to read `collection` with for a workload (TRANSACTIONAL or ANALYTICAL)."""
+    return collection.with_read_preference(READ_PREFERENCES[workload])
+
+FRESHNESS_CACHE_SECONDS = 10
+_freshness = {}
+
+def read_freshness(workload=ANALYTICAL):
+    """
+    How current the data served for a workload is, for the "data as of" captions:
+    {"member": host, "secondary": bool, "lag_seconds": float, "as_of": datetime}.
+    The lag is the primary's last write minus the serving member's last applied write.
+    """
+    database = current_database()
+    key = (id(database.client), workload)
+    cached = _freshness.get(key)
+    if cached and time.time() - cached[1] < FRESHNESS_CACHE_SECONDS:
+        return cached[0]
+    admin = database.client.admin
     try:
-        # --- Use the constructed URI ---
-        client = MongoClient(MONGO_URI)
-        client.admin.command('ping')
+        served = admin.command("hello", read_preference=READ_PREFERENCES[workload])
+        primary = served if served.get("isWritablePrimary") else admin.command("hello", read_preference=Primary())
+    except PyMongoError:
+        return None
+    served_at = served.get("lastWrite", {}).get("lastWriteDate")
+    primary_at = primary.get("lastWrite", {}).get("lastWriteDate")
+    lag = max(0.0, (primary_at - served_at).total_seconds()) if served_at and primary_at else 0.0
+    freshness = {
+        "member": served.get("me", "standalone"),
+        "secondary": bool(served.get("secondary")),
+        "lag_seconds": lag,
+        "as_of": datetime.now() - timedelta(seconds=lag)
+    }
+    _freshness[key] = (freshness, time.time())
+    return freshness
+
+def tenant_collection(name):
+    """Tenant-scoped handle for a collection name (e.g. journaled writes). Reads use the primary."""
+    return TenantCollection(name, get_tenant_database, read_preference=READ_PREFERENCES[TRANSACTIONAL])
+
+# --- Tenant-scoped collections: every query is filtered on tenant_id ---
+users_col = tenant_collection("users")
+attendance_col = tenant_collection("attendance")
+leaves_col = tenant_collection("leaves")
+announcements_col = tenant_collection("announcements")
+chats_col = tenant_collection("chats")
+leave_ledger_col = tenant_collection("leave_ledger")
+leave_balances_col = tenant_collection("leave_balances")
+work_calendars_col = tenant_collection("work_calendars")
+audit_log_col = tenant_collection("audit_log")
+schema_migrations_col = tenant_collection("schema_migrations")
+# Time-series: the tenant lives in the metaField ({tenant_id, employee_id}), so buckets
+# and chunks never mix tenants that reuse employee IDs (see modules/punch_events.py)
+punch_events_col = TenantCollection(
+    "punch_events", get_tenant_database, read_preference=READ_PREFERENCES[TRANSACTIONAL], tenant_field="meta.tenant_id"
+)
+chat_messages_col = tenant_collection("chat_messages")  # One document per message, for full-text search
+
+# --- Cold tier: records moved out of the hot collections by the archival job ---
+attendance_archive_col = tenant_collection("attendance_archive")
+leaves_archive_col = tenant_collection("leaves_archive")
+chats_archive_col = tenant_collection("chats_archive")
+archive_rollups_col = tenant_collection("archive_rollups")
+
+# --- Control collections (not tenant-scoped): a token identifies its tenant ---
+api_tokens_col = db["api_tokens"]
+
+# --- File storage for leave attachments (GridFS, streamed in chunks) ---
+def get_attachments_fs():
+    """GridFS bucket in the current tenant's database (files carry metadata.tenant_id)."""
+    return gridfs.GridFSBucket(current_database(), bucket_name="leave_attachments")
+
+# --- Shard keys for a sharded cluster (applied by shard_collections.py) ---
+# Per-employee data is sharded on (tenant_id, employee_id): a tenant's queries target
+# its own chunks, and large tenants still spread over several shards. Collections
+# with a tenant-wide unique key are sharded on tenant_id alone (a unique index must
+# start with the shard key). A shard key cannot be an array, so chat threads are
+# spread by a hash of their _id within the tenant. Time-series collections can only
+# use meta/time fields.
+SHARD_KEYS = {
+    "users": {"tenant_id": 1, "employee_id": 1},
+    "attendance": {"tenant_id": 1, "employee_id": 1},
+    "leaves": {"tenant_id": 1, "employee_id": 1},
+    "leave_balances": {"tenant_id": 1, "employee_id": 1},
+    "leave_ledger": {"tenant_id": 1},
+    "work_calendars": {"tenant_id": 1},
+    "chats": {"tenant_id": 1, "_id": "hashed"},
+    "chat_messages": {"tenant_id": 1, "thread_id": 1},
+    "audit_log": {"tenant_id": 1, "actor_id": 1},
+    "punch_events": {"meta.tenant_id": 1, "meta.employee_id": 1, "ts": 1},
+    "attendance_archive": {"tenant_id": 1, "employee_id": 1},
+    "leaves_archive": {"tenant_id": 1, "employee_id": 1},
+    "archive_rollups": {"tenant_id": 1, "employee_id": 1},
+    "leave_attachments.chunks": {"files_id": 1, "n": 1},
+}
+
+_indexed_databases = set()
+PUNCH_EVENTS_TIMESERIES = {"timeField": "ts", "metaField": "meta", "granularity": "minutes"}
+
+def _tenant_index(collection, keys, **options):
+    """Creates a tenant-prefixed index and drops the unprefixed one it replaces."""
+    collection.create_index([("tenant_id", 1)] + keys, **options)
+    legacy_name = "_".join(f"{field}_{direction}" for field, direction in keys)
+    try:
+        collection.drop_index(legacy_name)
+    except OperationFailure:
+        pass
+
+def ensure_indexes(database=None):
+    """Creates the indexes the app relies on in a (tenant) database. Safe to call repeatedly."""
+    database = db if database is None else database
+    key = (id(database.client), database.name)
+    if key in _indexed_databases:
+        return
+    _indexed_databases.add(key)
+    # Unique, so two concurrent uploads of the same content cannot both be stored
+    files = database["leave_attachments.files"]
+    if not files.index_information().get("metadata.tenant_id_1_metadata.sha256_1", {}).get("unique"):
+        for legacy_name in ("metadata.sha256_1", "metadata.tenant_id_1_metadata.sha256_1"):
+            try:
+                files.drop_index(legacy_name)
+            except OperationFailure:
+                pass
+    files.create_index(
+        [("metadata.tenant_id", 1), ("metadata.sha256", 1)],
+        unique=True, partialFilterExpression={"metadata.sha256": {"$exists": True}}
+    )
+
+    # --- Leave ledger: one running balance document per employee and leave type ---
+    _tenant_index(database["leave_balances"], [("employee_id", 1), ("leave_type", 1)], unique=True)
+    _tenant_index(database["leave_ledger"], [("employee_id", 1), ("created_at", -1)])
+    # sparse would still index entries without a ref (they have tenant_id), so filter explicitly
+    _tenant_index(database["leave_ledger"], [("ref", 1)], unique=True, partialFilterExpression={"ref": {"$exists": True}})
+    _tenant_index(database["work_calendars"], [("location", 1)], unique=True)
+    _tenant_index(database["chats"], [("last_message_at", 1)])
+    # --- Chat inbox: a participant's threads by last activity ---
+    _tenant_index(database["chats"], [("participants", 1), ("last_message_at", -1)])
+    _tenant_index(database["announcements"], [("is_active", 1), ("posted_at", -1)])
+    # --- Full-text search (modules/search.py): tenant_id is the text index's equality prefix ---
+    _tenant_index(database["chat_messages"], [("message", "text")])
+    _tenant_index(database["chat_messages"], [("thread_id", 1)])
+    _tenant_index(database["leaves"], [("reason", "text")])
+    _tenant_index(database["announcements"], [("message", "text")])
+    api_tokens_col.create_index("token_hash", unique=True)
+    api_tokens_col.create_index("expires_at", expireAfterSeconds=0)
+    _tenant_index(database["schema_migrations"], [("migration", 1)], unique=True)
+
+    # --- Audit log: filtered by actor / entity / action, newest first; TTL handles retention ---
+    _tenant_index(database["audit_log"], [("actor_id", 1), ("at", -1)])
+    _tenant_index(database["audit_log"], [("entity_type", 1), ("entity_id", 1), ("at", -1)])
+    _tenant_index(database["audit_log"], [("action", 1), ("at", -1)])
+    database["audit_log"].create_index("at", expireAfterSeconds=int(os.getenv("AUDIT_RETENTION_DAYS", "365")) * 86400)
+
+    # --- Raw punch events: time-series collection bucketed per tenant and employee ---
+    info = next(database.list_collections(filter={"name": "punch_events"}), None)
+    if info is None:
+        try:
+            database.create_collection("punch_events", timeseries=PUNCH_EVENTS_TIMESERIES)
+        except CollectionInvalid:
+            pass
+    elif info.get("options", {}).get("timeseries", {}).get("metaField") != "meta":
+        print(f"WARNING: {database.name}.punch_events uses the old metaField; run migrate_punch_events_meta.py")
+    database["punch_events"].create_index([("meta.tenant_id", 1), ("meta.employee_id", 1), ("ts", 1)])
+
+    # --- Typeahead employee search (prefix regexes on lowercased tokens) ---
+    _tenant_index(database["users"], [("search_keys", 1)])
+    # --- User lookups and the admin grid's keyset-paginated sort columns (user_admin.SORT_FIELDS) ---
+    for field in ("full_name", "employee_id", "username", "role", "department", "job_title"):
+        _tenant_index(database["users"], [(field, 1), ("_id", 1)])
+        try:
+            database["users"].drop_index(f"tenant_id_1_{field}_1")  # Prefix of the new index
+        except OperationFailure:
+            pass
+
+    # --- Archive tier: compressed with zstd, indexed for the history views ---
+    existing = set(database.list_collection_names())
+    for name in ("attendance_archive", "leaves_archive", "chats_archive"):
+        if name not in existing:
+            try:
+                database.create_collection(
+                    name,
+                    storageEngine={"wiredTiger": {"configString": "block_compressor=zstd"}}
+                )
+            except (CollectionInvalid, OperationFailure):
+                pass
+    _tenant_index(database["attendance_archive"], [("employee_id", 1), ("date", -1)])
+    _tenant_index(database["leaves_archive"], [("employee_id", 1), ("applied_at", -1)])
+    _tenant_index(database["chats_archive"], [("participants", 1)])
+    try:
+        _tenant_index(database["archive_rollups"], [("employee_id", 1)], unique=True)
+    except OperationFailure as e:
+        print(f"⚠️ Could not create unique rollup index (run migrate_tenants.py first?): {e}")
+    _tenant_index(database["attendance"], [("date", 1)])
+    _tenant_index(database["leaves"], [("status", 1), ("end_date", 1)])
+    _tenant_index(database["leaves"], [("start_date", 1), ("end_date", 1)])
+    _tenant_index(database["leaves"], [("employee_id", 1), ("applied_at", -1)])
+    # --- Is an attachment still used (deduplicated files are only deleted when not) ---
+    for name in ("leaves", "leaves_archive"):
+        _tenant_index(database[name], [("attachment.file_id", 1)], partialFilterExpression={"attachment.file_id": {"$exists": True}})
+
+    # --- One attendance record per employee and day (punch-in upserts rely on it) ---
+    try:
+        _tenant_index(database["attendance"], [("employee_id", 1), ("date", 1)], unique=True)
+    except OperationFailure as e:
+        print(f"⚠️ Could not create unique attendance index (duplicate records?): {e}")
+
+def _connect():
+    global _online
+    try:
+        db.client.admin.command('ping')
+        _online = True
         print("✅ Successfully connected to MongoDB!")
-        return client[DB_NAME]
     except Exception as e:
-        print(f"❌ Could not connect to MongoDB. Error: {e}")
-        return None
+        print(f"⚠️ Could not connect to MongoDB, starting in offline mode. Error: {e}")
+    finally:
+        _connected.set()
+    if _online:
+        try:
+            ensure_indexes()
+        except PyMongoError as e:
+            print(f"⚠️ Could not verify indexes: {e}")
 
-db = get_db_connection()
-
-if db is not None:
-    users_col = db["users"]
-    attendance_col = db["attendance"]
-    leaves_col = db["leaves"]
-    announcements_col = db["announcements"]
-    chats_col = db["chats"]
-else:
-    print("FATAL: Database connection failed. The application cannot start.")
-    sys.exit(1)
\ No newline at end of file
+threading.Thread(target=_connect, name="db-connect", daemon=True).start()
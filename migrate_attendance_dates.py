@@ -0,0 +1,21 @@
+import argparse
+from db import all_tenants
+from modules.attendance_schema import migrate_attendance_dates
+from modules.tenancy import tenant_context
+
+# Converts attendance `date` strings ("%Y-%m-%d") to native dates (schema v2).
+# Safe to run while the app is online and to interrupt: it resumes from its checkpoint.
+#   python migrate_attendance_dates.py --batch-size 1000 --max-rate 2000
+# Runs for every tenant, each in its own (shared or dedicated) database; the
+# migration status is kept per tenant.
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Migrate attendance dates to native BSON dates")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--max-rate", type=int, default=2000, help="Maximum documents per second (0 = unthrottled)")
+    args = parser.parse_args()
+    for tenant_id in all_tenants():
+        with tenant_context(tenant_id):
+            migrate_attendance_dates(
+                args.batch_size, args.max_rate, progress=lambda message: print(f"[{tenant_id}] {message}")
+            )
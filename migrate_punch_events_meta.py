@@ -0,0 +1,62 @@
+from db import PUNCH_EVENTS_TIMESERIES, tenant_databases
+from modules.tenancy import DEFAULT_TENANT
+
+# One-off migration of `punch_events` to the tenant-aware metaField. The old
+# collection used metaField "employee_id", so tenants reusing employee IDs shared
+# buckets and chunks. A time-series metaField cannot be changed in place: the
+# events are copied to `punch_events_pre_meta`, the collection is recreated with
+# metaField "meta" = {tenant_id, employee_id} and the events are copied back.
+# Stop the app and api.py first (or let punches queue in the local journal).
+# Re-running after an interruption is safe: events are re-copied with their _id
+# and readers count each _id once. A finished copy is renamed to
+# `punch_events_pre_meta_done`; drop it once the app looks right.
+#   python migrate_punch_events_meta.py
+
+BATCH_SIZE = 5000
+BACKUP = "punch_events_pre_meta"
+DONE = f"{BACKUP}_done"
+
+
+def _metafield(database):
+    info = next(database.list_collections(filter={"name": "punch_events"}), None)
+    return info and info.get("options", {}).get("timeseries", {}).get("metaField")
+
+
+def _converted(doc):
+    event = {k: v for k, v in doc.items() if k not in ("employee_id", "tenant_id")}
+    event["meta"] = {"tenant_id": doc.get("tenant_id") or DEFAULT_TENANT, "employee_id": doc.get("employee_id")}
+    return event
+
+
+def migrate(database):
+    names = set(database.list_collection_names())
+    if _metafield(database) == "meta" and BACKUP not in names:
+        print(f"✅ {database.name}: punch_events already uses the tenant metaField")
+        return
+    if _metafield(database) not in (None, "meta"):
+        database["punch_events"].aggregate([{"$out": BACKUP}])
+        database["punch_events"].drop()
+        print(f"{database.name}: {database[BACKUP].estimated_document_count()} events copied to {BACKUP}")
+    if "punch_events" not in database.list_collection_names():
+        database.create_collection("punch_events", timeseries=PUNCH_EVENTS_TIMESERIES)
+        database["punch_events"].create_index([("meta.tenant_id", 1), ("meta.employee_id", 1), ("ts", 1)])
+
+    copied = 0
+    batch = []
+    for doc in database[BACKUP].find(sort=[("_id", 1)], batch_size=BATCH_SIZE):
+        batch.append(_converted(doc))
+        if len(batch) >= BATCH_SIZE:
+            database["punch_events"].insert_many(batch, ordered=False)
+            copied += len(batch)
+            batch = []
+            print(f"{database.name}: {copied} events migrated")
+    if batch:
+        database["punch_events"].insert_many(batch, ordered=False)
+        copied += len(batch)
+    database[BACKUP].rename(DONE, dropTarget=True)
+    print(f"✅ {database.name}: {copied} events migrated. Drop {DONE} once the app looks right.")
+
+
+if __name__ == "__main__":
+    for database, _ in tenant_databases():
+        migrate(database)
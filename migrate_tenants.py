@@ -0,0 +1,52 @@
+import argparse
+from pymongo.errors import OperationFailure
+from db import db
+from modules.tenancy import DEFAULT_TENANT, TENANT_FIELD
+
+# One-off migration to multi-tenancy: stamps every document written before tenants
+# existed with a tenant id, so the tenant-scoped collections keep seeing it.
+# Idempotent; only documents without `tenant_id` are touched.
+#   python migrate_tenants.py [--tenant default]
+
+SCOPED_COLLECTIONS = [
+    "users", "attendance", "leaves", "announcements", "chats", "leave_ledger",
+    "leave_balances", "work_calendars", "audit_log", "schema_migrations",
+    "attendance_archive", "leaves_archive", "chats_archive", "archive_rollups",
+    "punch_events", "api_tokens"
+]
+
+
+def migrate(tenant_id):
+    missing = {TENANT_FIELD: {"$exists": False}}
+    for name in SCOPED_COLLECTIONS:
+        try:
+            result = db[name].update_many(missing, {"$set": {TENANT_FIELD: tenant_id}})
+            print(f"{name}: {result.modified_count} documents tagged")
+        except OperationFailure as e:
+            # Time-series collections accept updates on measurement fields from MongoDB 7.0
+            print(f"⚠️ {name}: could not tag documents ({e}). Upgrade to MongoDB 7.0+ or re-import this collection.")
+
+    # Migration state used the migration name as _id; it is now a per-tenant `migration` field
+    result = db["schema_migrations"].update_many(
+        {"migration": {"$exists": False}}, [{"$set": {"migration": "$_id"}}]
+    )
+    print(f"schema_migrations: {result.modified_count} documents keyed by migration")
+
+    # Rollups were keyed by employee _id; they now carry employee_id next to tenant_id
+    result = db["archive_rollups"].update_many(
+        {"employee_id": {"$exists": False}}, [{"$set": {"employee_id": "$_id"}}]
+    )
+    print(f"archive_rollups: {result.modified_count} documents keyed by employee_id")
+
+    result = db["leave_attachments.files"].update_many(
+        {"metadata.tenant_id": {"$exists": False}}, {"$set": {"metadata.tenant_id": tenant_id}}
+    )
+    print(f"leave_attachments.files: {result.modified_count} files tagged")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tag pre-tenancy documents with a tenant id")
+    parser.add_argument("--tenant", default=DEFAULT_TENANT)
+    args = parser.parse_args()
+    migrate(args.tenant)
+    print(f"✅ Existing data now belongs to tenant '{args.tenant}'.")
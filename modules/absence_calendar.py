@@ -0,0 +1,154 @@
+import os
+from datetime import datetime, time, timedelta
+from db import users_col, leaves_col, attendance_col
+from modules import work_calendar
+from modules.attendance_schema import date_filter
+
+# Team absence calendar. Leave intervals overlapping a window are fetched with one
+# indexed range query on (start_date, end_date), merged per employee (so overlapping
+# leaves and absent attendance days count once) and turned into per-day absence
+# counts with a single sweep over the sorted interval boundaries.
+
+COVERAGE_THRESHOLD = float(os.getenv("COVERAGE_THRESHOLD", "0.7"))
+ABSENT_LEAVE_STATUSES = ["approved", "pending"]
+
+
+def _to_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, str):
+        return datetime.strptime(value, "%Y-%m-%d").date()
+    return value
+
+
+def _midnight(day):
+    return datetime.combine(day, time.min)
+
+
+# --- Interval fetch ---
+def fetch_intervals(employee_ids, start, end):
+    """
+    Returns absence intervals [{employee_id, start, end, kind}] overlapping [start, end]:
+    approved/pending leaves plus days marked absent in attendance.
+    """
+    employee_ids = list(employee_ids)
+    intervals = [
+        {"employee_id": leave["employee_id"], "start": _to_date(leave["start_date"]),
+         "end": _to_date(leave["end_date"]), "kind": leave["status"]}
+        for leave in leaves_col.find(
+            {"start_date": {"$lte": _midnight(end)}, "end_date": {"$gte": _midnight(start)},
+             "status": {"$in": ABSENT_LEAVE_STATUSES}, "employee_id": {"$in": employee_ids}},
+            {"employee_id": 1, "start_date": 1, "end_date": 1, "status": 1}
+        )
+    ]
+    for record in attendance_col.find(
+        {"employee_id": {"$in": employee_ids}, "status": "absent",
+         **date_filter(gte=start, lt=end + timedelta(days=1))},
+        {"employee_id": 1, "date": 1}
+    ):
+        day = _to_date(record["date"])
+        intervals.append({"employee_id": record["employee_id"], "start": day, "end": day, "kind": "absent"})
+    return intervals
+
+
+def merge_intervals(intervals):
+    """Unions each employee's overlapping or adjacent intervals. Returns [(employee_id, start, end)]."""
+    merged = []
+    for interval in sorted(intervals, key=lambda i: (i["employee_id"], i["start"])):
+        last = merged[-1] if merged else None
+        if last and last[0] == interval["employee_id"] and interval["start"] <= last[2] + timedelta(days=1):
+            merged[-1] = (last[0], last[1], max(last[2], interval["end"]))
+        else:
+            merged.append((interval["employee_id"], interval["start"], interval["end"]))
+    return merged
+
+
+def sweep_daily_counts(merged, start, end):
+    """Number of people out on each day of [start, end], from one pass over the sorted boundaries."""
+    events = []
+    for _, first, last in merged:
+        first, last = max(first, start), min(last, end)
+        if first <= last:
+            events.append((first, 1))
+            events.append((last + timedelta(days=1), -1))
+    events.sort()
+
+    counts = {}
+    out, index = 0, 0
+    day = start
+    while day <= end:
+        while index < len(events) and events[index][0] <= day:
+            out += events[index][1]
+            index += 1
+        counts[day] = out
+        day += timedelta(days=1)
+    return counts
+
+
+def who_is_out(merged, day):
+    """Employee ids absent on a given day."""
+    return [employee_id for employee_id, first, last in merged if first <= day <= last]
+
+
+# --- Team view ---
+def team_members(department):
+    """{employee_id: full_name} for a department ("All" for the whole company)."""
+    query = {"role": {"$ne": "admin"}, "employee_id": {"$exists": True}}
+    if department != "All":
+        query["department"] = department
+    return {u["employee_id"]: u.get("full_name", "Unknown") for u in users_col.find(query, {"employee_id": 1, "full_name": 1})}
+
+
+def team_absence(department, start, end, exclude_employee_id=None):
+    """
+    Returns (members, merged intervals, {day: absent count}) for a department and window.
+    `exclude_employee_id` leaves one person out (the applicant of a new leave).
+    """
+    members = team_members(department)
+    members.pop(exclude_employee_id, None)
+    merged = merge_intervals(fetch_intervals(members.keys(), start, end))
+    return members, merged, sweep_daily_counts(merged, start, end)
+
+
+# --- Checks for a new leave ---
+def _half_day_slots(start, end, start_day_type, end_day_type):
+    """Maps a leave to an inclusive range of half-day slots so half days on the same date don't clash."""
+    first = _to_date(start).toordinal() * 2 + (1 if start_day_type.lower() == "second half" else 0)
+    last = _to_date(end).toordinal() * 2 + (0 if end_day_type.lower() == "first half" else 1)
+    return first, last
+
+
+def find_overlapping_leave(employee_id, start, end, start_day_type="full day", end_day_type="full day"):
+    """Returns the employee's pending/approved leave that overlaps the new one, or None."""
+    new_first, new_last = _half_day_slots(start, end, start_day_type, end_day_type)
+    for leave in leaves_col.find({
+        "employee_id": employee_id, "status": {"$in": ABSENT_LEAVE_STATUSES},
+        "start_date": {"$lte": _midnight(_to_date(end))}, "end_date": {"$gte": _midnight(_to_date(start))}
+    }):
+        first, last = _half_day_slots(
+            leave["start_date"], leave["end_date"],
+            leave.get("start_day_type", "full day"), leave.get("end_day_type", "full day")
+        )
+        if first <= new_last and new_first <= last:
+            return leave
+    return None
+
+
+def coverage_shortfalls(employee_id, start, end, threshold=COVERAGE_THRESHOLD):
+    """
+    Working days in [start, end] on which the applicant's department would drop below
+    `threshold` of its headcount if the leave were granted. Returns [(day, coverage)].
+    """
+    start, end = _to_date(start), _to_date(end)
+    user = users_col.find_one({"employee_id": employee_id}, {"department": 1})
+    if not user or not user.get("department"):
+        return []
+    members, _, counts = team_absence(user["department"], start, end, exclude_employee_id=employee_id)
+    headcount = len(members) + 1
+    location = work_calendar.get_user_location(employee_id)
+    shortfalls = []
+    for day, out in counts.items():
+        coverage = (headcount - out - 1) / headcount
+        if coverage < threshold and work_calendar.is_working_day(day, location):
+            shortfalls.append((day, coverage))
+    return shortfalls
@@ -2,28 +2,36 @@ import streamlit as st
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
-from db import users_col, leaves_col, attendance_col
-from modules import communication
+from db import ANALYTICAL, users_col, leaves_col, attendance_col, read_freshness, reads
+from modules import archive, audit, backup, employee_search, user_admin, communication, leave_ledger, work_calendar, punch_queue, write_buffer, monitoring
 from auth import hash_password
 from datetime import datetime, timedelta
 from bson.objectid import ObjectId
+from modules.attendance_schema import date_filter
+from modules.analytics_loader import aggregate_frame
 import calendar
 
 # --- Helper Function for Calendar Heatmap ---
 def get_attendance_heatmap_data():
     """Aggregates attendance data for a calendar heatmap."""
     start_date = datetime.now() - timedelta(days=180)
-    attendance_data = list(attendance_col.find(
-        {"punch_in": {"$gte": start_date}, "status": "present"},
-        {"date": 1}
-    ))
+    # Counted per day on the server; only one row per day comes back, as typed columns
+    df = aggregate_frame(
+        reads(attendance_col, ANALYTICAL),
+        [
+            {"$match": {**date_filter(gte=start_date), "status": "present"}},
+            {"$group": {"_id": "$date", "count": {"$sum": 1}}},
+            {"$set": {"date": "$_id"}}
+        ],
+        {"date": datetime, "count": int}
+    )
     
-    if not attendance_data:
+    if df.empty:
         return pd.DataFrame(columns=['date', 'count'])
 
-    df = pd.DataFrame(attendance_data)
-    df['date'] = pd.to_datetime(df['date']).dt.normalize()
-    daily_counts = df.groupby(df['date']).size().reset_index(name='count')
+    df['date'] = df['date'].astype('datetime64[ns]').dt.normalize()
+    # Legacy string dates and native dates for the same day are merged here
+    daily_counts = df.groupby(df['date'])['count'].sum().reset_index()
     return daily_counts
 
 def create_calendar_heatmap(df):
@@ -61,7 +69,167 @@ def create_calendar_heatmap(df):
     )
     return fig
 
+# --- Admin: Paginated User Grid (re-runs on its own) ---
+@st.fragment
+@monitoring.track_page
+def show_user_management_grid(current_employee_id):
+    """
+    One page of users in an editable grid. Role, department and title edits are staged
+    in the grid and saved together; deletes also remove the users' related records.
+    """
+    f1, f2, f3, f4 = st.columns([3, 2, 2, 1])
+    search = f1.text_input("🔍 Search", key="users_grid_search", placeholder="Name, username, ID or department")
+    roles = f2.multiselect("Role", user_admin.ROLES, key="users_grid_roles")
+    department = f3.selectbox("Department", ["All"] + sorted(d for d in users_col.distinct("department") if d), key="users_grid_department")
+    page_size = f4.selectbox("Rows", user_admin.PAGE_SIZES, key="users_grid_page_size")
+
+    s1, s2 = st.columns([2, 1])
+    sort_field = s1.selectbox("Sort by", user_admin.SORT_FIELDS, key="users_grid_sort")
+    ascending = s2.radio("Order", ["Ascending", "Descending"], horizontal=True, key="users_grid_order") == "Ascending"
+
+    # Keyset pagination: one cursor per page visited; a filter change starts at page 1
+    filters = (search, tuple(roles), department, sort_field, ascending, page_size)
+    if st.session_state.get("users_grid_filters") != filters:
+        st.session_state.users_grid_filters = filters
+        st.session_state.users_grid_cursors = [None]
+    cursors = st.session_state.setdefault("users_grid_cursors", [None])
+
+    rows, total = user_admin.list_users(search, roles, department, sort_field, ascending, cursors[-1], page_size)
+    if not rows and len(cursors) > 1:
+        # The last page emptied (e.g. its users were deleted): step back
+        cursors.pop()
+        rows, total = user_admin.list_users(search, roles, department, sort_field, ascending, cursors[-1], page_size)
+    page = len(cursors)
+    pages = max(1, -(-total // page_size))
+
+    if "users_grid_result" in st.session_state:
+        st.success(st.session_state.pop("users_grid_result"))
+    if not rows:
+        st.info("No users match these filters.")
+        return
+
+    df = pd.DataFrame(rows).reindex(columns=user_admin.GRID_COLUMNS).fillna("")
+    df.insert(0, "Delete", False)
+    # A new key after every save/delete so stale edits never apply to a different page of rows
+    version = st.session_state.get("users_grid_version", 0)
+    edited = st.data_editor(
+        df, hide_index=True, use_container_width=True, key=f"users_grid_{page}_{hash(filters)}_{version}",
+        column_config={
+            "Delete": st.column_config.CheckboxColumn(required=True),
+            "role": st.column_config.SelectboxColumn("role", options=user_admin.ROLES, required=True)
+        },
+        disabled=["employee_id", "full_name", "username", "email"]
+    )
+
+    original = df.set_index("employee_id")
+    changes = {}
+    for row in edited.to_dict("records"):
+        before = original.loc[row["employee_id"]].to_dict()
+        if any(row[f] != before[f] for f in user_admin.EDITABLE_FIELDS):
+            changes[row["employee_id"]] = {"before": dict(before, employee_id=row["employee_id"]), "after": row}
+    to_delete = edited.loc[edited["Delete"], "employee_id"].tolist()
+
+    st.caption(f"{total} users · {len(changes)} staged edit(s) · {len(to_delete)} marked for deletion")
+    b1, b2 = st.columns(2)
+    if b1.button(f"💾 Save {len(changes)} change(s)", disabled=not changes, width='stretch'):
+        updated = user_admin.apply_user_edits(changes, current_employee_id)
+        st.session_state.users_grid_result = f"Updated {updated} user(s)."
+        st.session_state.users_grid_version = version + 1
+        st.rerun(scope="fragment")
+    if to_delete:
+        if current_employee_id in to_delete:
+            st.warning("Your own account will be skipped.")
+        confirm = b2.checkbox(f"Confirm deleting {len(to_delete)} user(s) and all their records", key="users_grid_confirm")
+        if b2.button("🗑️ Delete selected", type="primary", disabled=not confirm, width='stretch'):
+            deleted = user_admin.delete_users(to_delete, current_employee_id)
+            st.session_state.users_grid_result = f"Deleted {deleted.get(users_col.name, 0)} user(s) and their related records."
+            st.session_state.users_grid_version = version + 1
+            st.rerun(scope="fragment")
+
+    p1, p2, p3 = st.columns([1, 2, 1])
+    if p1.button("⬅️ Previous", disabled=page == 1, key="users_grid_prev"):
+        cursors.pop()
+        st.rerun(scope="fragment")
+    p2.caption(f"Page {page} of {pages}")
+    if p3.button("Next ➡️", disabled=page >= pages or len(rows) < page_size, key="users_grid_next"):
+        cursors.append(user_admin.page_cursor(rows[-1], sort_field))
+        st.rerun(scope="fragment")
+
+# --- Admin: Database Backup (runs on a background thread; progress refreshes on demand) ---
+@st.fragment
+def show_backup_panel():
+    """Starts backups in the background and shows progress and recent runs."""
+    with st.expander("💾 Database Backup", expanded=backup.job_status["running"]):
+        b1, b2 = st.columns(2)
+        if b1.button("Run Full Backup", width='stretch', disabled=backup.job_status["running"]):
+            if backup.start_background_backup(incremental=False):
+                audit.record(st.session_state.user_info['employee_id'], "backup.start", "database", "full")
+        if b2.button("Run Incremental Backup", width='stretch', disabled=backup.job_status["running"]):
+            if backup.start_background_backup(incremental=True):
+                audit.record(st.session_state.user_info['employee_id'], "backup.start", "database", "incremental")
+        if backup.job_status["message"]:
+            st.caption(("⏳ " if backup.job_status["running"] else "") + backup.job_status["message"])
+        if backup.job_status["running"]:
+            st.button("🔄 Refresh progress", key="backup_refresh")
+
+        runs = backup.list_runs()[:10]
+        if runs:
+            st.dataframe(pd.DataFrame([{
+                "Run": m["run_id"], "Type": m["type"], "Documents": m.get("total_docs"),
+                "Size (MB)": round(m.get("total_bytes", 0) / 1024 / 1024, 2),
+                "Seconds": m.get("seconds"), "Docs/s": m.get("docs_per_second")
+            } for m in runs]), use_container_width=True, hide_index=True)
+            st.caption("Restore with: `python backup_db.py restore <run_id> [--drop]`")
+
+# --- Admin: Audit Log Viewer (filters and pages re-run only this section) ---
+@st.fragment
+@monitoring.track_page
+def show_audit_log_viewer():
+    """Filtered, keyset-paginated view of the audit log."""
+    st.caption(f"Events are kept for {audit.RETENTION_DAYS} days.")
+    f1, f2, f3, f4 = st.columns(4)
+    actor_id = f1.text_input("Actor (Employee ID)", key="audit_actor").strip()
+    action = f2.selectbox("Action", ["All"] + audit.distinct_actions(), key="audit_action")
+    entity_id = f3.text_input("Entity ID", key="audit_entity").strip()
+    date_range = f4.date_input("Date Range", value=(), key="audit_dates")
+
+    filters = {
+        "actor_id": actor_id or None,
+        "action": None if action == "All" else action,
+        "entity_id": entity_id or None
+    }
+    if len(date_range) == 2:
+        # The picked days are local; `at` is stamped in UTC
+        filters["start"] = audit.to_utc(datetime.combine(date_range[0], datetime.min.time()))
+        filters["end"] = audit.to_utc(datetime.combine(date_range[1], datetime.min.time()) + timedelta(days=1))
+
+    # Reset to the first page whenever the filters change
+    if st.session_state.get("audit_filters") != filters:
+        st.session_state.audit_filters = filters
+        st.session_state.audit_cursors = [None]
+    cursors = st.session_state.audit_cursors
+
+    events = audit.find_events(before=cursors[-1], **filters)
+    if not events:
+        st.info("No audit events match these filters.")
+    else:
+        df = pd.DataFrame([{
+            "Time": audit.to_local(e["at"]).strftime("%Y-%m-%d %H:%M:%S"), "Actor": e["actor_id"], "Action": e["action"],
+            "Entity": f"{e['entity_type']}:{e['entity_id']}", "Details": str(e.get("details") or "")
+        } for e in events])
+        st.dataframe(df, use_container_width=True, hide_index=True)
+
+    p1, p2, p3 = st.columns([1, 2, 1])
+    if p1.button("⬅️ Newer", disabled=len(cursors) == 1, key="audit_prev"):
+        cursors.pop()
+        st.rerun(scope="fragment")
+    p2.caption(f"Page {len(cursors)}")
+    if p3.button("Older ➡️", disabled=len(events) < audit.PAGE_SIZE, key="audit_next"):
+        cursors.append((events[-1]["at"], events[-1]["_id"]))
+        st.rerun(scope="fragment")
+
 # --- Main Dashboard Function ---
+@monitoring.track_page
 def show_admin_hr_dashboard():
     st.markdown('## 🧭 Management Dashboard', unsafe_allow_html=True)
     user_info = st.session_state.user_info
@@ -101,44 +269,25 @@ def show_admin_hr_dashboard():
                             st.error(f"Employee ID '{employee_id}' already exists.")
                         else:
                             hashed_pass = hash_password(temp_password)
-                            users_col.insert_one({
+                            users_col.insert_one(employee_search.with_search_keys({
                                 "username": username, "full_name": full_name, "email": email,
                                 "password_hash": hashed_pass, "employee_id": employee_id, "role": role,
                                 "department": department, "job_title": job_title, "join_date": datetime.now(),
                                 "profile_pic_url": "https://placehold.co/400x400/cccccc/FFFFFF/png?text=New"
-                            })
+                            }))
+                            employee_search.invalidate()
+                            audit.record(user_info['employee_id'], "user.create", "user", employee_id, {"username": username, "role": role})
                             st.success(f"✅ Account for {full_name} created!")
                             st.balloons()
             
             st.divider()
             st.subheader("Existing Employees")
-            all_users_admin = list(users_col.find({}))
-            for user in all_users_admin:
-                with st.container(border=True):
-                    col1, col2, col3, col4 = st.columns([2, 2, 2, 2])
-                    col1.write(f"**{user.get('full_name', 'N/A')}** (`{user.get('username', 'N/A')}`)")
-                    col2.write(f"Role: **{user.get('role', 'N/A').capitalize()}**")
-                    options = ["employee", "manager", "hr", "admin"]
-                    index = options.index(user.get('role', 'employee')) if user.get('role', 'employee') in options else 0
-                    new_role = col3.selectbox(
-                        "Change Role", options=options, index=index,
-                        key=f"role_{user['_id']}", label_visibility="collapsed"
-                    )
-                    if new_role != user.get('role'):
-                        users_col.update_one({"_id": user['_id']}, {"$set": {"role": new_role}})
-                        st.toast(f"Updated {user['full_name']}'s role to {new_role.capitalize()}")
-                        st.rerun()
-                    if col4.button("🗑️ Delete", key=f"del_{user['_id']}", type="primary"):
-                        if user['employee_id'] == user_info['employee_id']:
-                            st.error("Cannot delete your own account.")
-                        else:
-                            users_col.delete_one({"_id": user['_id']})
-                            st.toast(f"Deleted {user['full_name']}")
-                            st.rerun()
+            show_user_management_grid(user_info['employee_id'])
 
         elif user_info['role'] == 'hr':
             st.subheader("🌟 Employee Hub")
             st.markdown("A quick-glance overview of key employee metrics.")
+            st.caption(monitoring.freshness_caption(read_freshness(ANALYTICAL)))
             
             all_users = list(users_col.find({"role": {"$ne": "admin"}}).sort("full_name", 1))
             
@@ -147,7 +296,10 @@ def show_admin_hr_dashboard():
             
             if selected_dept != "All":
                 all_users = [user for user in all_users if user.get("department") == selected_dept]
-                
+
+            # Lifetime totals: one aggregation over the hot tier plus archived rollups
+            lifetime = archive.attendance_totals([u["employee_id"] for u in all_users if u.get("employee_id")], ANALYTICAL)
+
             for user in all_users:
                 with st.container(border=True):
                     emp_id = user.get("employee_id")
@@ -160,41 +312,36 @@ def show_admin_hr_dashboard():
                         st.caption(f"{user.get('job_title', 'N/A')} | `{user.get('department', 'N/A')}`")
                         st.write(f"ID: `{emp_id}`")
                     
-                    att_records = list(attendance_col.find({"employee_id": emp_id}))
-                    total_days = len(att_records)
-                    present_days = len([r for r in att_records if r.get("status") == "present"])
+                    totals = lifetime.get(emp_id, {})
+                    total_days = totals.get("days", 0)
+                    present_days = totals.get("present_days", 0)
                     attendance_pct = (present_days / total_days * 100) if total_days > 0 else 0
+                    avg_hours = (totals.get("worked_hours", 0) / present_days) if present_days > 0 else 0
                     
-                    worked_hours = 0
-                    for r in att_records:
-                        if isinstance(r.get("worked_hours"), (int, float)):
-                            worked_hours += r.get("worked_hours", 0)
-                    avg_hours = (worked_hours / present_days) if present_days > 0 else 0
-                    
-                    total_leave = leaves_col.count_documents({"employee_id": emp_id, "status": "approved"})
+                    total_leave = leave_ledger.get_total_leave_taken(emp_id)
 
                     with col2:
                         st.metric("Attendance", f"{attendance_pct:.1f}%")
                     with col3:
                         st.metric("Avg. Hours", f"{avg_hours:.1f} hrs")
                     with col4:
-                        st.metric("Total Leave", f"{total_leave} days")
+                        st.metric("Total Leave", f"{total_leave:g} days")
 
 
     # --- TAB 2: Analytics ---
     with tab2:
         st.subheader("📊 Company Analytics")
+        st.caption(monitoring.freshness_caption(read_freshness(ANALYTICAL)))
+        analytics_users = reads(users_col, ANALYTICAL)
 
-        total_employees = users_col.count_documents({})
+        total_employees = analytics_users.count_documents({})
+        # Pending requests are acted on from this page, so they are read from the primary
         pending_leaves = leaves_col.count_documents({"status": "pending"})
         
-        all_attendance = list(attendance_col.find({}, {"status": 1}))
-        avg_attendance_pct = 0
-        if all_attendance:
-            df_att = pd.DataFrame(all_attendance)
-            total_records = len(df_att)
-            present_records = len(df_att[df_att['status'] == 'present'])
-            avg_attendance_pct = (present_records / total_records * 100) if total_records > 0 else 0
+        lifetime = archive.attendance_totals(workload=ANALYTICAL)
+        total_records = sum(t["days"] for t in lifetime.values())
+        present_records = sum(t["present_days"] for t in lifetime.values())
+        avg_attendance_pct = (present_records / total_records * 100) if total_records > 0 else 0
 
         kpi1, kpi2, kpi3 = st.columns(3)
         kpi1.metric("Total Employees", total_employees)
@@ -206,18 +353,21 @@ def show_admin_hr_dashboard():
         chart_col1, chart_col2 = st.columns(2)
         with chart_col1:
             st.markdown("#### Employees by Department")
-            dept_data = list(users_col.aggregate([{"$group": {"_id": "$department", "count": {"$sum": 1}}}]))
-            if dept_data:
-                df_dept = pd.DataFrame(dept_data).rename(columns={'_id': 'Department', 'count': 'Employees'})
+            df_dept = aggregate_frame(
+                analytics_users,
+                [{"$group": {"_id": "$department", "count": {"$sum": 1}}}, {"$set": {"Department": "$_id", "Employees": "$count"}}],
+                {"Department": str, "Employees": int}
+            )
+            if not df_dept.empty:
                 fig_bar = px.bar(df_dept, x='Department', y='Employees', text_auto=True)
                 fig_bar.update_layout(margin=dict(l=0,r=0,t=0,b=0))
                 st.plotly_chart(fig_bar, use_container_width=True)
 
             st.markdown("#### Leave Type Distribution")
-            leave_data = list(leaves_col.aggregate([
-                {"$match": {"status": "approved"}},
-                {"$group": {"_id": "$leave_type", "count": {"$sum": 1}}}
-            ]))
+            leave_data = [
+                {"_id": leave_type, "count": count}
+                for leave_type, count in archive.approved_leave_counts("leave_type", ANALYTICAL).items()
+            ]
             if leave_data:
                 df_leave_pie = pd.DataFrame(leave_data).rename(columns={'_id': 'Leave Type', 'count': 'Count'})
                 fig_pie = px.pie(df_leave_pie, names='Leave Type', values='Count', hole=0.3)
@@ -226,17 +376,17 @@ def show_admin_hr_dashboard():
 
         with chart_col2:
             st.markdown("#### Attendance % vs. Approved Leave")
-            all_users = list(users_col.find({}))
+            all_users = list(analytics_users.find({}, {"employee_id": 1, "full_name": 1, "department": 1}))
+            approved_leaves = archive.approved_leave_counts("employee_id", ANALYTICAL)
             perf_data = []
             for user in all_users:
                 emp_id = user.get("employee_id")
                 if not emp_id: continue
                 
-                att_records = list(attendance_col.find({"employee_id": emp_id}))
-                total_days = len(att_records)
-                present_days = len([r for r in att_records if r.get("status") == "present"])
-                attendance_pct = (present_days / total_days * 100) if total_days > 0 else 0
-                total_leave = leaves_col.count_documents({"employee_id": emp_id, "status": "approved"})
+                totals = lifetime.get(emp_id, {})
+                total_days = totals.get("days", 0)
+                attendance_pct = (totals.get("present_days", 0) / total_days * 100) if total_days > 0 else 0
+                total_leave = approved_leaves.get(emp_id, 0)
                 
                 perf_data.append({
                     "Employee": user.get('full_name', 'N/A'),
@@ -269,16 +419,67 @@ def show_admin_hr_dashboard():
         if user_info['role'] == 'hr':
             communication.show_hr_communication_panel()
         elif user_info['role'] == 'admin':
+            st.subheader("🗓️ Holiday Calendar")
+            with st.expander("Manage Holidays & Weekends"):
+                location = st.text_input("Location", value=work_calendar.DEFAULT_LOCATION)
+                holidays = work_calendar.get_holidays(location)
+                for hdate, name in sorted(holidays.items()):
+                    h1, h2 = st.columns([4, 1])
+                    h1.write(f"**{name}**: {hdate.strftime('%A, %d %B %Y')}")
+                    if h2.button("Remove", key=f"rm_holiday_{location}_{hdate}"):
+                        work_calendar.remove_holiday(hdate, location)
+                        audit.record(user_info['employee_id'], "holiday.remove", "calendar", location, {"date": str(hdate)})
+                        st.rerun()
+                with st.form("holiday_form", clear_on_submit=True):
+                    c1, c2 = st.columns(2)
+                    holiday_date = c1.date_input("Date")
+                    holiday_name = c2.text_input("Holiday Name")
+                    if st.form_submit_button("Add Holiday") and holiday_name:
+                        work_calendar.save_holiday(holiday_date, holiday_name, location)
+                        audit.record(user_info['employee_id'], "holiday.save", "calendar", location, {"date": str(holiday_date), "name": holiday_name})
+                        st.rerun()
+            st.divider()
+
+            with st.expander("📥 Punch Ingestion Queue"):
+                queue_stats = punch_queue.get_punch_queue().metrics()
+                q1, q2, q3, q4 = st.columns(4)
+                q1.metric("Queue Depth", queue_stats["queue_depth"])
+                q2.metric("Avg. Batch Size", queue_stats["avg_batch_size"])
+                q3.metric("Avg. Flush", f"{queue_stats['avg_flush_ms']} ms")
+                q4.metric("Full-Queue Waits", queue_stats["full_waits"])
+                st.json(queue_stats)
+                journal_stats = write_buffer.get_write_buffer().stats()
+                st.caption(
+                    f"Local journal: {journal_stats['pending']} pending, {journal_stats['failed']} failed, "
+                    f"database {'online' if journal_stats['online'] else 'OFFLINE'}"
+                )
+            st.divider()
+
+            with st.expander("📦 Hot / Archive Tiers"):
+                st.caption(f"Records older than {archive.ARCHIVE_AFTER_DAYS} days are moved to the archive by `python run_archival.py`.")
+                st.dataframe(pd.DataFrame(archive.tier_stats()), use_container_width=True, hide_index=True)
+
+            st.subheader("📈 Query & Page Performance")
+            st.caption(f"Collected in memory since this process started. Queries slower than {monitoring.SLOW_QUERY_MS:.0f} ms are listed as slow.")
+            page_stats = monitoring.page_report()
+            if page_stats:
+                st.markdown("#### Page Latency")
+                st.dataframe(pd.DataFrame(page_stats), use_container_width=True, hide_index=True)
+                st.markdown("#### Mongo Commands by Page")
+                st.dataframe(pd.DataFrame(monitoring.command_report()), use_container_width=True, hide_index=True)
+                slow = monitoring.slow_queries()
+                st.markdown(f"#### Slow Queries ({len(slow)})")
+                if slow:
+                    st.dataframe(pd.DataFrame(slow), use_container_width=True, hide_index=True)
+                st.download_button(
+                    "📤 Export Prometheus Metrics", data=monitoring.prometheus_text(),
+                    file_name="hrms_metrics.prom", mime="text/plain"
+                )
+            else:
+                st.info("No page activity recorded yet.")
+            st.divider()
+
             st.subheader("⚙️ System & Audit Logs")
-            st.warning("Feature under development. This is a placeholder.")
-            if st.button("Force Database Backup (Placeholder)", width='stretch'): # Updated
-                st.toast("Backup initiated...")
-            if st.button("View Recent System Logs (Placeholder)", width='stretch'): # Updated
-                st.info("Showing last 5 system events (placeholder):")
-                st.json({
-                    "events": [
-                        {"timestamp": "2025-10-15 10:00", "user": "admin", "action": "Changed user roles."},
-                        {"timestamp": "2025-10-14 18:00", "user": "admin", "action": "Deleted inactive accounts."},
-                        {"timestamp": "2025-10-13 09:00", "user": "hr", "action": "Published company announcement."}
-                    ]
-                })
\ No newline at end of file
+            if backup.can_manage_backups():
+                show_backup_panel()
+            show_audit_log_viewer()
\ No newline at end of file
@@ -0,0 +1,48 @@
+from datetime import datetime
+import pandas as pd
+
+try:
+    from pymongoarrow.api import Schema, aggregate_pandas_all
+except ImportError:  # Falls back to building the frame from documents
+    Schema = aggregate_pandas_all = None
+
+# Columnar loader for the dashboards. Results are declared with a schema
+# ({field: datetime | float | int | str | bool}); the server converts every field
+# to its declared type in a final $project, and PyMongoArrow decodes the BSON
+# batches straight into Arrow buffers, so no per-document dicts or ObjectIds are
+# created and no to_datetime / to_numeric passes are needed afterwards.
+# Missing or unconvertible values become nulls (NaN / NaT / None).
+
+_BSON_TYPES = {datetime: "date", float: "double", int: "long", str: "string", bool: "bool"}
+_PANDAS_TYPES = {float: "float64", str: "object", bool: "object"}
+
+
+def _typed_projection(schema):
+    project = {"_id": 0}
+    for field, kind in schema.items():
+        project[field] = {"$convert": {"input": f"${field}", "to": _BSON_TYPES[kind], "onError": None, "onNull": None}}
+    return {"$project": project}
+
+
+def aggregate_frame(collection, pipeline, schema):
+    """
+    Runs `pipeline` on a tenant-scoped collection and returns a DataFrame with
+    exactly the columns and types of `schema`.
+    """
+    pipeline = collection.scope_pipeline(list(pipeline) + [_typed_projection(schema)])
+    if aggregate_pandas_all is not None:
+        return aggregate_pandas_all(collection.raw(), pipeline, schema=Schema(schema))
+    df = pd.DataFrame(list(collection.raw().aggregate(pipeline)), columns=list(schema))
+    for field, kind in schema.items():
+        if kind is datetime:
+            df[field] = pd.to_datetime(df[field])
+        elif kind is int:
+            df[field] = df[field].astype("Int64")
+        else:
+            df[field] = df[field].astype(_PANDAS_TYPES[kind])
+    return df
+
+
+def find_frame(collection, query, schema):
+    """DataFrame of the documents matching `query`, with the columns and types of `schema`."""
+    return aggregate_frame(collection, [{"$match": query}], schema)
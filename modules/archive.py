@@ -0,0 +1,211 @@
+import os
+from datetime import datetime, timedelta
+from pymongo import ReplaceOne, UpdateOne
+from db import (
+    TRANSACTIONAL, reads, start_session, attendance_col, leaves_col, chats_col,
+    attendance_archive_col, leaves_archive_col, chats_archive_col, archive_rollups_col
+)
+from modules.attendance_schema import OFF_DUTY_STATUSES, date_filter, to_day
+
+# Hot/cold tiering. Records older than the horizon are moved, in batches, from the
+# hot collections into their *_archive twins (zstd-compressed, rarely read), so the
+# working set of the day-to-day queries stays small.
+# Each batch is one transaction: copy into the archive, add the batch's totals to the
+# per-employee rollup documents, delete from the hot collection. Lifetime KPIs are
+# therefore always `hot aggregation + rollup` and never need to touch the archive.
+
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "365"))
+BATCH_SIZE = 500
+
+TIERS = [(attendance_col, attendance_archive_col), (leaves_col, leaves_archive_col), (chats_col, chats_archive_col)]
+ARCHIVES = {hot.name: cold for hot, cold in TIERS}
+
+
+def archive_cutoff(days=None):
+    """Records strictly older than this date belong to the cold tier."""
+    today = datetime.combine(datetime.today().date(), datetime.min.time())
+    return today - timedelta(days=ARCHIVE_AFTER_DAYS if days is None else days)
+
+
+# --- Rollup increments for one batch ---
+def _attendance_rollups(docs):
+    incs = {}
+    for doc in docs:
+        inc = incs.setdefault(doc["employee_id"], {})
+        status = doc.get("status") or "unknown"
+        if status not in OFF_DUTY_STATUSES:
+            inc["attendance.days"] = inc.get("attendance.days", 0) + 1
+        inc[f"attendance.status.{status}"] = inc.get(f"attendance.status.{status}", 0) + 1
+        if isinstance(doc.get("worked_hours"), (int, float)):
+            inc["attendance.worked_hours"] = inc.get("attendance.worked_hours", 0) + doc["worked_hours"]
+    return incs
+
+
+def _leave_rollups(docs):
+    incs = {}
+    for doc in docs:
+        if doc.get("status") != "approved":
+            continue
+        inc = incs.setdefault(doc["employee_id"], {})
+        leave_type = doc.get("leave_type") or "other"
+        inc[f"leaves.approved.{leave_type}"] = inc.get(f"leaves.approved.{leave_type}", 0) + 1
+        inc["leaves.approved_days"] = inc.get("leaves.approved_days", 0) + (doc.get("days") or 0)
+    return incs
+
+
+def _move_batch(source, query, rollups_for):
+    """Moves up to BATCH_SIZE matching documents to the archive in one transaction. Returns the count."""
+    target = ARCHIVES[source.name]
+
+    def callback(session):
+        docs = list(source.find(query, session=session).sort("_id", 1).limit(BATCH_SIZE))
+        if not docs:
+            return 0
+        target.bulk_write(
+            [ReplaceOne({"_id": doc["_id"]}, doc, upsert=True) for doc in docs],
+            ordered=False, session=session
+        )
+        incs = rollups_for(docs) if rollups_for else {}
+        if incs:
+            now = datetime.now()
+            archive_rollups_col.bulk_write([
+                UpdateOne({"employee_id": employee_id}, {"$inc": inc, "$set": {"updated_at": now}}, upsert=True)
+                for employee_id, inc in incs.items()
+            ], ordered=False, session=session)
+        source.delete_many({"_id": {"$in": [doc["_id"] for doc in docs]}}, session=session)
+        return len(docs)
+
+    with start_session() as session:
+        return session.with_transaction(callback)
+
+
+def _archive_collection(source, query, rollups_for, progress):
+    moved = 0
+    while True:
+        count = _move_batch(source, query, rollups_for)
+        if not count:
+            break
+        moved += count
+        progress(f"Archived {moved} {source.name} records")
+    return moved
+
+
+def run_archival(days=None, progress=print):
+    """
+    Moves attendance, finished leaves and inactive chat threads older than the
+    horizon into the archive collections. Safe to interrupt and re-run.
+    Returns {collection: documents moved}.
+    """
+    cutoff = archive_cutoff(days)
+    progress(f"Archiving records older than {cutoff:%d-%b-%Y}...")
+    return {
+        attendance_col.name: _archive_collection(
+            attendance_col, date_filter(lt=cutoff), _attendance_rollups, progress
+        ),
+        leaves_col.name: _archive_collection(
+            leaves_col, {"status": {"$ne": "pending"}, "end_date": {"$lt": cutoff}}, _leave_rollups, progress
+        ),
+        chats_col.name: _archive_collection(
+            chats_col,
+            {"$or": [
+                {"last_message_at": {"$lt": cutoff}},
+                {"last_message_at": {"$exists": False}, "created_at": {"$lt": cutoff}}
+            ]},
+            None, progress
+        )
+    }
+
+
+def tier_stats():
+    """Document counts per tier, for the admin panel."""
+    return [
+        {"Collection": hot.name, "Hot": hot.estimated_document_count(), "Archived": cold.estimated_document_count()}
+        for hot, cold in TIERS
+    ]
+
+
+# --- Reads ---
+def _sort_value(value):
+    if isinstance(value, datetime):
+        return value
+    return to_day(value) if isinstance(value, str) else datetime.min
+
+
+def find_with_archive(collection, query, sort_field, include_archive=False):
+    """
+    Runs a history query on the hot collection, and on its archive only when the
+    user explicitly asked for older records. Results are sorted newest first.
+    """
+    records = list(collection.find(query).sort(sort_field, -1))
+    if include_archive:
+        records += list(ARCHIVES[collection.name].find(query).sort(sort_field, -1))
+        records.sort(key=lambda r: _sort_value(r.get(sort_field)), reverse=True)
+    return records
+
+
+def restore_chat_thread(first_id, second_id):
+    """Moves an archived chat thread between two users back to the hot tier (e.g. when it is reopened)."""
+    query = {"$and": [{"participants": first_id}, {"participants": second_id}]}
+    if not chats_archive_col.find_one(query, {"_id": 1}):
+        return None
+
+    def callback(session):
+        thread = chats_archive_col.find_one(query, session=session)
+        if thread:
+            chats_col.replace_one({"_id": thread["_id"]}, thread, upsert=True, session=session)
+            chats_archive_col.delete_one({"_id": thread["_id"]}, session=session)
+        return thread
+
+    with start_session() as session:
+        return session.with_transaction(callback)
+
+
+def _rollups(employee_ids=None, workload=TRANSACTIONAL):
+    query = {"employee_id": {"$in": list(employee_ids)}} if employee_ids is not None else {}
+    return {doc["employee_id"]: doc for doc in reads(archive_rollups_col, workload).find(query)}
+
+
+def attendance_totals(employee_ids=None, workload=TRANSACTIONAL):
+    """
+    Lifetime attendance per employee ({employee_id: {days, present_days, worked_hours}}):
+    one grouped aggregation over the hot tier plus the archived rollups. `days`
+    counts expected working days (leave and holiday records are left out).
+    Dashboards pass workload=ANALYTICAL to read from a secondary.
+    """
+    pipeline = [
+        {"$group": {
+            "_id": "$employee_id",
+            "days": {"$sum": {"$cond": [{"$in": ["$status", OFF_DUTY_STATUSES]}, 0, 1]}},
+            "present_days": {"$sum": {"$cond": [{"$eq": ["$status", "present"]}, 1, 0]}},
+            "worked_hours": {"$sum": {"$cond": [{"$isNumber": "$worked_hours"}, "$worked_hours", 0]}}
+        }}
+    ]
+    if employee_ids is not None:
+        pipeline.insert(0, {"$match": {"employee_id": {"$in": list(employee_ids)}}})
+    totals = {
+        row["_id"]: {"days": row["days"], "present_days": row["present_days"], "worked_hours": row["worked_hours"]}
+        for row in reads(attendance_col, workload).aggregate(pipeline)
+    }
+    for employee_id, rollup in _rollups(employee_ids, workload).items():
+        archived = rollup.get("attendance", {})
+        total = totals.setdefault(employee_id, {"days": 0, "present_days": 0, "worked_hours": 0})
+        total["days"] += archived.get("days", 0)
+        total["present_days"] += archived.get("status", {}).get("present", 0)
+        total["worked_hours"] += archived.get("worked_hours", 0)
+    return totals
+
+
+def approved_leave_counts(group_by="employee_id", workload=TRANSACTIONAL):
+    """Lifetime number of approved leaves grouped by "employee_id" or "leave_type" (hot tier + rollups)."""
+    counts = {
+        row["_id"]: row["count"]
+        for row in reads(leaves_col, workload).aggregate([
+            {"$match": {"status": "approved"}},
+            {"$group": {"_id": f"${group_by}", "count": {"$sum": 1}}}
+        ])
+    }
+    for employee_id, rollup in _rollups(workload=workload).items():
+        for leave_type, count in rollup.get("leaves", {}).get("approved", {}).items():
+            key = employee_id if group_by == "employee_id" else leave_type
+            counts[key] = counts.get(key, 0) + count
+    return counts
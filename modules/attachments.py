@@ -0,0 +1,181 @@
+import hashlib
+import os
+import secrets
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from gridfs.errors import FileExists
+from pymongo.errors import DuplicateKeyError
+from gridfs.errors import NoFile
+from db import api_tokens_col, current_database, get_attachments_fs, leaves_col, leaves_archive_col
+from modules.tenancy import current_tenant
+
+# Streamlit uploads are read in 1 MB pieces and stored as 255 KiB GridFS chunks, so
+# large scans never have to be copied into a single bytes object inside the script
+# process. Downloads never pass through Streamlit either: the UI hands out a
+# short-lived, single-file link and api.py streams the file chunk by chunk.
+CHUNK_SIZE = 1024 * 1024
+GRIDFS_CHUNK_BYTES = 255 * 1024
+PREVIEW_LIMIT = 5 * 1024 * 1024  # Only images smaller than this are previewed inline
+DOWNLOAD_LINK_MINUTES = 5
+API_PUBLIC_URL = os.getenv("API_PUBLIC_URL", "http://localhost:8080")  # Where browsers reach api.py
+PREVIEW_CACHE_BYTES = 50 * 1024 * 1024  # Inline previews kept in memory (stored files never change)
+
+_previews = OrderedDict()  # (tenant_id, file_id) -> bytes, least recently shown first
+_previews_lock = threading.Lock()
+
+
+def _files_col():
+    return current_database()["leave_attachments.files"]
+
+
+def _iter_chunks(file_obj, chunk_size=CHUNK_SIZE):
+    """Yields successive chunks from a file-like object."""
+    while True:
+        chunk = file_obj.read(chunk_size)
+        if not chunk:
+            break
+        yield chunk
+
+
+def _sha256_of(file_obj):
+    """Computes the SHA-256 of a file-like object without reading it all at once."""
+    digest = hashlib.sha256()
+    file_obj.seek(0)
+    for chunk in _iter_chunks(file_obj):
+        digest.update(chunk)
+    file_obj.seek(0)
+    return digest.hexdigest()
+
+
+def store_attachment(uploaded_file, employee_id):
+    """
+    Stores an uploaded file in GridFS and returns the reference saved on the leave.
+    Files with identical content (same SHA-256) are stored only once.
+    """
+    sha256 = _sha256_of(uploaded_file)
+    content_type = getattr(uploaded_file, "type", None) or "application/octet-stream"
+
+    tenant_id = current_tenant()
+    # Deduplicate within the tenant only: content is never shared across companies
+    query = {"metadata.tenant_id": tenant_id, "metadata.sha256": sha256}
+    existing = _files_col().find_one(query, {"_id": 1, "length": 1})
+    if not existing:
+        grid_in = get_attachments_fs().open_upload_stream(
+            uploaded_file.name,
+            chunk_size_bytes=GRIDFS_CHUNK_BYTES,
+            metadata={
+                "tenant_id": tenant_id,
+                "sha256": sha256,
+                "content_type": content_type,
+                "uploaded_by": employee_id,
+                "uploaded_at": datetime.now()
+            }
+        )
+        try:
+            for chunk in _iter_chunks(uploaded_file):
+                grid_in.write(chunk)
+            grid_in.close()
+        except (FileExists, DuplicateKeyError):
+            # A concurrent upload of the same content won the unique index: keep
+            # that file and drop the chunks written by this one
+            current_database()["leave_attachments.chunks"].delete_many({"files_id": grid_in._id})
+        existing = _files_col().find_one(query, {"_id": 1, "length": 1})
+    file_id = existing["_id"]
+    length = existing["length"]
+
+    return {
+        "file_id": file_id,
+        "filename": uploaded_file.name,
+        "sha256": sha256,
+        "length": length,
+        "content_type": content_type
+    }
+
+
+def open_attachment(file_id):
+    """Opens one of the current tenant's attachments for streamed reading (returns a file-like GridOut)."""
+    if not _files_col().find_one({"_id": file_id, "metadata.tenant_id": current_tenant()}, {"_id": 1}):
+        raise FileNotFoundError(f"Attachment {file_id} not found")
+    return get_attachments_fs().open_download_stream(file_id)
+
+
+def preview_bytes(file_id):
+    """The content of a small attachment for inline display, read once and then served from memory."""
+    key = (current_tenant(), file_id)
+    with _previews_lock:
+        if key in _previews:
+            _previews.move_to_end(key)
+            return _previews[key]
+    with open_attachment(file_id) as grid_out:
+        data = grid_out.read()
+    with _previews_lock:
+        _previews[key] = data
+        while len(_previews) > 1 and sum(len(v) for v in _previews.values()) > PREVIEW_CACHE_BYTES:
+            _previews.popitem(last=False)
+    return data
+
+
+def uploaded_by(employee_ids):
+    """Ids of the current tenant's attachments uploaded by any of `employee_ids`."""
+    return set(_files_col().distinct(
+        "_id", {"metadata.tenant_id": current_tenant(), "metadata.uploaded_by": {"$in": list(employee_ids)}}
+    ))
+
+
+def delete_unreferenced(file_ids):
+    """
+    Deletes those of the current tenant's attachments that no leave (hot or archived)
+    refers to any more. Content is deduplicated, so a file may still back another
+    employee's leave. Returns the number of files deleted.
+    """
+    deleted = 0
+    for file_id in set(file_ids):
+        if any(col.find_one({"attachment.file_id": file_id}, {"_id": 1}) for col in (leaves_col, leaves_archive_col)):
+            continue
+        if not _files_col().find_one({"_id": file_id, "metadata.tenant_id": current_tenant()}, {"_id": 1}):
+            continue
+        try:
+            get_attachments_fs().delete(file_id)
+            deleted += 1
+        except NoFile:
+            pass
+        with _previews_lock:
+            _previews.pop((current_tenant(), file_id), None)
+    return deleted
+
+
+def create_download_link(file_id, employee_id):
+    """
+    A link to api.py that streams one attachment. The token only opens this file and
+    expires after DOWNLOAD_LINK_MINUTES; it is not accepted as an API bearer token.
+    """
+    token = secrets.token_urlsafe(32)
+    now = datetime.utcnow()  # UTC, like the TTL index and api._lookup_token
+    api_tokens_col.insert_one({
+        "token_hash": hashlib.sha256(token.encode()).hexdigest(),
+        "scope": "attachment",
+        "file_id": file_id,
+        "tenant_id": current_tenant(),
+        "employee_id": employee_id,
+        "created_at": now,
+        "expires_at": now + timedelta(minutes=DOWNLOAD_LINK_MINUTES)
+    })
+    return f"{API_PUBLIC_URL}/api/attachments/{file_id}?token={token}"
+
+
+def iter_attachment_chunks(file_id):
+    """Yields the stored attachment chunk by chunk."""
+    grid_out = open_attachment(file_id)
+    try:
+        yield from _iter_chunks(grid_out)
+    finally:
+        grid_out.close()
+
+
+def format_size(num_bytes):
+    """Formats a byte count for display."""
+    for unit in ["B", "KB", "MB", "GB"]:
+        if num_bytes < 1024 or unit == "GB":
+            return f"{num_bytes:.0f} {unit}" if unit == "B" else f"{num_bytes:.1f} {unit}"
+        num_bytes /= 1024
@@ -1,8 +1,12 @@
 import streamlit as st
+import streamlit.components.v1 as components
 import pandas as pd
 import plotly.graph_objects as go
 import plotly.express as px  # <-- Added this import
-from db import attendance_col, users_col
+from db import ANALYTICAL, attendance_col, read_freshness, reads
+from modules import archive, employee_search, punches, punch_events, work_calendar, monitoring
+from modules.analytics_loader import aggregate_frame, find_frame
+from modules.attendance_schema import date_filter
 from datetime import datetime, timedelta
 import calendar
 
@@ -10,38 +14,39 @@ import calendar
 def create_personal_heatmap(employee_id):
     """Creates a Plotly calendar heatmap for a single employee."""
     start_date = datetime.now() - timedelta(days=180)
-    attendance_data = list(attendance_col.find(
-        {"employee_id": employee_id, "punch_in": {"$gte": start_date}},
-        {"date": 1, "status": 1, "worked_hours": 1}
-    ))
+    # Loaded as typed columns: legacy string dates and non-numeric hours are converted on the server
+    df = find_frame(
+        reads(attendance_col, ANALYTICAL),
+        {"employee_id": employee_id, **date_filter(gte=start_date)},
+        {"date": datetime, "status": str, "worked_hours": float}
+    )
     
-    if not attendance_data:
+    if df.empty:
         return None 
 
-    df = pd.DataFrame(attendance_data)
-
-    if 'worked_hours' not in df.columns: df['worked_hours'] = 0
-    if 'status' not in df.columns: df['status'] = 'unknown'
-    if 'date' not in df.columns: df['date'] = pd.NaT
-    
-    df['date'] = pd.to_datetime(df['date']).dt.normalize()
-    df['day_str'] = df['date'].dt.strftime('%Y-%m-%d')
-    df['worked_hours'] = pd.to_numeric(df['worked_hours'], errors='coerce').fillna(0)
+    df['status'] = df['status'].fillna('unknown')
+    df['date'] = df['date'].astype('datetime64[ns]').dt.normalize()
+    df['worked_hours'] = df['worked_hours'].fillna(0)
     
     all_days = pd.date_range(start=start_date.date(), end=datetime.now().date(), freq='D').normalize()
     calendar_df = pd.DataFrame(all_days, columns=['date'])
     
     calendar_df = calendar_df.merge(df, on='date', how='left')
+    location = work_calendar.get_user_location(employee_id)
+    calendar_df['working_day'] = [work_calendar.is_working_day(d.date(), location) for d in calendar_df['date']]
+    # Closed days carry their own absent / on_leave / holiday record (end-of-day job);
+    # only days not closed yet are inferred here
     calendar_df['status'] = calendar_df['status'].fillna('absent')
+    calendar_df.loc[(calendar_df['status'] == 'absent') & ~calendar_df['working_day'], 'status'] = 'off'
     calendar_df['worked_hours'] = calendar_df['worked_hours'].fillna(0)
     
     def map_status_to_value(row):
         if row['status'] == 'present':
             return 0.1 + (row['worked_hours'] / 8.0) 
         elif row['status'] == 'absent':
-            if row['date'].weekday() >= 5: 
-                return -0.5
             return 0 
+        elif row['status'] in ('off', 'holiday'):
+            return -0.5
         return 0.05 
 
     calendar_df['color_value'] = calendar_df.apply(map_status_to_value, axis=1)
@@ -55,7 +60,7 @@ def create_personal_heatmap(employee_id):
         y=[''] * len(dates), 
         colorscale=[
             [0, 'rgb(230, 75, 75)'],  # Absent
-            [0.01, 'rgb(240, 240, 240)'], # Weekend
+            [0.01, 'rgb(240, 240, 240)'], # Weekend / Holiday
             [0.05, 'rgb(255, 224, 130)'], # Leave/Other
             [0.1, 'rgb(173, 230, 173)'],  # Present
             [1, 'rgb(0, 100, 0)'],     # Full Day
@@ -78,25 +83,27 @@ def create_personal_heatmap(employee_id):
 def create_weekly_hours_chart(employee_id):
     """Creates a bar chart of weekly worked hours for the last 60 days."""
     start_date = datetime.now() - timedelta(days=60)
-    records = list(attendance_col.find(
-        {"employee_id": employee_id, "date": {"$gte": start_date.strftime("%Y-%m-%d")}},
-        {"date": 1, "worked_hours": 1}
-    ))
-    
-    if not records:
-        return None
-        
-    df = pd.DataFrame(records)
-    if 'worked_hours' not in df.columns:
-        df['worked_hours'] = 0
-        
-    df['date'] = pd.to_datetime(df['date'])
-    df['worked_hours'] = pd.to_numeric(df['worked_hours'], errors='coerce').fillna(0)
-    
-    df.set_index('date', inplace=True)
-    
-    # Resample by week (W), summing the hours
-    weekly_hours = df['worked_hours'].resample('W').sum().reset_index()
+    # Aggregated on the server from raw punch events; falls back to the daily
+    # records for history that has not been backfilled into events yet.
+    event_weeks = punch_events.weekly_hours(employee_id, start_date, ANALYTICAL)
+    if event_weeks:
+        weekly_hours = pd.DataFrame(event_weeks)
+        weekly_hours['date'] = pd.to_datetime(weekly_hours['date'])
+    else:
+        df = find_frame(
+            reads(attendance_col, ANALYTICAL),
+            {"employee_id": employee_id, **date_filter(gte=start_date)},
+            {"date": datetime, "worked_hours": float}
+        )
+
+        if df.empty:
+            return None
+
+        df['worked_hours'] = df['worked_hours'].fillna(0)
+        df.set_index('date', inplace=True)
+
+        # Resample by week (W), summing the hours
+        weekly_hours = df['worked_hours'].resample('W').sum().reset_index()
     weekly_hours['Week'] = weekly_hours['date'].dt.strftime('Week of %b %d')
     
     fig = px.bar(
@@ -119,20 +126,19 @@ def create_weekly_hours_chart(employee_id):
 def create_status_pie_chart(employee_id):
     """Creates a pie chart of attendance status for the last 30 days."""
     start_date = datetime.now() - timedelta(days=30)
-    records = list(attendance_col.find(
-        {"employee_id": employee_id, "date": {"$gte": start_date.strftime("%Y-%m-%d")}},
-        {"status": 1}
-    ))
+    # Counted on the server; only one row per status comes back
+    status_counts = aggregate_frame(
+        reads(attendance_col, ANALYTICAL),
+        [
+            {"$match": {"employee_id": employee_id, **date_filter(gte=start_date)}},
+            {"$group": {"_id": {"$ifNull": ["$status", "unknown"]}, "count": {"$sum": 1}}},
+            {"$set": {"status": "$_id"}}
+        ],
+        {"status": str, "count": int}
+    )
     
-    if not records:
+    if status_counts.empty:
         return None
-        
-    df = pd.DataFrame(records)
-    if 'status' not in df.columns:
-        df['status'] = 'unknown'
-        
-    status_counts = df['status'].value_counts().reset_index()
-    status_counts.columns = ['status', 'count']
     
     fig = px.pie(
         status_counts, 
@@ -155,37 +161,14 @@ def show_employee_attendance_dashboard(employee_id, employee_name):
     Displays the complete visual dashboard for a given employee.
     """
     st.header(f"📊 Dashboard for {employee_name}")
+    # Dashboards read from a secondary; today's punch panel stays on the primary
+    st.caption(monitoring.freshness_caption(read_freshness(ANALYTICAL)))
     
     # --- PERSONAL KPIS ---
-    start_30_days = datetime.now() - timedelta(days=30)
-    my_records = list(attendance_col.find({
-        "employee_id": employee_id,
-        "date": {"$gte": start_30_days.strftime("%Y-%m-%d")}
-    }))
-    
-    avg_hours = 0
-    present_days = 0
-    on_time_days = 0
-
-    if my_records:
-        df_30 = pd.DataFrame(my_records)
-
-        if 'worked_hours' not in df_30.columns: df_30['worked_hours'] = 0
-        if 'status' not in df_30.columns: df_30['status'] = None
-        if 'punch_in' not in df_30.columns: df_30['punch_in'] = pd.NaT
-
-        df_30['worked_hours'] = pd.to_numeric(df_30['worked_hours'], errors='coerce').fillna(0)
-        
-        present_df = df_30[df_30['status'] == 'present']
-        present_days = len(present_df)
-        
-        if not present_df.empty:
-            worked_days_df = present_df[present_df['worked_hours'] > 0]
-            if not worked_days_df.empty:
-                avg_hours = worked_days_df['worked_hours'].mean()
-            
-            present_df['punch_in_time'] = pd.to_datetime(present_df['punch_in'], errors='coerce').dt.time
-            on_time_days = len(present_df[present_df['punch_in_time'] <= pd.to_datetime('09:30:00').time()])
+    summary = punches.attendance_summary(employee_id, days=30, workload=ANALYTICAL)
+    avg_hours = summary["avg_hours"]
+    present_days = summary["present_days"]
+    on_time_days = summary["on_time_days"]
 
     kpi1, kpi2, kpi3 = st.columns(3)
     kpi1.metric("Avg. Work Hours", f"{avg_hours:.1f} hrs")
@@ -217,7 +200,77 @@ def show_employee_attendance_dashboard(employee_id, employee_name):
             st.info("Not enough data for a weekly hours chart.")
 
 
+# --- LIVE WORK TIMER (ticks in the browser, no reruns) ---
+def show_work_timer(punch_in_time):
+    """Renders the "You've been working for" timer as a client-side ticking clock."""
+    start_ms = int(punch_in_time.timestamp() * 1000)
+    components.html(f"""
+        <div id="timer" style="font-family: sans-serif; color: #1c83e1; background: rgba(28, 131, 225, 0.1);
+             padding: 12px 16px; border-radius: 8px;">🧭 You’ve been working for <b id="elapsed">...</b></div>
+        <script>
+            const start = {start_ms};
+            function tick() {{
+                const seconds = Math.max(0, Math.floor((Date.now() - start) / 1000));
+                const hours = Math.floor(seconds / 3600);
+                const minutes = Math.floor((seconds % 3600) / 60);
+                document.getElementById("elapsed").textContent = hours + "h " + minutes + "m";
+            }}
+            tick();
+            setInterval(tick, 1000);
+        </script>
+    """, height=60)
+
+
+# --- PUNCH-IN/OUT PANEL (re-runs on its own, independent of the dashboards) ---
+@st.fragment
+@monitoring.track_page
+def show_punch_panel(employee_id):
+    """Punch In/Out buttons and today's status for the logged-in employee."""
+    today_record = punches.get_today_record(employee_id)
+
+    st.write(f"📅 Today: **{datetime.today().strftime('%A, %d %B %Y')}**")
+    col1, col2 = st.columns(2)
+
+    with col1:
+        if not today_record:
+            if st.button("✅ Punch In", width='stretch'): 
+                ok, result = punches.punch_in(employee_id)
+                st.toast("Punched in successfully!" if ok else result)
+                st.rerun(scope="fragment")
+        else:
+            punch_in_time = today_record.get("punch_in")
+            if isinstance(punch_in_time, datetime):
+                st.info(f"🟢 Punched in at **{punch_in_time.strftime('%H:%M:%S')}**")
+            else:
+                st.info("🟢 Punched in (time unavailable)")
+
+    with col2:
+        if today_record and "punch_out" not in today_record:
+            if st.button("🕔 Punch Out", width='stretch'): 
+                ok, result = punches.punch_out(employee_id)
+                st.toast(f"Punched out successfully! ⏱ Worked {result} hrs today." if ok else result)
+                st.rerun(scope="fragment")
+        elif today_record and "punch_out" in today_record:
+            punch_out_time = today_record.get("punch_out")
+            if isinstance(punch_out_time, datetime):
+                st.success(f"🔴 Punched out at **{punch_out_time.strftime('%H:%M:%S')}**")
+            else:
+                st.success("🔴 Punched out (time unavailable)")
+            if st.button("▶️ Resume (Punch In)", width='stretch'):
+                ok, result = punches.punch_in(employee_id)
+                st.toast("Welcome back! Punched in again." if ok else result)
+                st.rerun(scope="fragment")
+
+    if today_record and "punch_out" not in today_record:
+        segments = today_record.get("segments") or [{"in": today_record.get("punch_in")}]
+        segment_start = segments[-1].get("in")
+        if isinstance(segment_start, datetime):
+            # Time already worked in closed segments (before a break) keeps counting.
+            show_work_timer(segment_start - timedelta(hours=today_record.get("worked_hours") or 0))
+
+
 # --- MAIN PAGE FUNCTION ---
+@monitoring.track_page
 def show_attendance_page():
     st.title("🕒 Attendance Portal")
     user_info = st.session_state.user_info
@@ -225,61 +278,7 @@ def show_attendance_page():
 
     # --- PUNCH-IN/OUT (Only for employees) ---
     if user_role == "employee":
-        employee_id = user_info["employee_id"]
-        today_str = datetime.today().strftime("%Y-%m-%d")
-        today_record = attendance_col.find_one({"employee_id": employee_id, "date": today_str})
-
-        st.write(f"📅 Today: **{datetime.today().strftime('%A, %d %B %Y')}**")
-        col1, col2 = st.columns(2)
-
-        with col1:
-            if not today_record:
-                if st.button("✅ Punch In", width='stretch'): 
-                    attendance_col.insert_one({
-                        "employee_id": employee_id, "date": today_str,
-                        "punch_in": datetime.now(), "status": "present"
-                    })
-                    st.success("Punched in successfully!")
-                    st.rerun()
-            else:
-                punch_in_time = today_record.get("punch_in")
-                if isinstance(punch_in_time, datetime):
-                    st.info(f"🟢 Punched in at **{punch_in_time.strftime('%H:%M:%S')}**")
-                else:
-                    st.info("🟢 Punched in (time unavailable)")
-
-        with col2:
-            if today_record and "punch_out" not in today_record:
-                if st.button("🕔 Punch Out", width='stretch'): 
-                    punch_out_time = datetime.now()
-                    punch_in_time = today_record.get("punch_in")
-                    worked_hours = None
-                    if isinstance(punch_in_time, datetime):
-                        worked_duration = punch_out_time - punch_in_time
-                        worked_hours = round(worked_duration.total_seconds() / 3600, 2)
-                    
-                    attendance_col.update_one(
-                        {"_id": today_record["_id"]},
-                        {"$set": {"punch_out": punch_out_time, "worked_hours": worked_hours}}
-                    )
-                    st.success(f"Punched out successfully! ⏱ Worked {worked_hours} hrs today.")
-                    st.rerun()
-            elif today_record and "punch_out" in today_record:
-                punch_out_time = today_record.get("punch_out")
-                if isinstance(punch_out_time, datetime):
-                    st.success(f"🔴 Punched out at **{punch_out_time.strftime('%H:%M:%S')}**")
-                else:
-                    st.success("🔴 Punched out (time unavailable)")
-
-        if today_record and "punch_out" not in today_record:
-            punch_in_time = today_record.get("punch_in")
-            if isinstance(punch_in_time, datetime):
-                elapsed = datetime.now() - punch_in_time
-                # --- BUG FIX WAS HERE (divod -> divmod) ---
-                hours, remainder = divmod(int(elapsed.total_seconds()), 3600)
-                minutes, _ = divmod(remainder, 60)
-                st.info(f"🧭 You’ve been working for **{hours}h {minutes}m**")
-
+        show_punch_panel(user_info["employee_id"])
         st.divider()
 
     # --- ATTENDANCE DASHBOARD & HISTORY (Visible to all) ---
@@ -289,27 +288,10 @@ def show_attendance_page():
 
     if user_role in ["admin", "hr", "manager"]:
         st.subheader("Select Employee to View")
-        employee_list = list(users_col.find({}, {"employee_id": 1, "username": 1, "full_name": 1}))
-        if not employee_list:
-            st.error("No employee data found.")
-            return
-            
-        employee_map = {f"{emp.get('full_name', 'N/A')} ({emp.get('username', 'N/A')})": emp.get("employee_id") for emp in employee_list}
-        
-        current_user_key = f"{user_info.get('full_name', 'N/A')} ({user_info.get('username', 'N/A')})"
-        options = list(employee_map.keys())
-        index = 0
-        if current_user_key in options:
-            index = options.index(current_user_key)
-
-        selected_user_display = st.selectbox(
-            "Select Employee", 
-            options=options,
-            index=index
-        )
-        selected_employee_id = employee_map.get(selected_user_display)
-        selected_full_name = selected_user_display.split(' (')[0] # Get the name part
-        
+        selected_user = employee_search.employee_picker("Select Employee", key="attendance_employee", default=user_info)
+        selected_employee_id = selected_user.get("employee_id") if selected_user else None
+        selected_full_name = selected_user.get("full_name", "Employee") if selected_user else None
+
         if not selected_employee_id:
             st.warning("Could not find employee. Defaulting to your records.")
             selected_employee_id = user_info["employee_id"]
@@ -322,7 +304,11 @@ def show_attendance_page():
 
     # --- Detailed History Table (Visible to all) ---
     st.subheader("📋 Detailed History Table")
-    records = list(attendance_col.find({"employee_id": selected_employee_id}).sort("date", -1))
+    include_archive = st.toggle(
+        f"📦 Include archived records (older than {archive.ARCHIVE_AFTER_DAYS} days)",
+        key="attendance_include_archive"
+    )
+    records = archive.find_with_archive(attendance_col, {"employee_id": selected_employee_id}, "date", include_archive)
 
     if not records:
         st.info("No attendance records found.")
@@ -0,0 +1,145 @@
+import time
+from datetime import datetime, date
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from db import attendance_col, schema_migrations_col
+from modules.tenancy import current_tenant
+
+# Attendance schema versions:
+#   1 - `date` stored as a "%Y-%m-%d" string
+#   2 - `date` stored as a native BSON date (midnight of the working day)
+# While the migration is running both forms exist, so readers build their
+# `date` filters with date_filter(), which also matches legacy strings until
+# the migration has completed.
+
+SCHEMA_VERSION = 2
+# Day statuses written by the end-of-day job that are not expected working days;
+# attendance percentages leave them out of the denominator.
+OFF_DUTY_STATUSES = ["on_leave", "holiday"]
+MIGRATION_ID = "attendance_native_date"
+_STATUS_CACHE_SECONDS = 60
+_status_cache = {}  # tenant_id -> (checked_at, completed)
+
+
+def to_day(value):
+    """Returns the native `date` value (midnight datetime) for a date, datetime or legacy string."""
+    if isinstance(value, str):
+        return datetime.strptime(value, "%Y-%m-%d")
+    if isinstance(value, datetime):
+        return datetime.combine(value.date(), datetime.min.time())
+    if isinstance(value, date):
+        return datetime.combine(value, datetime.min.time())
+    raise TypeError(f"Unsupported attendance date value: {value!r}")
+
+
+def migration_completed():
+    """True once every attendance record uses a native date (cached for a minute)."""
+    now = time.time()
+    tenant_id = current_tenant()
+    checked_at, completed = _status_cache.get(tenant_id, (0, False))
+    if now - checked_at > _STATUS_CACHE_SECONDS:
+        state = schema_migrations_col.find_one({"migration": MIGRATION_ID}, {"status": 1})
+        completed = bool(state and state.get("status") == "completed")
+        _status_cache[tenant_id] = (now, completed)
+    return completed
+
+
+def date_filter(gte=None, lt=None, equals=None):
+    """
+    Builds a query fragment on `date`. Until the migration finishes it matches
+    both native dates and the equivalent legacy strings.
+    """
+    if equals is not None:
+        day = to_day(equals)
+        if migration_completed():
+            return {"date": day}
+        return {"date": {"$in": [day, day.strftime("%Y-%m-%d")]}}
+
+    native, legacy = {}, {}
+    if gte is not None:
+        native["$gte"] = to_day(gte)
+        legacy["$gte"] = native["$gte"].strftime("%Y-%m-%d")
+    if lt is not None:
+        native["$lt"] = to_day(lt)
+        legacy["$lt"] = native["$lt"].strftime("%Y-%m-%d")
+    if migration_completed():
+        return {"date": native}
+    return {"$or": [{"date": native}, {"date": legacy}]}
+
+
+# --- Migration (schema v1 -> v2) ---
+def migrate_attendance_dates(batch_size=1000, max_docs_per_second=2000, progress=print):
+    """
+    Rewrites legacy string dates to native dates in resumable bulk_write batches.
+    Progress (last _id, counts) is checkpointed after every batch in schema_migrations,
+    so an interrupted run picks up where it stopped. `max_docs_per_second` throttles
+    the run so it can execute while the app is online.
+    """
+    state = schema_migrations_col.find_one({"migration": MIGRATION_ID}) or {}
+    if state.get("status") == "completed":
+        progress("Migration already completed.")
+        return state
+
+    remaining = attendance_col.count_documents({"date": {"$type": "string"}})
+    processed = state.get("processed", 0)
+    conflicts = state.get("conflicts", 0)
+    last_id = state.get("last_id")
+    schema_migrations_col.update_one(
+        {"migration": MIGRATION_ID},
+        {"$set": {"status": "running", "updated_at": datetime.now()}, "$setOnInsert": {"started_at": datetime.now()}},
+        upsert=True
+    )
+    progress(f"{remaining} records to migrate (resuming after {last_id})." if last_id else f"{remaining} records to migrate.")
+
+    started = time.perf_counter()
+    done_this_run = 0
+    while True:
+        query = {"date": {"$type": "string"}}
+        if last_id is not None:
+            query["_id"] = {"$gt": last_id}
+        batch = list(attendance_col.find(query, {"date": 1}).sort("_id", 1).limit(batch_size))
+        if not batch:
+            break
+
+        batch_started = time.perf_counter()
+        ops = [
+            UpdateOne(
+                {"_id": doc["_id"], "date": doc["date"]},
+                {"$set": {"date": to_day(doc["date"]), "schema_version": SCHEMA_VERSION}}
+            )
+            for doc in batch
+        ]
+        try:
+            attendance_col.bulk_write(ops, ordered=False)
+        except BulkWriteError as e:
+            # Duplicate key: a native record for the same employee/day already exists.
+            # The legacy record is left untouched and counted for manual review.
+            conflicts += len(e.details.get("writeErrors", []))
+
+        last_id = batch[-1]["_id"]
+        processed += len(batch)
+        done_this_run += len(batch)
+        schema_migrations_col.update_one(
+            {"migration": MIGRATION_ID},
+            {"$set": {"last_id": last_id, "processed": processed, "conflicts": conflicts, "updated_at": datetime.now()}}
+        )
+
+        elapsed = time.perf_counter() - started
+        rate = done_this_run / elapsed if elapsed else 0
+        eta = (remaining - done_this_run) / rate if rate else 0
+        progress(f"Migrated {done_this_run}/{remaining} ({rate:.0f} docs/s, ETA {eta:.0f}s, {conflicts} conflicts)")
+
+        # Throttle: never exceed max_docs_per_second
+        min_batch_seconds = len(batch) / max_docs_per_second if max_docs_per_second else 0
+        spent = time.perf_counter() - batch_started
+        if spent < min_batch_seconds:
+            time.sleep(min_batch_seconds - spent)
+
+    status = "completed" if conflicts == 0 else "completed_with_conflicts"
+    schema_migrations_col.update_one(
+        {"migration": MIGRATION_ID},
+        {"$set": {"status": status, "finished_at": datetime.now(), "updated_at": datetime.now()}}
+    )
+    _status_cache.pop(current_tenant(), None)
+    progress(f"✅ Migration {status.replace('_', ' ')}: {processed} records processed, {conflicts} conflicts.")
+    return schema_migrations_col.find_one({"migration": MIGRATION_ID})
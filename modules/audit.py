@@ -0,0 +1,83 @@
+import os
+import threading
+from datetime import datetime, timezone
+from pymongo import InsertOne
+from db import audit_log_col
+from modules.punch_queue import PunchQueue
+
+# Append-only audit trail of who did what to which entity.
+# Events are handed to a group-commit queue (the same writer used for punches)
+# and inserted in batches by a background thread, so the audited action never
+# waits on the audit write.
+# `at` is stored in UTC; convert local times with to_utc / to_local at the edges.
+
+RETENTION_DAYS = int(os.getenv("AUDIT_RETENTION_DAYS", "365"))
+PAGE_SIZE = 25
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def _get_queue():
+    # One writer for every tenant; each event is queued with the caller's tenant
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = PunchQueue(audit_log_col, max_batch=200, max_wait_ms=500)
+        return _queue
+
+
+def record(actor_id, action, entity_type, entity_id, details=None):
+    """Queues an audit event. Never raises: auditing must not break the action itself."""
+    try:
+        _get_queue().submit(InsertOne({
+            "at": datetime.utcnow(),
+            "actor_id": actor_id,
+            "action": action,
+            "entity_type": entity_type,
+            "entity_id": str(entity_id),
+            "details": details or {}
+        }))
+    except Exception as e:
+        print(f"⚠️ Could not queue audit event {action}: {e}")
+
+
+def to_utc(local_dt):
+    """A naive local datetime as the naive UTC datetime `at` is stored in."""
+    return local_dt.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def to_local(utc_dt):
+    """A stored (naive UTC) `at` in this server's local time."""
+    return utc_dt.replace(tzinfo=timezone.utc).astimezone().replace(tzinfo=None)
+
+
+def find_events(actor_id=None, action=None, entity_type=None, entity_id=None, start=None, end=None, before=None, limit=PAGE_SIZE):
+    """
+    Returns one page of audit events, newest first. `start`/`end` are UTC. `before` is
+    the (at, _id) of the last event on the previous page (keyset pagination, so deep
+    pages stay fast).
+    """
+    query = {}
+    if actor_id:
+        query["actor_id"] = actor_id
+    if action:
+        query["action"] = action
+    if entity_type:
+        query["entity_type"] = entity_type
+    if entity_id:
+        query["entity_id"] = entity_id
+    if start or end:
+        query["at"] = {}
+        if start:
+            query["at"]["$gte"] = start
+        if end:
+            query["at"]["$lt"] = end
+    if before:
+        before_at, before_id = before
+        query["$or"] = [{"at": {"$lt": before_at}}, {"at": before_at, "_id": {"$lt": before_id}}]
+    return list(audit_log_col.find(query).sort([("at", -1), ("_id", -1)]).limit(limit))
+
+
+def distinct_actions():
+    return sorted(audit_log_col.distinct("action"))
@@ -0,0 +1,306 @@
+import gzip
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from bson import json_util
+from bson.objectid import ObjectId
+from bson.json_util import JSONOptions, JSONMode
+from pymongo import ReplaceOne
+from db import db, all_tenants, get_tenant_database, tenant_databases
+from modules.tenancy import DEFAULT_TENANT, current_tenant
+
+# Database backup / restore.
+# Each run writes one gzip-compressed NDJSON file per collection (canonical
+# Extended JSON, so ObjectIds, dates and binaries round-trip exactly) plus a
+# manifest.json. Collections are exported in parallel, each with its own cursor.
+#
+# Incremental runs only export documents whose _id is greater than the watermark
+# recorded by the previous run (ObjectIds grow with insertion time). That is only
+# safe for append-only collections with driver-generated ids, so only those listed
+# in APPEND_ONLY are incremental; everything else (leaves, attendance, chats, punch
+# events with derived ids, ...) is edited in place or keyed by hashed ids and is
+# exported in full on every run. The watermark is moved back by WATERMARK_OVERLAP
+# seconds to catch inserts from app servers whose clocks lag; restores are upserts,
+# so the overlap is harmless.
+#
+# Every database holding tenant data is included: the shared one and each tenant's
+# dedicated database (db.tenant_databases). Files live in <run_id>/<database>/ and
+# manifest keys are "<database>/<collection>"; restores route each database back
+# through the tenant registry.
+#
+# Collection options (time-series layout, zstd storage engine, validators...) are
+# captured from list_collections into the manifest, and a restore recreates missing
+# or dropped collections from them rather than from whatever the target has.
+#
+# A run covers every tenant, so only the platform operator may start one or see the
+# run history: admins of BACKUP_OPERATOR_TENANT (see can_manage_backups).
+
+BACKUP_DIR = os.getenv("BACKUP_DIR", "backups")
+APPEND_ONLY = {"leave_ledger", "audit_log", "leave_attachments.files", "leave_attachments.chunks"}
+WATERMARK_OVERLAP = 300
+OPERATOR_TENANT = os.getenv("BACKUP_OPERATOR_TENANT")
+BATCH_SIZE = 1000
+WORKERS = 4
+EXTENDED_JSON = JSONOptions(json_mode=JSONMode.CANONICAL)
+
+# Progress of the backup running in the background (shown in the admin panel)
+job_status = {"running": False, "message": "", "manifest": None}
+_job_lock = threading.Lock()
+
+
+def can_manage_backups():
+    """
+    True if the current tenant operates the platform. Without BACKUP_OPERATOR_TENANT
+    that is the default tenant of a single-tenant install only.
+    """
+    if OPERATOR_TENANT:
+        return current_tenant() == OPERATOR_TENANT
+    return current_tenant() == DEFAULT_TENANT and set(all_tenants()) <= {DEFAULT_TENANT}
+
+
+def _collections(database):
+    """{name: creation options} of the database's collections, as canonical Extended JSON."""
+    return {
+        info["name"]: json.loads(json_util.dumps(info.get("options") or {}, json_options=EXTENDED_JSON))
+        for info in sorted(database.list_collections(), key=lambda info: info["name"])
+        if not info["name"].startswith("system.") and info.get("type", "collection") in ("collection", "timeseries")
+    }
+
+
+def _split_key(key):
+    """(database name, collection) of a manifest key; runs before per-tenant databases used bare names."""
+    database_name, _, name = key.rpartition("/")
+    return database_name or db.name, name
+
+
+def _file_path(run_dir, key):
+    database_name, name = _split_key(key)
+    if "/" not in key:
+        return os.path.join(run_dir, f"{name}.ndjson.gz")
+    return os.path.join(run_dir, database_name, f"{name}.ndjson.gz")
+
+
+def list_runs():
+    """Returns manifests of previous runs, newest first."""
+    if not os.path.isdir(BACKUP_DIR):
+        return []
+    manifests = []
+    for run_id in sorted(os.listdir(BACKUP_DIR), reverse=True):
+        path = os.path.join(BACKUP_DIR, run_id, "manifest.json")
+        if os.path.exists(path):
+            with open(path) as f:
+                manifests.append(json.load(f))
+    return manifests
+
+
+def _export_collection(database, name, run_dir, watermark):
+    started = time.perf_counter()
+    query = {}
+    if isinstance(watermark, ObjectId):
+        query = {"_id": {"$gt": ObjectId.from_datetime(watermark.generation_time - timedelta(seconds=WATERMARK_OVERLAP))}}
+    elif watermark is not None:
+        query = {"_id": {"$gt": watermark}}
+    key = f"{database.name}/{name}"
+    path = _file_path(run_dir, key)
+    docs = 0
+    last_id = watermark
+    with gzip.open(path, "wt", encoding="utf-8", compresslevel=6) as out:
+        for doc in database[name].find(query, sort=[("_id", 1)], batch_size=BATCH_SIZE):
+            out.write(json_util.dumps(doc, json_options=EXTENDED_JSON))
+            out.write("\n")
+            docs += 1
+            last_id = doc["_id"]
+    elapsed = time.perf_counter() - started
+    return key, {
+        "docs": docs,
+        "bytes": os.path.getsize(path),
+        "seconds": round(elapsed, 2),
+        "docs_per_second": round(docs / elapsed) if elapsed else docs,
+        "watermark": json.loads(json_util.dumps(last_id, json_options=EXTENDED_JSON)) if last_id is not None else None,
+        "mode": "incremental" if watermark is not None else "full"
+    }
+
+
+def run_backup(incremental=False, progress=None):
+    """
+    Dumps every collection to BACKUP_DIR/<run_id>/ and returns the run manifest.
+    `progress` is an optional callback receiving status messages.
+    """
+    previous = next((m for m in list_runs() if m.get("completed")), None) if incremental else None
+    run_id = datetime.now().strftime("%Y%m%d-%H%M%S") + ("-incr" if previous else "-full")
+    run_dir = os.path.join(BACKUP_DIR, run_id)
+    os.makedirs(run_dir, exist_ok=True)
+
+    started = time.perf_counter()
+    manifest = {
+        "run_id": run_id, "type": "incremental" if previous else "full",
+        "base_run": previous["run_id"] if previous else None,
+        "started_at": datetime.now().isoformat(), "databases": {}, "collections": {}, "completed": False
+    }
+
+    jobs = []
+    for database, tenant_ids in tenant_databases():
+        manifest["databases"][database.name] = {"tenants": tenant_ids}
+        os.makedirs(os.path.join(run_dir, database.name), exist_ok=True)
+        for name, options in _collections(database).items():
+            key = f"{database.name}/{name}"
+            manifest["collections"][key] = {"options": options}
+            # Runs from before per-tenant databases keyed the shared database's collections by name
+            prev = (previous or {}).get("collections", {})
+            prev = prev.get(key) or (prev.get(name, {}) if database.name == db.name else {})
+            watermark = None
+            if previous and name in APPEND_ONLY and prev.get("watermark") is not None:
+                watermark = json_util.loads(json.dumps(prev["watermark"]))
+            jobs.append((database, name, watermark))
+
+    with ThreadPoolExecutor(max_workers=WORKERS) as pool:
+        futures = [pool.submit(_export_collection, database, name, run_dir, watermark) for database, name, watermark in jobs]
+        for future in futures:
+            key, stats = future.result()
+            manifest["collections"][key].update(stats)
+            if progress:
+                progress(f"Exported {key}: {stats['docs']} docs ({stats['docs_per_second']}/s)")
+
+    elapsed = time.perf_counter() - started
+    total_docs = sum(c["docs"] for c in manifest["collections"].values())
+    total_bytes = sum(c["bytes"] for c in manifest["collections"].values())
+    manifest.update({
+        "finished_at": datetime.now().isoformat(), "seconds": round(elapsed, 2),
+        "total_docs": total_docs, "total_bytes": total_bytes,
+        "docs_per_second": round(total_docs / elapsed) if elapsed else total_docs,
+        "mb_per_second": round(total_bytes / 1024 / 1024 / elapsed, 2) if elapsed else 0,
+        "completed": True
+    })
+    with open(os.path.join(run_dir, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def _creation_options(options):
+    """Keyword arguments for create_collection from the options recorded in the manifest."""
+    options = json_util.loads(json.dumps(options))
+    timeseries = options.get("timeseries")
+    if timeseries and "granularity" in timeseries:
+        # The server reports the bucket spans implied by the granularity but rejects both together
+        options["timeseries"] = {k: v for k, v in timeseries.items() if not k.startswith("bucket")}
+    return options
+
+
+def _legacy_options(database, name):
+    """Runs from before options were recorded: fall back to the target's existing collection."""
+    info = next(database.list_collections(filter={"name": name}), None)
+    return json.loads(json_util.dumps(info.get("options") or {}, json_options=EXTENDED_JSON)) if info else {}
+
+
+def _write_batch(collection, batch, timeseries):
+    if not timeseries:
+        # Upserts keep restores idempotent and let incremental runs overlay a full one
+        collection.bulk_write([ReplaceOne({"_id": doc["_id"]}, doc, upsert=True) for doc in batch], ordered=False)
+        return len(batch)
+    # Time-series collections do not support replace/upsert: insert the missing documents only
+    existing = {d["_id"] for d in collection.find({"_id": {"$in": [doc["_id"] for doc in batch]}}, {"_id": 1})}
+    missing = [doc for doc in batch if doc["_id"] not in existing]
+    if missing:
+        collection.insert_many(missing, ordered=False)
+    return len(missing)
+
+
+def _target_database(manifest, database_name):
+    """Where a backed-up database is restored: the shared one, or the tenant's routed database."""
+    if database_name == db.name:
+        return db
+    tenant_ids = manifest.get("databases", {}).get(database_name, {}).get("tenants") or []
+    return get_tenant_database(tenant_ids[0]) if tenant_ids else db.client[database_name]
+
+
+def _restore_file(database, name, path, drop, options=None):
+    collection = database[name]
+    if options is None:
+        options = _legacy_options(database, name)
+    exists = name in database.list_collection_names()
+    if drop and exists:
+        collection.drop()
+        exists = False
+    if not exists and options:
+        # Created up front: an insert would otherwise create a plain collection
+        database.create_collection(name, **_creation_options(options))
+    timeseries = "timeseries" in options
+    restored = 0
+    batch = []
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            batch.append(json_util.loads(line))
+            if len(batch) >= BATCH_SIZE:
+                restored += _write_batch(collection, batch, timeseries)
+                batch = []
+    if batch:
+        restored += _write_batch(collection, batch, timeseries)
+    return f"{database.name}/{name}", restored
+
+
+def run_restore(run_id, drop=False, progress=None):
+    """
+    Restores a run. For incremental runs the chain back to the last full run is
+    replayed oldest first. Returns {collection: documents restored}.
+    """
+    runs = {m["run_id"]: m for m in list_runs()}
+    chain = []
+    current = runs.get(run_id)
+    while current:
+        chain.insert(0, current)
+        current = runs.get(current.get("base_run"))
+    if not chain or chain[0]["type"] != "full":
+        raise ValueError(f"Cannot find a complete backup chain for run '{run_id}'.")
+
+    totals = {}
+    for index, manifest in enumerate(chain):
+        run_dir = os.path.join(BACKUP_DIR, manifest["run_id"])
+        keys = list(manifest["collections"])
+        # The shared database goes first: it holds the tenant registry used to route the others
+        for shared in (True, False):
+            batch = [key for key in keys if (_split_key(key)[0] == db.name) == shared]
+            with ThreadPoolExecutor(max_workers=WORKERS) as pool:
+                futures = [
+                    pool.submit(
+                        _restore_file, _target_database(manifest, _split_key(key)[0]), _split_key(key)[1],
+                        _file_path(run_dir, key), drop and index == 0, manifest["collections"][key].get("options")
+                    )
+                    for key in batch
+                ]
+                for future in futures:
+                    key, restored = future.result()
+                    totals[key] = totals.get(key, 0) + restored
+                    if progress:
+                        progress(f"Restored {restored} docs into {key} from {manifest['run_id']}")
+    return totals
+
+
+def start_background_backup(incremental=False):
+    """
+    Starts a backup on a worker thread so the UI stays responsive. Returns False if
+    one is running or the current tenant may not manage backups.
+    """
+    if not can_manage_backups():
+        return False
+    with _job_lock:
+        if job_status["running"]:
+            return False
+        job_status.update({"running": True, "message": "Starting backup...", "manifest": None})
+
+    def progress(message):
+        job_status["message"] = message
+
+    def worker():
+        try:
+            job_status["manifest"] = run_backup(incremental, progress)
+            job_status["message"] = "Backup completed."
+        except Exception as e:
+            job_status["message"] = f"Backup failed: {e}"
+        finally:
+            job_status["running"] = False
+
+    threading.Thread(target=worker, name="db-backup", daemon=True).start()
+    return True
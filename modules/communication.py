@@ -1,25 +1,423 @@
 import streamlit as st
-from db import announcements_col, chats_col, users_col
+import threading
+import time
+from collections import defaultdict
+from bson.objectid import ObjectId
+from pymongo.errors import OperationFailure, PyMongoError
+from db import announcements_col, chats_col, users_col, current_database
+from modules import archive, audit, employee_search, monitoring, search
+from modules.tenancy import TENANT_FIELD, DEFAULT_TENANT, current_tenant
 from datetime import datetime
 
+LIVE_REFRESH_SECONDS = 2  # How often open panels check for new events (in-memory only)
+POLL_INTERVAL_SECONDS = 5  # Fallback polling interval when change streams are unavailable
+PREVIEW_CHARS = 80  # Length of the last-message preview kept on each thread
+INBOX_LIMIT = 50  # Threads listed in the inbox
+MESSAGE_PAGE = 50  # Messages loaded when a thread is opened ("Load earlier" adds more)
+
+# Each chat thread carries its own inbox summary, updated in the same write as every
+# send: `last_message` (sender, preview, timestamp), `unread` ({participant: count})
+# and `message_count`. The inbox is therefore one indexed query on
+# (participants, last_message_at) that never loads the message arrays.
+_inbox_backfilled = set()  # tenants whose legacy threads got their summary
+
+# -------------------------------
+# 🔹 LIVE UPDATES (CHANGE STREAMS)
+# -------------------------------
+
+class LiveUpdateHub:
+    """
+    Watches chats and announcements of one database (shared by every tenant
+    routed to it) and bumps a version counter per tenant-qualified topic
+    ("<tenant>:announcements", "<tenant>:chat:<employee_id>"). Sessions compare
+    versions in memory and only re-query Mongo when their topic changed.
+    Falls back to polling on a standalone mongod (no change streams).
+    """
+
+    def __init__(self, database):
+        self._database = database
+        self._chats = database[chats_col.name]
+        self._announcements = database[announcements_col.name]
+        self._versions = defaultdict(int)
+        self._lock = threading.Lock()
+        self._chat_owners = {}  # chat _id -> (tenant_id, participants)
+        self._resume_token = None
+        self.mode = "starting"
+
+    def start(self):
+        threading.Thread(target=self._run, name="live-updates", daemon=True).start()
+
+    def publish(self, topic):
+        with self._lock:
+            self._versions[topic] += 1
+
+    def version(self, topic):
+        with self._lock:
+            return self._versions.get(topic, 0)
+
+    def _bump_all(self):
+        with self._lock:
+            for topic in self._versions:
+                self._versions[topic] += 1
+
+    def _run(self):
+        while True:
+            try:
+                self._watch()
+            except OperationFailure as e:
+                # Code 40573: "$changeStream is only supported on replica sets"
+                if e.code in (40573, 40324) or "replica set" in str(e):
+                    self.mode = "polling"
+                    self._poll()
+                    return
+                # Codes 286/280: the resume token fell off the oplog. Start a fresh stream
+                # and bump every topic, since events in the gap were missed
+                if e.code in (286, 280):
+                    self._resume_token = None
+                    self._bump_all()
+                time.sleep(POLL_INTERVAL_SECONDS)
+            except PyMongoError:
+                time.sleep(POLL_INTERVAL_SECONDS)
+
+    def _watch(self):
+        pipeline = [{"$match": {"ns.coll": {"$in": [chats_col.name, announcements_col.name]}}}]
+        with self._database.watch(pipeline, resume_after=self._resume_token) as stream:
+            self.mode = "change_stream"
+            for event in stream:
+                self._resume_token = stream.resume_token
+                if event["ns"]["coll"] == announcements_col.name:
+                    self._publish_announcement_event(event)
+                else:
+                    self._publish_chat_event(event)
+
+    def _publish_announcement_event(self, event):
+        tenant_id = (event.get("fullDocument") or {}).get(TENANT_FIELD)
+        if tenant_id is None:
+            doc = self._announcements.find_one({"_id": event["documentKey"]["_id"]}, {TENANT_FIELD: 1}) or {}
+            tenant_id = doc.get(TENANT_FIELD)
+        if tenant_id is None:
+            # Deleted before we could look it up: nudge every tenant seen on this database
+            with self._lock:
+                tenants = {topic.split(":", 1)[0] for topic in self._versions} or {DEFAULT_TENANT}
+            for tenant in tenants:
+                self.publish(f"{tenant}:announcements")
+            return
+        self.publish(f"{tenant_id}:announcements")
+
+    def _publish_chat_event(self, event):
+        chat_id = event["documentKey"]["_id"]
+        full_document = event.get("fullDocument") or {}
+        owner = None
+        if "participants" in full_document:
+            owner = (full_document.get(TENANT_FIELD), full_document["participants"])
+        if owner is None:
+            owner = self._chat_owners.get(chat_id)
+        if owner is None:
+            doc = self._chats.find_one({"_id": chat_id}, {"participants": 1, TENANT_FIELD: 1}) or {}
+            owner = (doc.get(TENANT_FIELD), doc.get("participants") or [])
+        self._chat_owners[chat_id] = owner
+        tenant_id, participants = owner
+        for participant in participants:
+            self.publish(f"{tenant_id}:chat:{participant}")
+
+    def _poll(self):
+        last_announcement = {}
+        last_chat_at = datetime.now()
+        while True:
+            try:
+                latest_per_tenant = {
+                    row["_id"]: row["latest"]
+                    for row in self._announcements.aggregate([
+                        {"$group": {"_id": f"${TENANT_FIELD}", "latest": {"$max": "$posted_at"}}}
+                    ])
+                }
+                for tenant_id, latest in latest_per_tenant.items():
+                    if last_announcement.get(tenant_id) != latest:
+                        last_announcement[tenant_id] = latest
+                        self.publish(f"{tenant_id}:announcements")
+
+                changed = self._chats.find(
+                    {"last_message_at": {"$gt": last_chat_at}},
+                    {"participants": 1, "last_message_at": 1, TENANT_FIELD: 1}
+                )
+                for chat in changed:
+                    last_chat_at = max(last_chat_at, chat["last_message_at"])
+                    for participant in chat.get("participants", []):
+                        self.publish(f"{chat.get(TENANT_FIELD)}:chat:{participant}")
+            except PyMongoError:
+                pass
+            time.sleep(POLL_INTERVAL_SECONDS)
+
+
+_hubs = {}
+_hubs_lock = threading.Lock()
+
+
+def get_live_updates():
+    """
+    Returns the LiveUpdateHub of the current tenant's database, starting its
+    listener on first use. Tenants sharing a database share one listener.
+    """
+    database = current_database()
+    key = (id(database.client), database.name)  # clients are cached per cluster in db.py
+    with _hubs_lock:
+        if key not in _hubs:
+            _hubs[key] = LiveUpdateHub(database)
+            _hubs[key].start()
+        return _hubs[key]
+
+
+def load_for_topic(cache_key, topic, loader):
+    """
+    Returns loader() cached in the session until the current tenant's topic
+    changes, so periodic refreshes cost no database queries when nothing happened.
+    """
+    version = get_live_updates().version(f"{current_tenant()}:{topic}")
+    cached = st.session_state.get(cache_key)
+    if cached is None or cached[0] != version:
+        cached = (version, loader())
+        st.session_state[cache_key] = cached
+    return cached[1]
+
+
+# -------------------------------
+# 🔹 CHAT THREADS & INBOX
+# -------------------------------
+
+def _summarize_threads(query):
+    """Derives the inbox summary from the stored messages of the matching threads that lack one."""
+    chats_col.update_many(
+        {**query, "message_count": {"$exists": False}},
+        [{"$set": {
+            "message_count": {"$size": {"$ifNull": ["$messages", []]}},
+            "unread": {"$ifNull": ["$unread", {}]},
+            "last_message": {"$let": {
+                "vars": {"m": {"$arrayElemAt": ["$messages", -1]}},
+                "in": {
+                    "sender_id": "$$m.sender_id",
+                    "preview": {"$substrCP": [{"$ifNull": ["$$m.message", ""]}, 0, PREVIEW_CHARS]},
+                    "timestamp": "$$m.timestamp"
+                }
+            }}
+        }}]
+    )
+
+
+def ensure_inbox_fields():
+    """Adds the inbox summary to threads created before the inbox existed (once per tenant and process)."""
+    tenant_id = current_tenant()
+    if tenant_id in _inbox_backfilled:
+        return
+    _summarize_threads({})
+    _inbox_backfilled.add(tenant_id)
+
+
+def send_chat_message(chat_thread, sender_id, participants, text):
+    """
+    Appends a message to a chat thread (creating it if needed) and updates the
+    thread's inbox summary in the same write: the preview, and one more unread
+    message for everyone but the sender.
+    """
+    ensure_inbox_fields()
+    now = datetime.now()
+    message_doc = {
+        "_id": ObjectId(),  # Also the message's _id in the search collection
+        "sender_id": sender_id,
+        "message": text,
+        "timestamp": now
+    }
+    last_message = {"sender_id": sender_id, "preview": text[:PREVIEW_CHARS], "timestamp": now}
+    recipients = [p for p in participants if p != sender_id]
+
+    # ✅ If chat exists, only push message using _id
+    if chat_thread:
+        thread_id = chat_thread["_id"]
+        chats_col.update_one(
+            {"_id": chat_thread["_id"]},
+            {
+                "$push": {"messages": message_doc},
+                "$set": {"last_message_at": now, "last_message": last_message, f"unread.{sender_id}": 0},
+                "$inc": {"message_count": 1, **{f"unread.{p}": 1 for p in recipients}}
+            }
+        )
+    else:
+        # Create new chat with sorted participants
+        thread_id = chats_col.insert_one({
+            "participants": participants,
+            "messages": [message_doc],
+            "created_at": now,
+            "last_message_at": now,
+            "last_message": last_message,
+            "message_count": 1,
+            "unread": {p: (1 if p in recipients else 0) for p in participants},
+            "search_indexed": True
+        }).inserted_id
+    search.index_chat_message(thread_id, participants, message_doc)
+    # Make the sender's own panel and inbox reload immediately instead of waiting for the event.
+    _drop_chat_caches(sender_id, participants)
+
+
+def _drop_chat_caches(viewer_id, participants):
+    prefix = f"chat_cache_{viewer_id}_{'_'.join(participants)}"
+    for key in [k for k in st.session_state if k.startswith(prefix)]:
+        del st.session_state[key]
+    st.session_state.pop(f"inbox_cache_{viewer_id}", None)
+
+
+def mark_thread_read(thread_id, viewer_id):
+    """Resets the viewer's unread count on a thread."""
+    chats_col.update_one({"_id": thread_id}, {"$set": {f"unread.{viewer_id}": 0}})
+
+
+def get_inbox(viewer_id, limit=INBOX_LIMIT):
+    """
+    The viewer's threads, most recent activity first, with their preview and the
+    viewer's unread count, from one indexed query (message arrays are not loaded).
+    """
+    ensure_inbox_fields()
+    return list(
+        chats_col.find(
+            {"participants": viewer_id},
+            {"participants": 1, "last_message": 1, "last_message_at": 1, f"unread.{viewer_id}": 1}
+        ).sort("last_message_at", -1).limit(limit)
+    )
+
+
+def unread_count(thread, viewer_id):
+    return (thread.get("unread") or {}).get(viewer_id, 0)
+
+
+def _unread_badge(count):
+    return f" 🔴 {count}" if count else ""
+
+
+def _find_chat_thread(first_id, second_id, projection=None):
+    thread = chats_col.find_one({
+        "$and": [
+            {"participants": first_id},
+            {"participants": second_id}
+        ]
+    }, projection)
+    if thread:
+        return thread
+    # A conversation reopened after it went cold is moved back to the hot tier
+    thread = archive.restore_chat_thread(first_id, second_id)
+    if thread:
+        _summarize_threads({"_id": thread["_id"]})
+    return thread
+
+
 # -------------------------------
 # 🔹 COMPANY ANNOUNCEMENT SECTION
 # -------------------------------
 
+@st.fragment(run_every=LIVE_REFRESH_SECONDS)
+@monitoring.track_page
 def show_announcement_banner():
     """Finds the latest active announcement and displays it as a banner."""
-    latest_announcement = announcements_col.find_one(
-        {"is_active": True},
-        sort=[("posted_at", -1)]
+    latest_announcement = load_for_topic(
+        "announcement_cache", "announcements",
+        lambda: announcements_col.find_one({"is_active": True}, sort=[("posted_at", -1)])
     )
     if latest_announcement:
         st.info(f"**📢 Announcement:** {latest_announcement['message']}")
 
 
+def _send_from_input(viewer_id, other_id, input_key):
+    """Send button callback: posts the typed message and clears the input."""
+    text = st.session_state.get(input_key, "").strip()
+    if text:
+        # ✅ Fetch existing chat using $and to avoid conflicts
+        chat_thread = _find_chat_thread(viewer_id, other_id, {"_id": 1})
+        send_chat_message(chat_thread, viewer_id, sorted([viewer_id, other_id]), text)
+        st.session_state[input_key] = ""
+        st.toast("Message sent!")
+
+
+@st.fragment(run_every=LIVE_REFRESH_SECONDS)
+@monitoring.track_page
+def show_chat_panel(viewer_id, other_id, other_name, input_label, empty_text=None, title=None):
+    """
+    Renders a chat thread with its message box. Sending and incoming messages
+    only re-run this panel, and history is re-read only when the thread changed.
+    `title` is rendered with the unread badge once the thread has been marked read.
+    """
+    participants = sorted([viewer_id, other_id])
+    limit_key = f"chat_limit_{other_id}"
+    limit = st.session_state.get(limit_key, MESSAGE_PAGE)
+    # Only the latest `limit` messages are loaded; the summary fields come along
+    chat_thread = load_for_topic(
+        f"chat_cache_{viewer_id}_{'_'.join(participants)}_{limit}", f"chat:{viewer_id}",
+        lambda: _find_chat_thread(viewer_id, other_id, {"messages": {"$slice": -limit}})
+    )
+
+    new_messages = unread_count(chat_thread, viewer_id) if chat_thread else 0
+    if new_messages:
+        mark_thread_read(chat_thread["_id"], viewer_id)
+        chat_thread["unread"][viewer_id] = 0
+        st.session_state.pop(f"inbox_cache_{viewer_id}", None)
+    if title:
+        st.subheader(f"{title}{_unread_badge(unread_count(chat_thread, viewer_id) if chat_thread else 0)}")
+    if new_messages:
+        st.caption(f"{new_messages} new message{'s' if new_messages > 1 else ''} from {other_name}.")
+
+    if chat_thread and "messages" in chat_thread:
+        if chat_thread.get("message_count", 0) > limit:
+            if st.button("⬆️ Load earlier messages", key=f"earlier_{other_id}"):
+                st.session_state[limit_key] = limit + MESSAGE_PAGE
+                st.rerun(scope="fragment")
+        for msg in chat_thread["messages"]:
+            sender_name = "You" if msg["sender_id"] == viewer_id else other_name
+            st.chat_message("user" if sender_name != "You" else "assistant").write(
+                f"**{sender_name}:** {msg['message']}"
+            )
+    elif empty_text:
+        st.info(empty_text)
+
+    input_key = f"chat_{other_id}"
+    st.text_input(input_label, key=input_key)
+    st.button("Send", key=f"send_{other_id}", on_click=_send_from_input, args=(viewer_id, other_id, input_key))
+
+
 # -------------------------------
 # 🔹 HR COMMUNICATION PANEL
 # -------------------------------
 
+def _load_inbox_with_names(hr_id):
+    """The inbox plus {employee_id: name} of the other participants (one $in lookup), cached together."""
+    threads = get_inbox(hr_id)
+    others = {p for t in threads for p in t.get("participants", []) if p != hr_id}
+    names = {u["employee_id"]: u.get("full_name", u["employee_id"])
+             for u in users_col.find({"employee_id": {"$in": list(others)}}, {"employee_id": 1, "full_name": 1})}
+    return threads, names
+
+
+@st.fragment(run_every=LIVE_REFRESH_SECONDS)
+@monitoring.track_page
+def show_hr_inbox(hr_id):
+    """Threads by last activity with preview and unread badge; re-queried only when a chat changed."""
+    threads, names = load_for_topic(f"inbox_cache_{hr_id}", f"chat:{hr_id}", lambda: _load_inbox_with_names(hr_id))
+    total_unread = sum(unread_count(t, hr_id) for t in threads)
+    st.subheader(f"📥 Inbox{_unread_badge(total_unread)}")
+    if not threads:
+        st.caption("No conversations yet.")
+        return
+
+    for thread in threads:
+        other_id = next((p for p in thread.get("participants", []) if p != hr_id), None)
+        if not other_id:
+            continue
+        last = thread.get("last_message") or {}
+        sender = "You: " if last.get("sender_id") == hr_id else ""
+        when = last.get("timestamp") or thread.get("last_message_at")
+        label = (f"**{names.get(other_id, other_id)}**{_unread_badge(unread_count(thread, hr_id))}  \n"
+                 f"{sender}{last.get('preview', '')}")
+        if st.button(label, key=f"inbox_{thread['_id']}", use_container_width=True,
+                     help=when.strftime("%d %b %Y, %H:%M") if isinstance(when, datetime) else None):
+            st.session_state.hr_chat_with = (other_id, names.get(other_id, other_id))
+            st.rerun()
+
+
 def show_hr_communication_panel():
     """HR dashboard: Chat with employees + Post announcements."""
     try:
@@ -32,69 +430,31 @@ def show_hr_communication_panel():
         
         hr_id = hr_user['employee_id']
 
-        tab1, tab2 = st.tabs(["💬 Chat with Employees", "📢 Post an Announcement"])
+        tab1, tab2, tab3 = st.tabs(["💬 Chat with Employees", "📢 Post an Announcement", "🔎 Search"])
 
         # --- Tab 1: HR ↔ Employee Chat ---
         with tab1:
-            st.subheader("Chat with Employees")
-            all_employees = list(users_col.find({"role": "employee"}, {"full_name": 1, "employee_id": 1}))
-
-            if not all_employees:
-                st.warning("No employees found in the database.")
-                return
-
-            employee_map = {emp['full_name']: emp['employee_id'] for emp in all_employees}
-            selected_name = st.selectbox("Select an employee to chat with", options=list(employee_map.keys()))
-
-            if selected_name:
-                selected_emp_id = employee_map[selected_name]
-
-                # ✅ Create sorted participant list for consistent querying
-                participants = sorted([hr_id, selected_emp_id])
-
-                # ✅ Fetch existing chat - using _id lookup to avoid participants field issues
-                chat_thread = chats_col.find_one({
-                    "$and": [
-                        {"participants": hr_id},
-                        {"participants": selected_emp_id}
-                    ]
-                })
-
-                # Display chat history
-                if chat_thread and "messages" in chat_thread:
-                    for msg in chat_thread["messages"]:
-                        sender_name = "You" if msg["sender_id"] == hr_id else selected_name
-                        st.chat_message("user" if sender_name != "You" else "assistant").write(
-                            f"**{sender_name}:** {msg['message']}"
+            inbox_col, thread_col = st.columns([2, 3])
+            with inbox_col:
+                show_hr_inbox(hr_id)
+                with st.expander("✏️ New conversation"):
+                    new_employee = employee_search.employee_picker(
+                        "Select an employee to chat with", key="chat_employee", role="employee"
+                    )
+                    if new_employee and st.button("Open chat", key="open_new_chat"):
+                        st.session_state.hr_chat_with = (
+                            new_employee['employee_id'], new_employee.get('full_name', new_employee['employee_id'])
                         )
-
-                # Send a new message
-                new_message = st.text_input("Your message:", key=f"chat_{selected_emp_id}")
-                if st.button("Send", key=f"send_{selected_emp_id}"):
-                    if new_message.strip():
-                        message_doc = {
-                            "sender_id": hr_id,
-                            "message": new_message.strip(),
-                            "timestamp": datetime.now()
-                        }
-
-                        # ✅ If chat exists, only push message using _id
-                        if chat_thread:
-                            chats_col.update_one(
-                                {"_id": chat_thread["_id"]},
-                                {"$push": {"messages": message_doc}}
-                            )
-                        else:
-                            # Create new chat with sorted participants
-                            chats_col.insert_one({
-                                "participants": participants,
-                                "messages": [message_doc],
-                                "created_at": datetime.now()
-                            })
-
-                        st.success("Message sent!")
                         st.rerun()
 
+            with thread_col:
+                if st.session_state.get("hr_chat_with"):
+                    selected_emp_id, selected_name = st.session_state.hr_chat_with
+                    # Chat history + message box (refreshes live when a new message arrives)
+                    show_chat_panel(hr_id, selected_emp_id, selected_name, "Your message:", title=f"💬 {selected_name}")
+                else:
+                    st.info("Select a conversation from the inbox, or start a new one.")
+
         # --- Tab 2: Company Announcements ---
         with tab2:
             st.subheader("Company-Wide Announcements")
@@ -108,13 +468,18 @@ def show_hr_communication_panel():
                     announcements_col.update_many({"is_active": True}, {"$set": {"is_active": False}})
 
                     # Insert new announcement
-                    announcements_col.insert_one({
+                    result = announcements_col.insert_one({
                         "posted_by": hr_id,
                         "posted_at": datetime.now(),
                         "message": message.strip(),
                         "is_active": True
                     })
+                    audit.record(hr_id, "announcement.post", "announcement", result.inserted_id, {"message": message.strip()[:200]})
                     st.success("✅ Announcement posted successfully!")
+
+        # --- Tab 3: Search chats, leave reasons and announcements ---
+        with tab3:
+            search.show_search_panel(hr_id, "hr", key="hr_search")
     
     except Exception as e:
         st.error(f"An error occurred: {str(e)}")
@@ -147,61 +512,22 @@ def show_employee_communication_panel():
         
         emp_id = employee_user['employee_id']
         
-        st.subheader("✉️ Messages with HR")
-
         hr_user = users_col.find_one({"role": "hr"})
         if not hr_user:
+            st.subheader("✉️ Messages with HR")
             st.error("No HR user found in the system.")
             return
 
         hr_id = hr_user['employee_id']
-        
-        # ✅ Create sorted participant list
-        participants = sorted([hr_id, emp_id])
-
-        # ✅ Fetch existing chat using $and to avoid conflicts
-        chat_thread = chats_col.find_one({
-            "$and": [
-                {"participants": hr_id},
-                {"participants": emp_id}
-            ]
-        })
-
-        if chat_thread and "messages" in chat_thread:
-            for msg in chat_thread["messages"]:
-                sender_name = "You" if msg["sender_id"] == emp_id else "HR"
-                st.chat_message("user" if sender_name != "You" else "assistant").write(
-                    f"**{sender_name}:** {msg['message']}"
-                )
-        else:
-            st.info("You have no messages yet. Send a message to start a conversation with HR.")
-
-        # New message input
-        new_message = st.text_input("Your message to HR:")
-        if st.button("Send", key="send_to_hr"):
-            if new_message.strip():
-                message_doc = {
-                    "sender_id": emp_id,
-                    "message": new_message.strip(),
-                    "timestamp": datetime.now()
-                }
-
-                # ✅ If chat exists, only push message using _id
-                if chat_thread:
-                    chats_col.update_one(
-                        {"_id": chat_thread["_id"]},
-                        {"$push": {"messages": message_doc}}
-                    )
-                else:
-                    # Create new chat with sorted participants
-                    chats_col.insert_one({
-                        "participants": participants,
-                        "messages": [message_doc],
-                        "created_at": datetime.now()
-                    })
+        # The header and its unread badge render inside the live panel, after it marked the thread read
+        show_chat_panel(
+            emp_id, hr_id, "HR", "Your message to HR:",
+            "You have no messages yet. Send a message to start a conversation with HR.",
+            title="✉️ Messages with HR"
+        )
 
-                st.success("Message sent!")
-                st.rerun()
+        with st.expander("🔎 Search my messages, leaves & announcements"):
+            search.show_search_panel(emp_id, "employee", key="emp_search")
     
     except Exception as e:
         st.error(f"An error occurred: {str(e)}")
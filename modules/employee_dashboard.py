@@ -1,9 +1,39 @@
 import streamlit as st
 import pandas as pd
 from db import attendance_col, leaves_col
-from modules import communication  # Import the new communication module
-from datetime import datetime, date
+from modules import communication, work_calendar, monitoring
+from modules.attendance_schema import date_filter, to_day
+from datetime import datetime, date, time
 
+def _month_attendance_percentage(employee_id, location, today):
+    """
+    Present working days / expected working days this month. Days on approved leave
+    are not expected, and presence on a weekend or holiday does not count.
+    """
+    start_of_month = today.replace(day=1)
+    present_dates = {
+        to_day(record["date"]).date()
+        for record in attendance_col.find(
+            {"employee_id": employee_id, **date_filter(gte=start_of_month), "status": "present"}, {"date": 1}
+        )
+    }
+    present_days = sum(1 for day in present_dates if day <= today and work_calendar.is_working_day(day, location))
+    expected = work_calendar.count_working_days(start_of_month, today, location)
+    month_start, month_end = datetime.combine(start_of_month, time.min), datetime.combine(today, time.min)
+    for leave in leaves_col.find(
+        {"employee_id": employee_id, "status": "approved", "start_date": {"$lte": month_end}, "end_date": {"$gte": month_start}},
+        {"start_date": 1, "end_date": 1, "start_day_type": 1, "end_day_type": 1}
+    ):
+        # Only the part of the leave inside this month so far, keeping half days at its own ends
+        clipped = dict(leave)
+        if leave["start_date"] < month_start:
+            clipped.update(start_date=month_start, start_day_type="full day")
+        if leave["end_date"] > month_end:
+            clipped.update(end_date=month_end, end_day_type="full day")
+        expected -= work_calendar.leave_working_days(clipped, location)
+    return min(100.0, present_days / expected * 100) if expected > 0 else 0
+
+@monitoring.track_page
 def show_employee_dashboard():
     """
     Displays a personalized dashboard for the logged-in employee,
@@ -12,6 +42,7 @@ def show_employee_dashboard():
     st.title(f"My Dashboard")
     user_info = st.session_state.user_info
     employee_id = user_info['employee_id']
+    location = work_calendar.get_user_location(employee_id)
 
     # --- NEW: Show the latest company-wide announcement ---
     communication.show_announcement_banner()
@@ -25,18 +56,8 @@ def show_employee_dashboard():
         # --- Quick Stats Row ---
         col1, col2 = st.columns(2)
         with col1:
-            # Calculate attendance percentage for the current month
-            today = date.today()
-            start_of_month = today.replace(day=1).strftime('%Y-%m-%d')
-            
-            present_days = attendance_col.count_documents({
-                "employee_id": employee_id,
-                "date": {"$gte": start_of_month},
-                "status": "present"
-            })
-            # Use the current day of the month as the number of working days so far
-            total_work_days_so_far = today.day 
-            attendance_percentage = (present_days / total_work_days_so_far) * 100 if total_work_days_so_far > 0 else 0
+            # Only working days that were not on approved leave count towards the percentage
+            attendance_percentage = _month_attendance_percentage(employee_id, location, date.today())
             st.metric("This Month's Attendance", f"{attendance_percentage:.1f}%")
 
         with col2:
@@ -63,15 +84,11 @@ def show_employee_dashboard():
 
     with tab3:
         st.subheader("Upcoming Company Holidays")
-        # In a real application, this data would come from the database
-        holidays = {
-            "Diwali": "2025-11-01",
-            "Christmas Day": "2025-12-25",
-            "New Year's Day": "2026-01-01",
-            "Republic Day": "2026-01-26"
-        }
-        for holiday, hdate in holidays.items():
-            st.markdown(f"- **{holiday}**: {datetime.strptime(hdate, '%Y-%m-%d').strftime('%A, %d %B %Y')}")
+        holidays = work_calendar.upcoming_holidays(location)
+        if not holidays:
+            st.info("No upcoming holidays configured.")
+        for hdate, holiday in holidays:
+            st.markdown(f"- **{holiday}**: {hdate.strftime('%A, %d %B %Y')}")
         
         st.divider()
         st.subheader("Company Documents")
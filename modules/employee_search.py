@@ -0,0 +1,183 @@
+import re
+import threading
+import time
+import streamlit as st
+from pymongo import UpdateOne
+from db import users_col
+from modules.tenancy import current_tenant
+
+# Typeahead employee search. Every user document carries `search_keys`: lowercased
+# tokens of the full name, username, employee ID and department, with a multikey
+# index. A query like "dav eng" becomes one anchored regex per token ("^dav", "^eng"),
+# which MongoDB answers with an index range scan instead of a collection scan.
+# Hot prefixes are served from a small in-process trie with a short TTL.
+
+MAX_RESULTS = 20
+CACHE_TTL_SECONDS = 60
+CACHE_MAX_PREFIXES = 2000
+PROJECTION = {"employee_id": 1, "full_name": 1, "username": 1, "department": 1, "role": 1}
+
+_keys_backfilled = set()  # tenants whose users have been backfilled
+
+
+def search_keys_for(user):
+    """Lowercased tokens (whole values and their words) a user can be found by."""
+    keys = set()
+    for field in ("full_name", "username", "employee_id", "department"):
+        value = str(user.get(field) or "").lower().strip()
+        if value:
+            keys.add(value)
+            keys.update(re.findall(r"\w+", value))
+    return sorted(keys)
+
+
+def with_search_keys(user):
+    """Returns the user document with its `search_keys` filled in (use on insert/update)."""
+    return dict(user, search_keys=search_keys_for(user))
+
+
+def ensure_search_keys():
+    """Fills `search_keys` for users created before search existed (once per tenant and process)."""
+    tenant_id = current_tenant()
+    if tenant_id in _keys_backfilled:
+        return
+    missing = list(users_col.find({"search_keys": {"$exists": False}}, PROJECTION))
+    if missing:
+        users_col.bulk_write(
+            [UpdateOne({"_id": u["_id"]}, {"$set": {"search_keys": search_keys_for(u)}}) for u in missing],
+            ordered=False
+        )
+    _keys_backfilled.add(tenant_id)
+
+
+# --- In-process prefix cache ---
+class _TrieNode:
+    __slots__ = ("children", "results", "complete", "cached_at")
+
+    def __init__(self):
+        self.children = {}
+        self.results = None
+        self.complete = False
+        self.cached_at = 0.0
+
+
+class PrefixCache:
+    """
+    Trie of recently searched prefixes. A node holds the top matches for its prefix;
+    when a shorter prefix returned fewer than MAX_RESULTS ("complete"), any longer
+    prefix is answered by filtering those results without touching the database.
+    """
+
+    def __init__(self, ttl=CACHE_TTL_SECONDS, max_prefixes=CACHE_MAX_PREFIXES):
+        self.ttl = ttl
+        self.max_prefixes = max_prefixes
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._root = _TrieNode()
+            self._size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _fresh(self, node):
+        return node.results is not None and time.time() - node.cached_at < self.ttl
+
+    def get(self, key):
+        with self._lock:
+            node = self._root
+            best_complete = node if self._fresh(node) and node.complete else None
+            for char in key:
+                node = node.children.get(char)
+                if node is None:
+                    break
+                if self._fresh(node) and node.complete:
+                    best_complete = node
+            else:
+                if self._fresh(node):
+                    self.hits += 1
+                    return node.results
+            if best_complete is not None:
+                self.hits += 1
+                return [u for u in best_complete.results if _matches(u, key)]
+        self.misses += 1
+        return None
+
+    def put(self, key, results, complete):
+        with self._lock:
+            if self._size >= self.max_prefixes:
+                self._root, self._size = _TrieNode(), 0
+            node = self._root
+            for char in key:
+                node = node.children.setdefault(char, _TrieNode())
+            if node.results is None:
+                self._size += 1
+            node.results, node.complete, node.cached_at = results, complete, time.time()
+
+
+_cache = PrefixCache()
+
+
+def _tokens(query):
+    return query.lower().split()
+
+
+def _matches(user, key):
+    keys = search_keys_for(user)
+    return all(any(k.startswith(token) for k in keys) for token in _tokens(key.split("|", 2)[2]))
+
+
+def invalidate():
+    """Drops cached results after a user is created, renamed or deleted in this process."""
+    _cache.clear()
+
+
+def search_employees(query, role=None, limit=MAX_RESULTS):
+    """Top `limit` users matching every token of `query` by prefix, sorted by name."""
+    tokens = _tokens(query)
+    if not tokens:
+        return []
+    cache_key = f"{current_tenant()}|{role or '*'}|{' '.join(tokens)}"
+    if limit == MAX_RESULTS:
+        cached = _cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+    ensure_search_keys()
+    mongo_query = {"$and": [{"search_keys": {"$regex": f"^{re.escape(token)}"}} for token in tokens]}
+    if role:
+        mongo_query["role"] = role
+    results = list(users_col.find(mongo_query, PROJECTION).sort("full_name", 1).limit(limit))
+    if limit == MAX_RESULTS:
+        _cache.put(cache_key, results, complete=len(results) < limit)
+    return results
+
+
+def cache_stats():
+    return {"hits": _cache.hits, "misses": _cache.misses}
+
+
+# --- Streamlit picker ---
+def _label(user):
+    return f"{user.get('full_name', 'N/A')} ({user.get('username') or user.get('employee_id')})"
+
+
+def employee_picker(label, key, role=None, default=None):
+    """
+    Drop-in replacement for a selectbox over every user: a search box plus a
+    selectbox of the top matches. `default` (a user dict) is offered while the
+    search box is empty. Returns the selected user (employee_id, full_name,
+    username, department, role) or None.
+    """
+    query = st.text_input(f"🔍 {label}", key=f"{key}_query", placeholder="Type a name, username, ID or department")
+    options = search_employees(query, role=role) if query.strip() else ([default] if default else [])
+    if query.strip() and not options:
+        st.caption("No matching employees.")
+        return None
+    if not options:
+        return None
+    selected = st.selectbox(label, options=options, format_func=_label, key=f"{key}_select", label_visibility="collapsed")
+    if query.strip() and len(options) == MAX_RESULTS:
+        st.caption(f"Showing the first {MAX_RESULTS} matches — keep typing to narrow down.")
+    return selected
@@ -0,0 +1,208 @@
+import os
+from datetime import datetime, timedelta, time
+from bson.objectid import ObjectId
+from pymongo import InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError
+from db import users_col, leaves_col, attendance_col, punch_events_col
+from modules import work_calendar
+from modules.attendance_schema import SCHEMA_VERSION, date_filter, to_day
+from modules.punch_events import EVENT_OUT, rebuild_daily_records, stored_event
+
+# End-of-day close. Once a day is over every employee gets exactly one attendance
+# record for it: punches left open are closed according to AUTO_CLOSE_POLICY, and
+# employees without a record are marked on_leave (approved leave covers the day),
+# holiday (not a working day at their location) or absent. Absences are therefore
+# stored instead of inferred, and a forgotten Punch Out no longer leaves a record
+# without worked_hours. A run costs a handful of bulk operations regardless of
+# headcount and is idempotent, so a missed day can simply be closed later.
+
+# "shift_end": close at SHIFT_END; "max_hours": close AUTO_CLOSE_MAX_HOURS after the
+# open punch; "zero": close at the open punch itself (the open segment counts nothing)
+AUTO_CLOSE_POLICIES = ("shift_end", "max_hours", "zero")
+AUTO_CLOSE_POLICY = os.getenv("AUTO_CLOSE_POLICY", "shift_end")
+SHIFT_END = time.fromisoformat(os.getenv("SHIFT_END", "18:00"))
+AUTO_CLOSE_MAX_HOURS = float(os.getenv("AUTO_CLOSE_MAX_HOURS", "8"))
+AUTO_CLOSE_SOURCE = "auto_close"
+_MARK_FIELDS = ("holiday_name", "leave_id", "leave_type", "half_day")
+
+
+def close_time(open_in, day, policy=AUTO_CLOSE_POLICY):
+    """When an open segment started at `open_in` is closed under `policy` (never past the day)."""
+    if policy == "shift_end":
+        closed_at = max(open_in, datetime.combine(to_day(day).date(), SHIFT_END))
+    elif policy == "max_hours":
+        closed_at = open_in + timedelta(hours=AUTO_CLOSE_MAX_HOURS)
+    elif policy == "zero":
+        closed_at = open_in
+    else:
+        raise ValueError(f"Unknown auto-close policy {policy!r} (expected one of {', '.join(AUTO_CLOSE_POLICIES)})")
+    return min(closed_at, to_day(day) + timedelta(days=1) - timedelta(seconds=1))
+
+
+# --- Open punches ---
+def _nativize_dates(records, day):
+    """
+    Gives legacy string-dated records the native date (as the date migration would),
+    so re-deriving them updates the record instead of adding a second one.
+    Returns the ids that could not be converted (a native record already exists).
+    """
+    legacy = [r for r in records if isinstance(r.get("date"), str)]
+    if not legacy:
+        return set()
+    try:
+        attendance_col.bulk_write([
+            UpdateOne({"_id": r["_id"], "date": r["date"]}, {"$set": {"date": day, "schema_version": SCHEMA_VERSION}})
+            for r in legacy
+        ], ordered=False)
+    except BulkWriteError as e:
+        return {legacy[err["index"]]["_id"] for err in e.details.get("writeErrors", [])}
+    return set()
+
+
+def close_open_punches(day, policy=AUTO_CLOSE_POLICY):
+    """
+    Adds a punch-out event for every record of `day` whose last segment is still
+    open, then re-derives those records in one bulk write. Returns the number closed.
+    Employees already auto-closed for the day are skipped, so re-runs add nothing.
+    """
+    day = to_day(day)
+    records = list(attendance_col.find(
+        {**date_filter(equals=day), "status": "present", "punch_out": {"$exists": False}},
+        {"employee_id": 1, "date": 1, "punch_in": 1, "segments": 1}
+    ))
+    if not records:
+        return 0
+    already_closed = set(punch_events_col.distinct("meta.employee_id", {
+        "meta.employee_id": {"$in": [r["employee_id"] for r in records]},
+        "ts": {"$gte": day, "$lt": day + timedelta(days=1)},
+        "source": AUTO_CLOSE_SOURCE
+    }))
+    conflicts = _nativize_dates(records, day)
+    events = []
+    for record in records:
+        if record["employee_id"] in already_closed or record["_id"] in conflicts:
+            continue
+        segments = record.get("segments") or []
+        open_in = segments[-1]["in"] if segments else record.get("punch_in")
+        if not isinstance(open_in, datetime):
+            continue
+        events.append({
+            "_id": ObjectId(), "employee_id": record["employee_id"], "type": EVENT_OUT,
+            "ts": close_time(open_in, day, policy), "source": AUTO_CLOSE_SOURCE
+        })
+    if not events:
+        return 0
+    punch_events_col.insert_many([stored_event(event) for event in events], ordered=False)
+    employee_ids = [event["employee_id"] for event in events]
+    rebuild_daily_records({(employee_id, day) for employee_id in employee_ids})
+    attendance_col.update_many(
+        {"employee_id": {"$in": employee_ids}, **date_filter(equals=day)},
+        {"$set": {"auto_closed": True, "auto_close_policy": policy}}
+    )
+    return len(events)
+
+
+# --- Missing records ---
+def _approved_leaves_on(day):
+    """{employee_id: leave} for approved leaves covering `day`."""
+    return {
+        leave["employee_id"]: leave
+        for leave in leaves_col.find(
+            {"status": "approved", "start_date": {"$lte": day}, "end_date": {"$gte": day}},
+            {"employee_id": 1, "leave_type": 1, "start_date": 1, "end_date": 1, "start_day_type": 1, "end_day_type": 1}
+        )
+    }
+
+
+def _half_day(leave, day):
+    if to_day(leave["start_date"]) == day and leave.get("start_day_type", "full day") != "full day":
+        return leave["start_day_type"]
+    if to_day(leave["end_date"]) == day and leave.get("end_day_type", "full day") != "full day":
+        return leave["end_day_type"]
+    return None
+
+
+def _expected_status(user, day, leave, holidays_by_location):
+    """The status an employee without punches gets for `day`, plus the fields explaining it."""
+    location = user.get("location") or work_calendar.DEFAULT_LOCATION
+    if not work_calendar.is_working_day(day.date(), location):
+        if location not in holidays_by_location:
+            holidays_by_location[location] = work_calendar.get_holidays(location)
+        return {"status": "holiday", "holiday_name": holidays_by_location[location].get(day.date(), "Weekend")}
+    if leave:
+        fields = {"status": "on_leave", "leave_id": leave["_id"], "leave_type": leave.get("leave_type")}
+        half_day = _half_day(leave, day)
+        if half_day:
+            fields["half_day"] = half_day
+        return fields
+    return {"status": "absent"}
+
+
+def mark_missing_days(day):
+    """
+    Writes an on_leave / holiday / absent record for every employee without one
+    on `day`, and corrects earlier auto-marked records when a leave was approved
+    (or cancelled) since. Present employees on an approved full-day leave are
+    flagged `leave_conflict` for HR. Returns {status: records written}.
+    """
+    day = to_day(day)
+    existing = {
+        record["employee_id"]: record
+        for record in attendance_col.find(
+            date_filter(equals=day), {"employee_id": 1, "status": 1, "auto_marked": 1, "leave_conflict": 1}
+        )
+    }
+    leaves = _approved_leaves_on(day)
+    holidays_by_location = {}
+    now = datetime.now()
+    ops, counts = [], {}
+    for user in users_col.find(
+        {"role": {"$ne": "admin"}, "employee_id": {"$exists": True}},
+        {"employee_id": 1, "location": 1, "join_date": 1}
+    ):
+        employee_id = user["employee_id"]
+        joined = user.get("join_date")
+        if isinstance(joined, datetime) and to_day(joined) > day:
+            continue
+        leave = leaves.get(employee_id)
+        record = existing.get(employee_id)
+        if record is None:
+            fields = _expected_status(user, day, leave, holidays_by_location)
+            ops.append(InsertOne({
+                "employee_id": employee_id, "date": day, **fields,
+                "auto_marked": True, "marked_at": now, "schema_version": SCHEMA_VERSION
+            }))
+            label = fields["status"]
+        elif record.get("auto_marked"):
+            fields = _expected_status(user, day, leave, holidays_by_location)
+            if fields["status"] == record.get("status"):
+                continue
+            stale = {f: "" for f in _MARK_FIELDS if f not in fields}
+            ops.append(UpdateOne({"_id": record["_id"]}, {"$set": dict(fields, marked_at=now), **({"$unset": stale} if stale else {})}))
+            label = fields["status"]
+        elif record.get("status") == "present":
+            conflict = bool(leave) and _half_day(leave, day) is None
+            if conflict == bool(record.get("leave_conflict")):
+                continue
+            ops.append(UpdateOne({"_id": record["_id"]}, {"$set": {"leave_conflict": conflict}}))
+            label = "leave_conflict" if conflict else "conflict_cleared"
+        else:
+            continue
+        counts[label] = counts.get(label, 0) + 1
+    if ops:
+        attendance_col.bulk_write(ops, ordered=False)
+    return counts
+
+
+def close_day(day=None, policy=AUTO_CLOSE_POLICY, progress=print):
+    """
+    Closes one finished day (default: yesterday) for the current tenant.
+    Returns {"auto_closed": n, status: records written, ...}.
+    """
+    day = to_day(day or datetime.now() - timedelta(days=1))
+    if day >= to_day(datetime.now()):
+        raise ValueError("Only finished days can be closed.")
+    result = {"auto_closed": close_open_punches(day, policy)}
+    result.update(mark_missing_days(day))
+    progress(f"{day:%d-%b-%Y}: " + ", ".join(f"{count} {name}" for name, count in result.items()))
+    return result
@@ -0,0 +1,318 @@
+from datetime import datetime, time
+from bson.objectid import ObjectId
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import PyMongoError
+from db import start_session, leaves_col, users_col, leave_ledger_col, leave_balances_col
+from modules import absence_calendar, audit, work_calendar
+from modules.write_buffer import get_write_buffer
+
+# Leave types that accrue a balance, with the days credited each month.
+# Other types (maternity, LOP, ...) still get a balance document so "used" stays complete.
+ACCRUAL_RATES = {
+    "casual": 1.0,
+    "sick": 0.75,
+    "earned": 1.25
+}
+
+
+# Leave types offered by the leave form (stored lowercased)
+LEAVE_TYPES = ["casual", "sick", "earned", "maternity", "paternity", "loss of pay (lop)"]
+
+
+class LeaveOverlapError(ValueError):
+    """Raised when a new leave overlaps one of the employee's pending or approved leaves."""
+
+
+class SelfReviewError(PermissionError):
+    """Raised when a reviewer tries to approve or reject their own leave."""
+
+
+# --- Helper: Leave Length ---
+def leave_days(leave):
+    """Returns the working days a leave covers, counting half days as 0.5."""
+    location = work_calendar.get_user_location(leave["employee_id"])
+    return work_calendar.leave_working_days(leave, location)
+
+
+def _stored_days(leave):
+    """
+    The days a leave is worth: the value stored at submission, so later calendar
+    edits never change a debit or its credit back. Only legacy leaves without
+    `days` are counted from the calendar (call this outside transactions).
+    """
+    return leave["days"] if leave.get("days") is not None else leave_days(leave)
+
+
+def _run_in_transaction(callback):
+    """Runs callback(session) inside a MongoDB transaction and returns its result."""
+    with start_session() as session:
+        return session.with_transaction(callback)
+
+
+def _ledger_entry(leave, entry_type, days, actor_id):
+    return {
+        "employee_id": leave["employee_id"],
+        "leave_type": leave["leave_type"],
+        "entry_type": entry_type,
+        "days": days,
+        "leave_id": leave["_id"],
+        "actor_id": actor_id,
+        "ref": f"{entry_type}:{leave['_id']}",
+        "created_at": datetime.now()
+    }
+
+
+# --- Leave Submission ---
+def submit_leave(employee_id, leave_type, start_date, end_date, start_day_type, end_day_type, reason, attachment=None):
+    """
+    Creates a pending leave request (shared by the leave form and the HTTP API).
+    `attachment` is the reference returned by attachments.store_attachment().
+    Returns the inserted leave document. Raises LeaveOverlapError on a self-overlap.
+    """
+    buffer = get_write_buffer()
+    clash = None
+    if buffer.online:
+        try:
+            clash = absence_calendar.find_overlapping_leave(employee_id, start_date, end_date, start_day_type, end_day_type)
+        except PyMongoError:
+            pass  # Went offline since the last check: journal the request like any offline one
+        if clash:
+            raise LeaveOverlapError(
+                f"You already have a {clash['status']} {clash['leave_type']} leave from "
+                f"{clash['start_date']:%d-%b-%Y} to {clash['end_date']:%d-%b-%Y}."
+            )
+
+    new_leave = {
+        "employee_id": employee_id,
+        "leave_type": leave_type.lower(),
+        "start_date": datetime.combine(start_date, time.min),
+        "end_date": datetime.combine(end_date, time.min),
+        "start_day_type": start_day_type.lower(),
+        "end_day_type": end_day_type.lower(),
+        "reason": reason,
+        "attachment_filename": attachment["filename"] if attachment else None,
+        "attachment": attachment,
+        "status": "pending",
+        "applied_at": datetime.now()
+    }
+    new_leave["days"] = leave_days(new_leave)
+    # Journaled locally with a pre-generated _id; replay is an idempotent insert.
+    new_leave["_id"] = ObjectId()
+    buffer.append(leaves_col.name, "insert", new_leave, employee_id)
+    return new_leave
+
+
+# --- Ledger Operations ---
+def approve_leave(leave_id, approver_id):
+    """
+    Approves a pending leave and debits the employee's balance atomically.
+    Returns False if the leave was no longer pending; raises SelfReviewError if it is
+    the approver's own.
+    """
+    pending = leaves_col.find_one({"_id": leave_id, "status": "pending"})
+    if not pending:
+        return False
+    if pending["employee_id"] == approver_id:
+        raise SelfReviewError("You cannot review your own leave.")
+    days = _stored_days(pending)
+
+    def callback(session):
+        leave = leaves_col.find_one_and_update(
+            {"_id": leave_id, "status": "pending", "employee_id": {"$ne": approver_id}},
+            {"$set": {"status": "approved", "days": days, "reviewed_by": approver_id, "reviewed_at": datetime.now()}},
+            return_document=ReturnDocument.AFTER,
+            session=session
+        )
+        if not leave:
+            return False
+        leave_ledger_col.insert_one(_ledger_entry(leave, "debit", -days, approver_id), session=session)
+        leave_balances_col.update_one(
+            {"employee_id": leave["employee_id"], "leave_type": leave["leave_type"]},
+            {"$inc": {"balance": -days, "used": days}, "$set": {"updated_at": datetime.now()}},
+            upsert=True,
+            session=session
+        )
+        return True
+
+    approved = _run_in_transaction(callback)
+    if approved:
+        audit.record(approver_id, "leave.approve", "leave", leave_id)
+    return approved
+
+
+def reject_leave(leave_id, approver_id):
+    """
+    Rejects a pending leave and records the decision in the ledger (no balance change).
+    Returns False if the leave was no longer pending; raises SelfReviewError if it is
+    the approver's own.
+    """
+    pending = leaves_col.find_one({"_id": leave_id, "status": "pending"}, {"employee_id": 1})
+    if not pending:
+        return False
+    if pending["employee_id"] == approver_id:
+        raise SelfReviewError("You cannot review your own leave.")
+
+    def callback(session):
+        leave = leaves_col.find_one_and_update(
+            {"_id": leave_id, "status": "pending", "employee_id": {"$ne": approver_id}},
+            {"$set": {"status": "rejected", "reviewed_by": approver_id, "reviewed_at": datetime.now()}},
+            return_document=ReturnDocument.AFTER,
+            session=session
+        )
+        if not leave:
+            return False
+        leave_ledger_col.insert_one(_ledger_entry(leave, "rejection", 0.0, approver_id), session=session)
+        return True
+
+    rejected = _run_in_transaction(callback)
+    if rejected:
+        audit.record(approver_id, "leave.reject", "leave", leave_id)
+    return rejected
+
+
+def review_leaves(leave_ids, action, reviewer_id):
+    """
+    Approves or rejects many leaves in one transaction: one guarded bulk_write on the
+    leaves, one insert_many on the ledger and (for approvals) one bulk_write on balances.
+    `action` is "approve" or "reject". Returns {"reviewed": [ids], "conflicts": [ids],
+    "own": [ids]}: conflicts were no longer pending, own are the reviewer's own leaves
+    (never reviewed).
+    """
+    status = {"approve": "approved", "reject": "rejected"}[action]
+    leave_ids = list(leave_ids)
+    # Days are settled before the transaction (legacy leaves need calendar reads)
+    days_by_id, own = {}, []
+    for leave in leaves_col.find({"_id": {"$in": leave_ids}, "status": "pending"}):
+        if leave["employee_id"] == reviewer_id:
+            own.append(leave["_id"])
+        else:
+            days_by_id[leave["_id"]] = _stored_days(leave)
+
+    def callback(session):
+        now = datetime.now()
+        pending = list(leaves_col.find(
+            {"_id": {"$in": list(days_by_id)}, "status": "pending", "employee_id": {"$ne": reviewer_id}}, session=session
+        ))
+        if not pending:
+            return []
+        leaves_col.bulk_write([
+            UpdateOne(
+                {"_id": leave["_id"], "status": "pending", "employee_id": {"$ne": reviewer_id}},
+                {"$set": {"status": status, "days": days_by_id[leave["_id"]], "reviewed_by": reviewer_id, "reviewed_at": now}}
+            )
+            for leave in pending
+        ], ordered=False, session=session)
+
+        entries, debits = [], {}
+        for leave in pending:
+            if action == "approve":
+                days = days_by_id[leave["_id"]]
+                entries.append(_ledger_entry(leave, "debit", -days, reviewer_id))
+                key = (leave["employee_id"], leave["leave_type"])
+                debits[key] = debits.get(key, 0) + days
+            else:
+                entries.append(_ledger_entry(leave, "rejection", 0.0, reviewer_id))
+        leave_ledger_col.insert_many(entries, ordered=False, session=session)
+        if debits:
+            leave_balances_col.bulk_write([
+                UpdateOne(
+                    {"employee_id": employee_id, "leave_type": leave_type},
+                    {"$inc": {"balance": -days, "used": days}, "$set": {"updated_at": now}},
+                    upsert=True
+                )
+                for (employee_id, leave_type), days in debits.items()
+            ], ordered=False, session=session)
+        return [leave["_id"] for leave in pending]
+
+    reviewed = _run_in_transaction(callback)
+    for leave_id in reviewed:
+        audit.record(reviewer_id, f"leave.{action}", "leave", leave_id, {"bulk": True})
+    done = set(reviewed) | set(own)
+    return {"reviewed": reviewed, "conflicts": [i for i in leave_ids if i not in done], "own": own}
+
+
+def cancel_leave(leave_id, employee_id):
+    """
+    Cancels an employee's pending or approved leave.
+    Approved leaves get back exactly the days debited when they were approved.
+    """
+    debit = leave_ledger_col.find_one({"ref": f"debit:{leave_id}"}, {"days": 1})
+    leave = leaves_col.find_one({"_id": leave_id, "employee_id": employee_id})
+    if not leave:
+        return False
+    credit = -debit["days"] if debit else _stored_days(leave)
+
+    def callback(session):
+        leave = leaves_col.find_one_and_update(
+            {"_id": leave_id, "employee_id": employee_id, "status": {"$in": ["pending", "approved"]}},
+            {"$set": {"status": "cancelled", "cancelled_at": datetime.now()}},
+            return_document=ReturnDocument.BEFORE,
+            session=session
+        )
+        if not leave:
+            return False
+        days = credit if leave["status"] == "approved" else 0.0
+        leave_ledger_col.insert_one(_ledger_entry(leave, "cancellation", days, employee_id), session=session)
+        if days:
+            leave_balances_col.update_one(
+                {"employee_id": employee_id, "leave_type": leave["leave_type"]},
+                {"$inc": {"balance": days, "used": -days}, "$set": {"updated_at": datetime.now()}},
+                upsert=True,
+                session=session
+            )
+        return True
+
+    cancelled = _run_in_transaction(callback)
+    if cancelled:
+        audit.record(employee_id, "leave.cancel", "leave", leave_id)
+    return cancelled
+
+
+def apply_monthly_accrual(period=None):
+    """
+    Credits the monthly accrual to every employee as one bulk operation per collection.
+    `period` is a "YYYY-MM" string; a period is only ever applied once.
+    Returns the number of employees credited.
+    """
+    period = period or datetime.now().strftime("%Y-%m")
+    run_ref = f"accrual-run:{period}"
+    if leave_ledger_col.find_one({"ref": run_ref}, {"_id": 1}):
+        return 0
+
+    employee_ids = [u["employee_id"] for u in users_col.find({"role": {"$ne": "admin"}}, {"employee_id": 1}) if u.get("employee_id")]
+    if not employee_ids:
+        return 0
+
+    now = datetime.now()
+    ledger_entries = []
+    balance_updates = []
+    for emp_id in employee_ids:
+        for leave_type, days in ACCRUAL_RATES.items():
+            ledger_entries.append({
+                "employee_id": emp_id, "leave_type": leave_type, "entry_type": "accrual",
+                "days": days, "period": period, "created_at": now
+            })
+            balance_updates.append(UpdateOne(
+                {"employee_id": emp_id, "leave_type": leave_type},
+                {"$inc": {"balance": days, "accrued": days}, "$set": {"updated_at": now}},
+                upsert=True
+            ))
+
+    def callback(session):
+        leave_ledger_col.insert_many(ledger_entries, ordered=False, session=session)
+        leave_balances_col.bulk_write(balance_updates, ordered=False, session=session)
+        leave_ledger_col.insert_one({"ref": run_ref, "entry_type": "accrual_run", "period": period, "created_at": now}, session=session)
+
+    _run_in_transaction(callback)
+    return len(employee_ids)
+
+
+# --- Balance Reads ---
+def get_balances(employee_id):
+    """Returns {leave_type: balance document} for an employee with a single indexed read."""
+    return {doc["leave_type"]: doc for doc in leave_balances_col.find({"employee_id": employee_id})}
+
+
+def get_total_leave_taken(employee_id):
+    """Returns the total number of approved leave days taken by an employee."""
+    return sum(doc.get("used", 0) for doc in get_balances(employee_id).values())
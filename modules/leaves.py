@@ -1,9 +1,12 @@
 import streamlit as st
 import pandas as pd
 from db import leaves_col, users_col
-from datetime import datetime, time
+from modules import absence_calendar, archive, attachments, leave_ledger, work_calendar, monitoring
+from modules.write_buffer import get_write_buffer
+import plotly.graph_objects as go
+from datetime import datetime, time, timedelta
 from bson.objectid import ObjectId
-import requests 
+from pymongo.errors import PyMongoError
 import json     
 
 # --- NEW: Real AI Letter Generation Function (using Ollama) ---
@@ -11,6 +14,7 @@ def get_ai_generated_reason(prompt, user_name):
     """
     Calls a local Ollama model to generate a formal leave letter.
     """
+    import requests  # Only needed for the AI helper, so it is not loaded with the page
     st.toast("🤖 Contacting local AI... please wait.")
     
     ollama_url = "http://localhost:11434/api/generate"
@@ -52,19 +56,97 @@ def get_ai_generated_reason(prompt, user_name):
         return f"---ERROR: {e}---\n\nUser Prompt: {prompt}"
 
 
-# --- (Placeholder) Leave Balance Function ---
+# --- Leave Balance Function ---
 def get_leave_balance(employee_id):
     """
-    Simulates fetching a user's leave balance.
+    Fetches a user's running leave balance from the leave ledger.
     """
-    balance = {
-        "casual": 10,
-        "sick": 8,
-        "earned": 12
+    balances = leave_ledger.get_balances(employee_id)
+    return {
+        leave_type: balances.get(leave_type, {}).get("balance", 0)
+        for leave_type in leave_ledger.ACCRUAL_RATES
     }
-    return balance
+
+# --- Helper Function for Leave Attachments ---
+def show_leave_attachment(leave):
+    """
+    Shows the attachment linked to a leave. The file is only streamed from
+    GridFS when HR explicitly asks to open it.
+    """
+    attachment = leave.get("attachment")
+    if not attachment:
+        if leave.get("attachment_filename"):
+            st.warning(f"📎 {leave['attachment_filename']} (file was not stored)")
+        return
+
+    size_label = attachments.format_size(attachment.get("length", 0))
+    st.success(f"📎 Attached File: {attachment['filename']} ({size_label})")
+
+    open_key = f"open_attachment_{leave['_id']}"
+    if not st.session_state.get(open_key):
+        if st.button("Open Attachment", key=f"btn_{open_key}"):
+            st.session_state[open_key] = True
+            st.rerun(scope="fragment")
+        return
+
+    content_type = attachment.get("content_type", "")
+    if content_type.startswith("image/") and attachment.get("length", 0) <= attachments.PREVIEW_LIMIT:
+        st.image(attachments.preview_bytes(attachment["file_id"]), width=300)
+
+    # The file itself is streamed by api.py; Streamlit only holds a short-lived link
+    link_key = f"download_link_{leave['_id']}"
+    if st.button("📥 Prepare Download", key=f"btn_{link_key}"):
+        st.session_state[link_key] = attachments.create_download_link(
+            attachment["file_id"], st.session_state.user_info["employee_id"]
+        )
+    if st.session_state.get(link_key):
+        st.link_button(f"⬇️ Download {attachment['filename']}", st.session_state[link_key])
+        st.caption(f"The link expires after {attachments.DOWNLOAD_LINK_MINUTES} minutes.")
+
 
 # --- Helper Function for Admin Tabs ---
+@st.fragment
+@monitoring.track_page
+def show_leave_card(leave, applicant_name):
+    """
+    One leave request card. Approve/Reject only re-run this card, not the page.
+    """
+    reviewed_key = f"reviewed_{leave['_id']}"
+    status = st.session_state.get(reviewed_key, leave['status'])
+
+    with st.container(border=True):
+        col1, col2 = st.columns([2, 1])
+        with col1:
+            st.markdown(f"**Applicant:** {applicant_name} (`{leave['employee_id']}`)")
+            st.write(f"**Type:** {leave.get('leave_type', 'N/A').capitalize()}")
+            st.write(f"**Dates:** {leave['start_date'].strftime('%d-%b-%Y')} ({leave.get('start_day_type')}) to {leave['end_date'].strftime('%d-%b-%Y')} ({leave.get('end_day_type')})")
+            if leave.get("days") is not None:
+                st.write(f"**Duration:** {leave['days']:g} working days")
+            st.info(f"**Reason:**\n\n{leave.get('reason', 'N/A')}")
+
+            show_leave_attachment(leave)
+        
+        with col2:
+            reviewer_id = st.session_state.user_info['employee_id']
+            if status == "pending" and leave['employee_id'] == reviewer_id:
+                st.write("---")
+                st.caption("🚫 You cannot review your own leave.")
+            elif status == "pending":
+                st.write("---") 
+                if st.button("Approve", key=f"approve_{leave['_id']}", width='stretch'):
+                    if not leave_ledger.approve_leave(ObjectId(leave['_id']), reviewer_id):
+                        st.warning("This leave was already reviewed.")
+                    st.session_state[reviewed_key] = "approved"
+                    st.rerun(scope="fragment")
+                if st.button("Reject", key=f"reject_{leave['_id']}", type="primary", width='stretch'):
+                    if not leave_ledger.reject_leave(ObjectId(leave['_id']), reviewer_id):
+                        st.warning("This leave was already reviewed.")
+                    st.session_state[reviewed_key] = "rejected"
+                    st.rerun(scope="fragment")
+            else:
+                st.markdown(f"**Status:** {status.capitalize()}")
+
+
 def display_leave_requests(status_to_display):
     """
     Reusable function to display leave requests in the admin tabs.
@@ -75,35 +157,157 @@ def display_leave_requests(status_to_display):
         st.info(f"No {status_to_display} leave applications found.")
         return
 
+    # Look up all applicants with one query instead of one per card
+    applicant_ids = list({leave['employee_id'] for leave in requests})
+    applicant_names = {
+        u['employee_id']: u.get("full_name", "Unknown User")
+        for u in users_col.find({"employee_id": {"$in": applicant_ids}}, {"employee_id": 1, "full_name": 1})
+    }
+
     for leave in requests:
-        applicant_user = users_col.find_one({"employee_id": leave['employee_id']})
-        applicant_name = applicant_user.get("full_name", "Unknown User") if applicant_user else "Unknown User"
-        
-        with st.container(border=True):
-            col1, col2 = st.columns([2, 1])
-            with col1:
-                st.markdown(f"**Applicant:** {applicant_name} (`{leave['employee_id']}`)")
-                st.write(f"**Type:** {leave.get('leave_type', 'N/A').capitalize()}")
-                st.write(f"**Dates:** {leave['start_date'].strftime('%d-%b-%Y')} ({leave.get('start_day_type')}) to {leave['end_date'].strftime('%d-%b-%Y')} ({leave.get('end_day_type')})")
-                st.info(f"**Reason:**\n\n{leave.get('reason', 'N/A')}")
-
-                if leave.get("attachment_filename"):
-                    st.success(f"📎 Attached File: {leave['attachment_filename']}")
-            
-            with col2:
-                if status_to_display == "pending":
-                    st.write("---") 
-                    if st.button("Approve", key=f"approve_{leave['_id']}", width='stretch'):
-                        leaves_col.update_one({"_id": ObjectId(leave['_id'])}, {"$set": {"status": "approved"}})
-                        st.rerun()
-                    if st.button("Reject", key=f"reject_{leave['_id']}", type="primary", width='stretch'):
-                        leaves_col.update_one({"_id": ObjectId(leave['_id'])}, {"$set": {"status": "rejected"}})
-                        st.rerun()
-                else:
-                    st.markdown(f"**Status:** {status_to_display.capitalize()}")
+        show_leave_card(leave, applicant_names.get(leave['employee_id'], "Unknown User"))
+
+
+# --- Bulk Review of Pending Leaves ---
+@st.fragment
+@monitoring.track_page
+def show_pending_leaves_grid():
+    """
+    Selectable table of pending leaves with filters. "Approve/Reject selected" run as
+    one guarded bulk operation, and only this fragment re-runs.
+    """
+    reviewer_id = st.session_state.user_info['employee_id']
+    # Reviewers never see their own requests here (leave_ledger refuses them anyway)
+    pending = list(leaves_col.find(
+        {"status": "pending", "employee_id": {"$ne": reviewer_id}},
+        {"employee_id": 1, "leave_type": 1, "start_date": 1, "end_date": 1, "days": 1, "reason": 1, "applied_at": 1}
+    ).sort("applied_at", 1))
+    if "bulk_review_result" in st.session_state:
+        st.success(st.session_state.pop("bulk_review_result"))
+    if not pending:
+        st.info("No pending leave applications found.")
+        return
+
+    applicants = {
+        u['employee_id']: u
+        for u in users_col.find(
+            {"employee_id": {"$in": list({l['employee_id'] for l in pending})}},
+            {"employee_id": 1, "full_name": 1, "department": 1}
+        )
+    }
+    df = pd.DataFrame([{
+        "Select": False,
+        "id": str(l['_id']),
+        "Applicant": applicants.get(l['employee_id'], {}).get("full_name", "Unknown User"),
+        "Department": applicants.get(l['employee_id'], {}).get("department", "N/A"),
+        "Type": l.get('leave_type', 'N/A').capitalize(),
+        "Start": l['start_date'].date(),
+        "End": l['end_date'].date(),
+        "Days": l.get('days'),
+        "Reason": (l.get('reason') or "")[:80]
+    } for l in pending])
+
+    f1, f2, f3 = st.columns(3)
+    types = f1.multiselect("Type", sorted(df["Type"].unique()), key="bulk_filter_type")
+    departments = f2.multiselect("Department", sorted(df["Department"].unique()), key="bulk_filter_department")
+    date_range = f3.date_input("Starting between", value=(), key="bulk_filter_dates")
+    if types:
+        df = df[df["Type"].isin(types)]
+    if departments:
+        df = df[df["Department"].isin(departments)]
+    if len(date_range) == 2:
+        df = df[(df["Start"] >= date_range[0]) & (df["Start"] <= date_range[1])]
+
+    select_all = st.checkbox(f"Select all {len(df)} shown", key="bulk_select_all")
+    df["Select"] = select_all
+    # The grid keeps its edits by row position: a new key whenever the filters, the rows
+    # shown or the data change, so a selection never carries over to different leaves
+    version = st.session_state.get("bulk_grid_version", 0)
+    signature = hash((tuple(types), tuple(departments), tuple(date_range), select_all, tuple(df["id"])))
+    edited = st.data_editor(
+        df, hide_index=True, use_container_width=True, key=f"bulk_leave_grid_{signature}_{version}",
+        column_config={"id": None, "Select": st.column_config.CheckboxColumn(required=True)},
+        disabled=[c for c in df.columns if c != "Select"]
+    )
+    selected = [ObjectId(i) for i in edited.loc[edited["Select"], "id"]]
+
+    b1, b2 = st.columns(2)
+    action = None
+    if b1.button(f"✅ Approve selected ({len(selected)})", disabled=not selected, width='stretch'):
+        action = "approve"
+    if b2.button(f"❌ Reject selected ({len(selected)})", disabled=not selected, type="primary", width='stretch'):
+        action = "reject"
+    if action:
+        result = leave_ledger.review_leaves(selected, action, reviewer_id)
+        message = f"{len(result['reviewed'])} leave(s) {action}d."
+        if result["conflicts"]:
+            message += f" {len(result['conflicts'])} skipped (already reviewed by someone else)."
+        if result["own"]:
+            message += f" {len(result['own'])} skipped (your own leave)."
+        st.session_state.bulk_review_result = message
+        st.session_state.bulk_grid_version = version + 1
+        st.rerun(scope="fragment")
+
+
+# --- Team Absence Calendar ---
+@st.fragment
+@monitoring.track_page
+def show_team_absence_calendar():
+    """Month view of who is out per department (approved + pending leaves and absences)."""
+    departments = ["All"] + sorted(d for d in users_col.distinct("department") if d)
+    c1, c2 = st.columns(2)
+    department = c1.selectbox("Department", departments, key="absence_department")
+    month = c2.date_input("Month", value=datetime.today().replace(day=1), key="absence_month")
+
+    start = month.replace(day=1)
+    end = (start + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+    members, merged, counts = absence_calendar.team_absence(department, start, end)
+    if not members:
+        st.info("No employees found in this department.")
+        return
+
+    headcount = len(members)
+    df = pd.DataFrame({"date": list(counts.keys()), "out": list(counts.values())})
+    df["coverage"] = (headcount - df["out"]) / headcount
+    df["working_day"] = [work_calendar.is_working_day(d) for d in df["date"]]
+    df["date"] = pd.to_datetime(df["date"])
+    df["week"] = df["date"].dt.isocalendar().week.astype(str)
+    df["weekday"] = df["date"].dt.strftime("%a")
+    df.loc[~df["working_day"], "out"] = None
+
+    fig = go.Figure(go.Heatmap(
+        x=df["weekday"], y=df["week"], z=df["out"],
+        text=df["date"].dt.strftime("%d"), texttemplate="%{text}",
+        customdata=df[["coverage"]],
+        colorscale="Reds", zmin=0,
+        hovertemplate="Out: %{z}<br>Coverage: %{customdata[0]:.0%}<extra></extra>"
+    ))
+    fig.update_layout(
+        title=f"People Out per Day ({headcount} in {department})",
+        xaxis=dict(categoryorder="array", categoryarray=["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]),
+        yaxis=dict(autorange="reversed", showticklabels=False),
+        height=300, margin=dict(l=0, r=0, t=40, b=10)
+    )
+    st.plotly_chart(fig, use_container_width=True)
+
+    low = df[df["working_day"] & (df["coverage"] < absence_calendar.COVERAGE_THRESHOLD)]
+    if not low.empty:
+        st.warning(
+            f"⚠️ Coverage below {absence_calendar.COVERAGE_THRESHOLD:.0%} on "
+            + ", ".join(low["date"].dt.strftime("%d-%b"))
+        )
+
+    day = st.date_input("Who is out on", value=max(start, min(datetime.today().date(), end)),
+                        min_value=start, max_value=end, key="absence_day")
+    out_ids = absence_calendar.who_is_out(merged, day)
+    if out_ids:
+        st.dataframe(pd.DataFrame({"Employee": [members.get(e, e) for e in out_ids]}), use_container_width=True, hide_index=True)
+    else:
+        st.success("Everyone is in. 🎉")
 
 
 # --- Main Page Function ---
+@monitoring.track_page
 def show_leaves_page():
     st.title("🌴 Leave Management")
     user_info = st.session_state.user_info
@@ -118,14 +322,18 @@ def show_leaves_page():
     if user_role in ['admin', 'hr', 'manager']:
         st.subheader("Review Leave Applications")
         
-        tab1, tab2, tab3 = st.tabs(["⏳ Pending", "✅ Approved", "❌ Rejected"])
+        tab1, tab2, tab3, tab4 = st.tabs(["⏳ Pending", "✅ Approved", "❌ Rejected", "🗓️ Team Calendar"])
 
         with tab1:
-            display_leave_requests("pending")
+            show_pending_leaves_grid()
+            if st.toggle("Review one by one (with reasons and attachments)", key="pending_cards"):
+                display_leave_requests("pending")
         with tab2:
             display_leave_requests("approved")
         with tab3:
             display_leave_requests("rejected")
+        with tab4:
+            show_team_absence_calendar()
     
     # --- EMPLOYEE VIEW ---
     if user_role == 'employee':
@@ -134,13 +342,34 @@ def show_leaves_page():
         st.subheader("Your Leave Balance")
         balance = get_leave_balance(user_info['employee_id'])
         kpi1, kpi2, kpi3 = st.columns(3)
-        kpi1.metric("Casual Leave", f"{balance['casual']} Days")
-        kpi2.metric("Sick Leave", f"{balance['sick']} Days")
-        kpi3.metric("Earned Leave", f"{balance['earned']} Days")
+        kpi1.metric("Casual Leave", f"{balance['casual']:g} Days")
+        kpi2.metric("Sick Leave", f"{balance['sick']:g} Days")
+        kpi3.metric("Earned Leave", f"{balance['earned']:g} Days")
+
+        cancellable = list(leaves_col.find(
+            {"employee_id": user_info['employee_id'], "status": {"$in": ["pending", "approved"]},
+             "start_date": {"$gte": datetime.combine(datetime.today(), time.min)}},
+            {"leave_type": 1, "start_date": 1, "end_date": 1, "status": 1}
+        ).sort("start_date", 1))
+        if cancellable:
+            with st.expander("↩️ Cancel an Upcoming Leave"):
+                cancel_map = {
+                    f"{l['leave_type'].capitalize()}: {l['start_date'].strftime('%d-%b-%Y')} to {l['end_date'].strftime('%d-%b-%Y')} ({l['status']})": l['_id']
+                    for l in cancellable
+                }
+                to_cancel = st.selectbox("Select leave", options=list(cancel_map.keys()))
+                if st.button("Cancel Leave", type="primary"):
+                    if leave_ledger.cancel_leave(cancel_map[to_cancel], user_info['employee_id']):
+                        st.success("Leave cancelled.")
+                    else:
+                        st.warning("This leave can no longer be cancelled.")
+                    st.rerun()
         st.divider()
 
         # --- 2. Application Form ---
         st.subheader("Apply for a New Leave")
+        if "leave_coverage_warning" in st.session_state:
+            st.warning(st.session_state.pop("leave_coverage_warning"))
         
         # --- 3. AI GENERATOR (MOVED OUTSIDE THE FORM) ---
         st.markdown("#### 🤖 AI Letter Generator")
@@ -195,28 +424,40 @@ def show_leaves_page():
                     st.error("Please provide a valid reason for your leave.")
                 elif start_date > end_date:
                     st.error("Error: Start date must be before or the same as the end date.")
+                elif attachment and not get_write_buffer().online:
+                    st.error("📴 Attachments cannot be uploaded while the database is unreachable. Submit without it or try again later.")
                 else:
-                    file_name = attachment.name if attachment else None
-                    
-                    leaves_col.insert_one({
-                        "employee_id": user_info['employee_id'],
-                        "leave_type": leave_type.lower(),
-                        "start_date": datetime.combine(start_date, time.min),
-                        "end_date": datetime.combine(end_date, time.min),
-                        "start_day_type": start_day_type.lower(),
-                        "end_day_type": end_day_type.lower(),
-                        "reason": reason, 
-                        "attachment_filename": file_name,
-                        "status": "pending", 
-                        "applied_at": datetime.now()
-                    })
+                    stored_attachment = attachments.store_attachment(attachment, user_info['employee_id']) if attachment else None
+                    try:
+                        # Checks for overlapping leaves when online; offline it only journals the request
+                        leave_ledger.submit_leave(
+                            user_info['employee_id'], leave_type, start_date, end_date,
+                            start_day_type, end_day_type, reason, stored_attachment
+                        )
+                    except leave_ledger.LeaveOverlapError as e:
+                        if stored_attachment:
+                            attachments.delete_unreferenced([stored_attachment["file_id"]])
+                        st.error(str(e))
+                        st.stop()
                     
                     st.session_state.generated_reason = ""
                     # --- THIS IS THE FIX ---
                     # We comment out the line that causes the crash.
                     # st.session_state.ai_prompt_text = "" 
                     # --- END OF FIX ---
-                    
+
+                    shortfalls = []
+                    if get_write_buffer().online:
+                        try:
+                            shortfalls = absence_calendar.coverage_shortfalls(user_info['employee_id'], start_date, end_date)
+                        except PyMongoError:
+                            pass  # The leave is journaled; the coverage hint is best effort
+                    if shortfalls:
+                        days = ", ".join(f"{day:%d-%b} ({coverage:.0%})" for day, coverage in shortfalls[:5])
+                        st.session_state.leave_coverage_warning = (
+                            f"⚠️ Team coverage drops below {absence_calendar.COVERAGE_THRESHOLD:.0%} on: {days}. "
+                            "Your manager may ask you to reschedule."
+                        )
                     st.success("Your leave application has been submitted successfully!")
                     st.rerun()
 
@@ -228,7 +469,11 @@ def show_leaves_page():
     if user_role == 'employee':
         query = {"employee_id": user_info['employee_id']}
         
-    records = list(leaves_col.find(query).sort("applied_at", -1))
+    include_archive = st.toggle(
+        f"📦 Include archived leaves (ended more than {archive.ARCHIVE_AFTER_DAYS} days ago)",
+        key="leaves_include_archive"
+    )
+    records = archive.find_with_archive(leaves_col, query, "applied_at", include_archive)
     
     if not records:
         st.info("No leave records found.")
@@ -251,11 +496,11 @@ def show_leaves_page():
 
         # 2. NOW, build the display_cols list using the NEW names
         if user_role != 'employee':
-            def get_username(eid):
-                user = users_col.find_one({"employee_id": eid})
-                return user.get("full_name", "Unknown") if user else "Unknown"
-            
-            df['Applicant'] = df['employee_id'].apply(get_username)
+            names = {
+                u['employee_id']: u.get("full_name", "Unknown")
+                for u in users_col.find({"employee_id": {"$in": df['employee_id'].unique().tolist()}}, {"employee_id": 1, "full_name": 1})
+            }
+            df['Applicant'] = df['employee_id'].map(names).fillna("Unknown")
             
             if 'attachment_filename' not in df.columns:
                 df['attachment_filename'] = pd.NA
@@ -0,0 +1,181 @@
+import functools
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from pymongo import monitoring
+
+# Lightweight Mongo command monitoring and per-page latency tracking.
+# The listener is registered on the MongoClient in db.py. Synchronous pymongo
+# calls fire the listener on the calling thread, so each command is attributed
+# to the page currently rendering on that thread (Streamlit runs one script
+# thread per session). Everything is kept in fixed-size in-memory buffers.
+
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "100"))
+SAMPLE_SIZE = 1000  # Latency samples kept per page / command for percentiles
+IGNORED_COMMANDS = {"ping", "hello", "ismaster", "isMaster", "endSessions", "saslStart", "saslContinue"}
+
+_local = threading.local()
+_lock = threading.Lock()
+_pages = defaultdict(lambda: {"runs": 0, "commands": 0, "docs": 0, "errors": 0, "total_ms": 0.0, "samples": deque(maxlen=SAMPLE_SIZE)})
+_commands = defaultdict(lambda: {"count": 0, "failed": 0, "docs": 0, "total_ms": 0.0, "samples": deque(maxlen=SAMPLE_SIZE)})
+_slow_queries = deque(maxlen=50)
+
+
+def _docs_returned(reply):
+    cursor = reply.get("cursor")
+    if isinstance(cursor, dict):
+        return len(cursor.get("firstBatch", cursor.get("nextBatch", [])))
+    if "n" in reply and isinstance(reply["n"], int):
+        return reply["n"]
+    return 0
+
+
+def _record_command(event, docs, failed):
+    duration_ms = event.duration_micros / 1000
+    page = getattr(_local, "page", None) or "(background)"
+    key = (page, event.command_name)
+    with _lock:
+        stats = _commands[key]
+        stats["count"] += 1
+        stats["failed"] += int(failed)
+        stats["docs"] += docs
+        stats["total_ms"] += duration_ms
+        stats["samples"].append(duration_ms)
+    run = getattr(_local, "run", None)
+    if run is not None:
+        run["commands"] += 1
+        run["docs"] += docs
+    if duration_ms >= SLOW_QUERY_MS:
+        with _lock:
+            _slow_queries.append({
+                "at": time.strftime("%Y-%m-%d %H:%M:%S"), "page": page,
+                "command": event.command_name, "database": event.database_name,
+                "duration_ms": round(duration_ms, 1), "docs": docs
+            })
+
+
+class CommandStatsListener(monitoring.CommandListener):
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        if event.command_name not in IGNORED_COMMANDS:
+            _record_command(event, _docs_returned(event.reply), failed=False)
+
+    def failed(self, event):
+        if event.command_name not in IGNORED_COMMANDS:
+            _record_command(event, 0, failed=True)
+
+
+command_listener = CommandStatsListener()
+
+
+def track_page(func):
+    """Decorator: times a page function and attributes its Mongo commands to it."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        outer_page, outer_run = getattr(_local, "page", None), getattr(_local, "run", None)
+        _local.page = func.__name__
+        _local.run = {"commands": 0, "docs": 0}
+        started = time.perf_counter()
+        failed = False
+        try:
+            return func(*args, **kwargs)
+        except Exception:
+            failed = True
+            raise
+        finally:
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            run = _local.run
+            with _lock:
+                page = _pages[func.__name__]
+                page["runs"] += 1
+                page["commands"] += run["commands"]
+                page["docs"] += run["docs"]
+                page["errors"] += int(failed)
+                page["total_ms"] += elapsed_ms
+                page["samples"].append(elapsed_ms)
+            _local.page, _local.run = outer_page, outer_run
+            if outer_run is not None:
+                outer_run["commands"] += run["commands"]
+                outer_run["docs"] += run["docs"]
+    return wrapper
+
+
+def _percentile(samples, pct):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct))]
+
+
+# --- Reports ---
+def page_report():
+    """One row per page: runs, latency percentiles and average commands/docs per run."""
+    with _lock:
+        items = [(name, dict(stats, samples=list(stats["samples"]))) for name, stats in _pages.items()]
+    return [{
+        "page": name,
+        "runs": stats["runs"],
+        "total_ms": round(stats["total_ms"], 1),
+        "p50_ms": round(_percentile(stats["samples"], 0.50), 1),
+        "p95_ms": round(_percentile(stats["samples"], 0.95), 1),
+        "p99_ms": round(_percentile(stats["samples"], 0.99), 1),
+        "commands_per_run": round(stats["commands"] / stats["runs"], 1) if stats["runs"] else 0,
+        "docs_per_run": round(stats["docs"] / stats["runs"], 1) if stats["runs"] else 0,
+        "errors": stats["errors"]
+    } for name, stats in sorted(items)]
+
+
+def command_report():
+    """One row per (page, command name) with counts and latency percentiles."""
+    with _lock:
+        items = [(key, dict(stats, samples=list(stats["samples"]))) for key, stats in _commands.items()]
+    return [{
+        "page": page, "command": command,
+        "count": stats["count"], "failed": stats["failed"], "docs": stats["docs"],
+        "avg_ms": round(stats["total_ms"] / stats["count"], 2) if stats["count"] else 0,
+        "p95_ms": round(_percentile(stats["samples"], 0.95), 2)
+    } for (page, command), stats in sorted(items)]
+
+
+def freshness_caption(freshness):
+    """Caption for a dashboard's "data as of" line, from db.read_freshness()."""
+    if freshness is None:
+        return "🕒 Data freshness unknown (database unreachable)."
+    if not freshness["secondary"]:
+        return f"🟢 Live data from the primary ({freshness['member']})."
+    lag = freshness["lag_seconds"]
+    icon = "🟢" if lag < 5 else "🟡" if lag < 60 else "🟠"
+    return f"{icon} Data as of {freshness['as_of']:%H:%M:%S} — replica {freshness['member']}, {lag:.0f}s behind the primary."
+
+
+def slow_queries():
+    with _lock:
+        return list(reversed(_slow_queries))
+
+
+def prometheus_text():
+    """Exports the collected metrics in the Prometheus text exposition format."""
+    lines = [
+        "# HELP hrms_page_runs_total Page function executions.",
+        "# TYPE hrms_page_runs_total counter",
+    ]
+    pages = page_report()
+    for row in pages:
+        lines.append(f'hrms_page_runs_total{{page="{row["page"]}"}} {row["runs"]}')
+    lines += ["# HELP hrms_page_latency_ms Page render latency.", "# TYPE hrms_page_latency_ms summary"]
+    for row in pages:
+        for quantile, key in (("0.5", "p50_ms"), ("0.95", "p95_ms"), ("0.99", "p99_ms")):
+            lines.append(f'hrms_page_latency_ms{{page="{row["page"]}",quantile="{quantile}"}} {row[key]}')
+        lines.append(f'hrms_page_latency_ms_sum{{page="{row["page"]}"}} {row["total_ms"]}')
+        lines.append(f'hrms_page_latency_ms_count{{page="{row["page"]}"}} {row["runs"]}')
+    lines += ["# HELP hrms_mongo_commands_total Mongo commands issued.", "# TYPE hrms_mongo_commands_total counter"]
+    commands = command_report()
+    for row in commands:
+        lines.append(f'hrms_mongo_commands_total{{page="{row["page"]}",command="{row["command"]}"}} {row["count"]}')
+    lines += ["# HELP hrms_mongo_docs_returned_total Documents returned by Mongo commands.", "# TYPE hrms_mongo_docs_returned_total counter"]
+    for row in commands:
+        lines.append(f'hrms_mongo_docs_returned_total{{page="{row["page"]}",command="{row["command"]}"}} {row["docs"]}')
+    return "\n".join(lines) + "\n"
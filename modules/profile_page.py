@@ -1,18 +1,19 @@
 import streamlit as st
 from db import users_col
+from modules import employee_search, monitoring
 import base64
 
+@monitoring.track_page
 def show_profile_page():
     st.title("User Profile")
     current_user = st.session_state.user_info
 
     # --- Employee Selection for Admins/HR ---
     if current_user['role'] in ['admin', 'hr']:
-        employee_list = list(users_col.find({}, {"username": 1}))
-        employee_usernames = [emp['username'] for emp in employee_list]
-        selected_username = st.selectbox("Select Employee to View Profile", options=employee_usernames,
-                                           index=employee_usernames.index(current_user['username']))
-        profile_data = users_col.find_one({"username": selected_username})
+        selected_user = employee_search.employee_picker("Select Employee to View Profile", key="profile_employee", default=current_user)
+        if not selected_user:
+            return
+        profile_data = users_col.find_one({"employee_id": selected_user['employee_id']})
     else:
         profile_data = users_col.find_one({"employee_id": current_user['employee_id']})
 
@@ -63,6 +64,8 @@ def show_profile_page():
                         encoded_image = base64.b64encode(uploaded_image.getvalue()).decode('utf-8')
                         update_data["profile_pic_url"] = f"data:image/png;base64,{encoded_image}"
 
+                    update_data["search_keys"] = employee_search.search_keys_for(dict(profile_data, **update_data))
                     users_col.update_one({"_id": profile_data['_id']}, {"$set": update_data})
+                    employee_search.invalidate()
                     st.success("Profile updated successfully!")
                     st.rerun()
\ No newline at end of file
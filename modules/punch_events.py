@@ -0,0 +1,198 @@
+import hashlib
+import time
+from datetime import datetime, timedelta
+from bson.objectid import ObjectId
+from pymongo import UpdateOne
+from db import TRANSACTIONAL, reads, attendance_col, punch_events_col
+from modules.attendance_schema import SCHEMA_VERSION, to_day
+
+# Raw punch events live in the `punch_events` time-series collection
+# (timeField "ts", metaField "meta" = {tenant_id, employee_id}). In code an event is
+# the flat {"employee_id", "type", "ts", "source"}; stored_event / loaded_event
+# convert at the collection boundary. The daily attendance record is a
+# projection of a day's events: first punch in, last punch out, every in/out
+# segment (e.g. around a lunch break) and the total worked hours.
+# Time-series collections have no unique _id index, so a replayed or re-run insert
+# can store an event twice. Every event has a fixed _id before it is written, and
+# readers count each _id once.
+
+EVENT_IN = "in"
+EVENT_OUT = "out"
+
+
+def stored_event(event):
+    """The document stored for a flat event (the tenant is added to meta by punch_events_col)."""
+    if "meta" in event:
+        return event
+    stored = {k: v for k, v in event.items() if k not in ("employee_id", "tenant_id")}
+    stored["meta"] = {"employee_id": event["employee_id"]}
+    return stored
+
+
+def loaded_event(document):
+    """The flat event for a stored document."""
+    event = {k: v for k, v in document.items() if k != "meta"}
+    event["employee_id"] = document["meta"]["employee_id"]
+    return event
+
+
+def build_segments(events):
+    """Pairs sorted in/out events into [{"in": ts, "out": ts}] segments; the last may be open."""
+    segments = []
+    for event in sorted(events, key=lambda e: e["ts"]):
+        if event["type"] == EVENT_IN:
+            if not segments or "out" in segments[-1]:
+                segments.append({"in": event["ts"]})
+        elif event["type"] == EVENT_OUT and segments and "out" not in segments[-1]:
+            segments[-1]["out"] = event["ts"]
+    return segments
+
+
+def derive_record(employee_id, day, events):
+    """Returns the attendance fields for one employee-day derived from its events."""
+    segments = build_segments(events)
+    if not segments:
+        return None
+    closed = [s for s in segments if "out" in s]
+    record = {
+        "employee_id": employee_id,
+        "date": to_day(day),
+        "status": "present",
+        "punch_in": segments[0]["in"],
+        "segments": segments,
+        "from_events": True,
+        "schema_version": SCHEMA_VERSION
+    }
+    if closed:
+        record["worked_hours"] = round(sum((s["out"] - s["in"]).total_seconds() for s in closed) / 3600, 2)
+    if "out" in segments[-1]:
+        record["punch_out"] = segments[-1]["out"]
+    return record
+
+
+def events_from_record(record):
+    """Rebuilds the event list of a stored attendance record (legacy records have no segments)."""
+    segments = record.get("segments")
+    if segments is None:
+        segments = [{"in": record["punch_in"]}] if isinstance(record.get("punch_in"), datetime) else []
+        if segments and isinstance(record.get("punch_out"), datetime):
+            segments[0]["out"] = record["punch_out"]
+    events = []
+    for segment in segments:
+        events.append({"employee_id": record["employee_id"], "type": EVENT_IN, "ts": segment["in"]})
+        if "out" in segment:
+            events.append({"employee_id": record["employee_id"], "type": EVENT_OUT, "ts": segment["out"]})
+    return events
+
+
+def _update_for(record):
+    update = {"$set": record}
+    unset = {field: "" for field in ("punch_out", "worked_hours") if field not in record}
+    # Punches replayed for a day the end-of-day job already marked absent / on leave
+    unset.update({field: "" for field in ("auto_marked", "holiday_name", "leave_id", "leave_type", "half_day")})
+    if unset:
+        update["$unset"] = unset
+    return UpdateOne({"employee_id": record["employee_id"], "date": record["date"]}, update, upsert=True)
+
+
+def rebuild_daily_records(pairs):
+    """
+    Re-derives the attendance records for a set of (employee_id, day) pairs from
+    their events with one query and one bulk write.
+    """
+    pairs = {(employee_id, to_day(day)) for employee_id, day in pairs}
+    if not pairs:
+        return 0
+    query = {"$or": [
+        {"meta.employee_id": employee_id, "ts": {"$gte": day, "$lt": day + timedelta(days=1)}}
+        for employee_id, day in pairs
+    ]}
+    events_by_pair = {}
+    seen = set()
+    for document in punch_events_col.find(query):
+        if document["_id"] in seen:
+            continue
+        seen.add(document["_id"])
+        event = loaded_event(document)
+        events_by_pair.setdefault((event["employee_id"], to_day(event["ts"])), []).append(event)
+    # Records started before events existed keep their punches until the backfill runs.
+    legacy_query = {"$or": [{"employee_id": e, "date": d} for e, d in pairs], "from_events": {"$ne": True}}
+    for legacy in attendance_col.find(legacy_query):
+        key = (legacy["employee_id"], legacy["date"])
+        if key in events_by_pair:
+            events_by_pair[key].extend(events_from_record(legacy))
+
+    ops = []
+    for (employee_id, day), events in events_by_pair.items():
+        record = derive_record(employee_id, day, events)
+        if record:
+            ops.append(_update_for(record))
+    if ops:
+        attendance_col.bulk_write(ops, ordered=False)
+    return len(ops)
+
+
+# --- Analytics over the time-series collection ---
+def weekly_hours(employee_id, since, workload=TRANSACTIONAL):
+    """
+    Worked hours per week, aggregated on the server over the time-bucketed events.
+    For each day with every segment closed, worked time = sum(out) - sum(in).
+    """
+    return list(reads(punch_events_col, workload).aggregate([
+        {"$match": {"meta.employee_id": employee_id, "ts": {"$gte": since}}},
+        # A replayed event is stored twice with the same _id: count it once
+        {"$group": {"_id": "$_id", "ts": {"$first": "$ts"}, "type": {"$first": "$type"}}},
+        {"$group": {
+            "_id": {"$dateTrunc": {"date": "$ts", "unit": "day"}},
+            "ins": {"$sum": {"$cond": [{"$eq": ["$type", EVENT_IN]}, 1, 0]}},
+            "outs": {"$sum": {"$cond": [{"$eq": ["$type", EVENT_OUT]}, 1, 0]}},
+            "net_ms": {"$sum": {"$cond": [
+                {"$eq": ["$type", EVENT_OUT]}, {"$toLong": "$ts"}, {"$multiply": [-1, {"$toLong": "$ts"}]}
+            ]}}
+        }},
+        {"$match": {"$expr": {"$eq": ["$ins", "$outs"]}}},
+        {"$group": {
+            "_id": {"$dateTrunc": {"date": "$_id", "unit": "week"}},
+            "worked_hours": {"$sum": {"$divide": ["$net_ms", 3600000]}}
+        }},
+        {"$project": {"_id": 0, "date": "$_id", "worked_hours": 1}},
+        {"$sort": {"date": 1}}
+    ]))
+
+
+# --- Backfill from existing attendance records ---
+def _backfill_event_id(record_id, n):
+    """Deterministic _id of a record's n-th backfilled event, so a resumed run rewrites the same ids."""
+    return ObjectId(hashlib.sha1(f"backfill:{record_id}:{n}".encode()).digest()[:12])
+
+
+def backfill_from_attendance(batch_size=1000, progress=print):
+    """
+    Creates punch events for attendance records written before events existed.
+    Resumable: records are flagged with `from_events` once their events are stored;
+    events of an interrupted batch are re-inserted with the same _id and read once.
+    """
+    query = {"from_events": {"$ne": True}, "punch_in": {"$type": "date"}}
+    total = attendance_col.count_documents(query)
+    done = 0
+    started = time.perf_counter()
+    while True:
+        records = list(attendance_col.find(query).sort("_id", 1).limit(batch_size))
+        if not records:
+            break
+        events_by_record = {r["_id"]: events_from_record(r) for r in records}
+        events = [
+            dict(event, _id=_backfill_event_id(record_id, n), source="backfill")
+            for record_id, record_events in events_by_record.items()
+            for n, event in enumerate(record_events)
+        ]
+        if events:
+            punch_events_col.insert_many([stored_event(event) for event in events], ordered=False)
+        attendance_col.bulk_write([
+            UpdateOne({"_id": record_id}, {"$set": {"from_events": True, "segments": build_segments(record_events)}})
+            for record_id, record_events in events_by_record.items()
+        ], ordered=False)
+        done += len(records)
+        rate = done / (time.perf_counter() - started)
+        progress(f"Backfilled {done}/{total} records ({rate:.0f} records/s)")
+    return done
@@ -0,0 +1,134 @@
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import Future
+from pymongo.errors import BulkWriteError
+from db import punch_events_col
+from modules.tenancy import current_tenant
+
+# Group-commit writer for punch events. Callers enqueue a pymongo write op and
+# block on a Future; one background thread flushes queued ops as unordered
+# bulk_writes every MAX_WAIT_MS or MAX_BATCH events, whichever comes first.
+# One writer serves every tenant: each op is queued with the caller's tenant and
+# a batch is written as one bulk_write per tenant, on a handle pinned to it.
+
+MAX_QUEUE_SIZE = 10000
+MAX_BATCH = 500
+MAX_WAIT_MS = 5
+ENQUEUE_TIMEOUT_SECONDS = 2
+
+
+class QueueFullError(Exception):
+    """Raised when the queue stays full for longer than the enqueue timeout."""
+
+
+class PunchQueue:
+    """Group-commit writer for a tenant-scoped collection (pinned per tenant on flush)."""
+
+    def __init__(self, collection, max_size=MAX_QUEUE_SIZE, max_batch=MAX_BATCH, max_wait_ms=MAX_WAIT_MS):
+        self.collection = collection
+        self.max_size = max_size
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self._items = deque()
+        self._cond = threading.Condition()
+        self._stats = {
+            "enqueued": 0, "committed": 0, "failed": 0, "batches": 0,
+            "full_waits": 0, "rejected": 0, "max_depth": 0,
+            "last_batch_size": 0, "last_flush_ms": 0.0, "total_flush_ms": 0.0
+        }
+        threading.Thread(target=self._run, name="punch-writer", daemon=True).start()
+
+    # --- Producer side ---
+    def submit(self, op, tenant_id=None):
+        """Queues a write op and returns a Future resolved with its per-op result once committed."""
+        tenant_id = tenant_id or current_tenant()
+        future = Future()
+        with self._cond:
+            if len(self._items) >= self.max_size:
+                self._stats["full_waits"] += 1
+                if not self._cond.wait_for(lambda: len(self._items) < self.max_size, ENQUEUE_TIMEOUT_SECONDS):
+                    self._stats["rejected"] += 1
+                    raise QueueFullError("Punch queue is full, please retry.")
+            self._items.append((tenant_id, op, future))
+            self._stats["enqueued"] += 1
+            self._stats["max_depth"] = max(self._stats["max_depth"], len(self._items))
+            self._cond.notify_all()
+        return future
+
+    def metrics(self):
+        """Back-pressure and throughput metrics for dashboards."""
+        with self._cond:
+            stats = dict(self._stats)
+            stats["queue_depth"] = len(self._items)
+        stats["avg_batch_size"] = round(stats["committed"] / stats["batches"], 1) if stats["batches"] else 0
+        stats["avg_flush_ms"] = round(stats["total_flush_ms"] / stats["batches"], 2) if stats["batches"] else 0
+        return stats
+
+    # --- Writer side ---
+    def _take_batch(self):
+        with self._cond:
+            self._cond.wait_for(lambda: self._items)
+            deadline = time.monotonic() + self.max_wait
+            while len(self._items) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self._cond.wait(remaining):
+                    break
+            batch = [self._items.popleft() for _ in range(min(self.max_batch, len(self._items)))]
+            self._cond.notify_all()
+            return batch
+
+    def _run(self):
+        while True:
+            by_tenant = defaultdict(list)
+            for tenant_id, op, future in self._take_batch():
+                by_tenant[tenant_id].append((op, future))
+            for tenant_id, batch in by_tenant.items():
+                self._flush(tenant_id, batch)
+
+    def _flush(self, tenant_id, batch):
+        started = time.perf_counter()
+        errors = {}
+        upserted = {}
+        try:
+            result = self.collection.for_tenant(tenant_id).bulk_write([op for op, _ in batch], ordered=False)
+            upserted = result.upserted_ids
+        except BulkWriteError as e:
+            errors = {err["index"]: err for err in e.details.get("writeErrors", [])}
+            upserted = {u["index"]: u["_id"] for u in e.details.get("upserted", [])}
+        except Exception as e:
+            # Fails this batch only (e.g. a malformed op or a routing error); the writer keeps running
+            for _, future in batch:
+                future.set_exception(e)
+            self._record(len(batch), 0, started)
+            return
+
+        for index, (_, future) in enumerate(batch):
+            if index in errors:
+                future.set_result({"ok": False, "error": errors[index]})
+            else:
+                future.set_result({"ok": True, "upserted_id": upserted.get(index)})
+        self._record(len(batch), len(batch) - len(errors), started)
+
+    def _record(self, size, committed, started):
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        with self._cond:
+            self._stats["batches"] += 1
+            self._stats["committed"] += committed
+            self._stats["failed"] += size - committed
+            self._stats["last_batch_size"] = size
+            self._stats["last_flush_ms"] = round(elapsed_ms, 2)
+            self._stats["total_flush_ms"] += elapsed_ms
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_punch_queue():
+    """Returns the process-wide punch queue, starting its writer thread on first use."""
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = PunchQueue(punch_events_col)
+        return _queue
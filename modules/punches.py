@@ -0,0 +1,115 @@
+from datetime import datetime, timedelta, time
+from bson.objectid import ObjectId
+from pymongo.errors import PyMongoError
+from db import TRANSACTIONAL, reads, attendance_col, punch_events_col
+from modules.attendance_schema import date_filter
+from modules.punch_events import EVENT_IN, EVENT_OUT, derive_record, events_from_record
+from modules.write_buffer import get_write_buffer
+
+ON_TIME_CUTOFF = time(9, 30)
+
+# Punch and attendance-summary logic shared by the Streamlit pages and the HTTP API.
+# Each press is a raw punch event, journaled locally and acknowledged immediately;
+# the write buffer replays events to Mongo (through the group-commit punch queue)
+# and re-derives the daily attendance record from them.
+
+
+def get_today_record(employee_id):
+    """
+    Returns today's attendance record for an employee, or None.
+    Events still waiting in the local journal are merged into the stored record.
+    """
+    today = datetime.today()
+    buffer = get_write_buffer()
+    record = None
+    if buffer.online:
+        try:
+            record = attendance_col.find_one({"employee_id": employee_id, **date_filter(equals=today)})
+        except PyMongoError:
+            record = None
+
+    pending = [
+        payload for kind, payload in buffer.pending(employee_id=employee_id, day=today.strftime("%Y-%m-%d"))
+        if kind == "insert" and "ts" in payload
+    ]
+    if not pending:
+        return record
+    events = (events_from_record(record) if record else []) + pending
+    derived = derive_record(employee_id, today, events)
+    if not derived:
+        return record
+    stored = {k: v for k, v in (record or {}).items() if k not in ("punch_out", "worked_hours")}
+    return dict(stored, **derived)
+
+
+def _is_working(record):
+    """True while the latest segment of the day is still open."""
+    return bool(record) and "punch_out" not in record
+
+
+def _record_event(employee_id, event_type, when, source):
+    event = {"_id": ObjectId(), "employee_id": employee_id, "type": event_type, "ts": when, "source": source}
+    get_write_buffer().append(punch_events_col.name, "insert", event, employee_id, when.strftime("%Y-%m-%d"))
+    return event
+
+
+def punch_in(employee_id, when=None, source="ui"):
+    """
+    Records a punch in (the first of the day, or resuming after a break).
+    Returns (ok, record_or_message).
+    """
+    when = when or datetime.now()
+    today_record = get_today_record(employee_id)
+    if _is_working(today_record):
+        return False, "Already punched in."
+    _record_event(employee_id, EVENT_IN, when, source)
+    events = (events_from_record(today_record) if today_record else []) + [{"type": EVENT_IN, "ts": when}]
+    return True, derive_record(employee_id, when, events)
+
+
+def punch_out(employee_id, when=None, source="ui"):
+    """
+    Records a punch out and returns (ok, worked_hours_today_or_message).
+    """
+    when = when or datetime.now()
+    today_record = get_today_record(employee_id)
+    if not today_record:
+        return False, "No punch in found for today."
+    if not _is_working(today_record):
+        return False, "Already punched out."
+    _record_event(employee_id, EVENT_OUT, when, source)
+    events = events_from_record(today_record) + [{"type": EVENT_OUT, "ts": when}]
+    return True, derive_record(employee_id, when, events).get("worked_hours")
+
+
+def attendance_summary(employee_id, days=30, workload=TRANSACTIONAL):
+    """
+    Returns the personal KPIs (avg. hours, present days, on-time days) for the last `days` days.
+    """
+    start = datetime.now() - timedelta(days=days)
+    records = reads(attendance_col, workload).find(
+        {"employee_id": employee_id, **date_filter(gte=start)},
+        {"status": 1, "worked_hours": 1, "punch_in": 1}
+    )
+
+    present_days = 0
+    on_time_days = 0
+    worked_hours = []
+    for record in records:
+        if record.get("status") != "present":
+            continue
+        present_days += 1
+        hours = record.get("worked_hours")
+        if isinstance(hours, (int, float)) and hours > 0:
+            worked_hours.append(hours)
+        punched_in = record.get("punch_in")
+        if isinstance(punched_in, datetime) and punched_in.time() <= ON_TIME_CUTOFF:
+            on_time_days += 1
+
+    return {
+        "employee_id": employee_id,
+        "days": days,
+        "avg_hours": round(sum(worked_hours) / len(worked_hours), 2) if worked_hours else 0,
+        "present_days": present_days,
+        "on_time_days": on_time_days
+    }
@@ -0,0 +1,217 @@
+import hashlib
+import re
+import time
+from datetime import datetime, time as day_time
+import streamlit as st
+from bson.objectid import ObjectId
+from pymongo import ReplaceOne
+from db import chats_col, chats_archive_col, chat_messages_col, leaves_col, announcements_col, users_col
+
+# Full-text search over chat messages, leave reasons and announcements, on MongoDB
+# text indexes prefixed with tenant_id (db.ensure_indexes). Leave reasons and
+# announcements are indexed in place. Chat messages live in arrays inside their
+# thread, so every message is also written to `chat_messages` when it is sent (one
+# document per message); search can then rank, date-filter and page single messages.
+# A message's search document reuses the message's own _id (legacy messages without
+# one get an id hashed from their content), so the live write and the backfill
+# upsert the same document and never drop or double it.
+# Each source returns its best matches by textScore and the results are merged.
+# Scoping: HR and admins search everything; an employee only their own chats and
+# leaves, plus announcements.
+
+PAGE_SIZE = 20
+MAX_PAGES = 25  # Deeper pages should narrow the query or the dates instead
+SNIPPET_CHARS = 160
+SOURCES = {"chat": "💬 Chats", "leave": "🌴 Leave reasons", "announcement": "📢 Announcements"}
+PRIVILEGED_ROLES = ("hr", "admin")
+
+
+# --- Indexing on write ---
+def _message_id(thread_id, message_doc):
+    if message_doc.get("_id") is not None:
+        return message_doc["_id"]
+    # BSON keeps milliseconds: hash what a stored message reads back as
+    ts = message_doc.get("timestamp")
+    if isinstance(ts, datetime):
+        ts = ts.replace(microsecond=ts.microsecond // 1000 * 1000)
+    key = f"{thread_id}|{message_doc.get('sender_id')}|{ts}|{message_doc.get('message', '')}"
+    return ObjectId(hashlib.sha1(key.encode()).digest()[:12])
+
+
+def _search_doc(thread_id, participants, message_doc):
+    return {
+        "_id": _message_id(thread_id, message_doc),
+        "thread_id": thread_id,
+        "participants": participants,
+        "sender_id": message_doc.get("sender_id"),
+        "message": message_doc.get("message", ""),
+        "timestamp": message_doc.get("timestamp")
+    }
+
+
+def index_chat_message(thread_id, participants, message_doc):
+    """Adds a sent message to the search collection (called by communication.send_chat_message)."""
+    doc = _search_doc(thread_id, participants, message_doc)
+    chat_messages_col.replace_one({"_id": doc["_id"]}, doc, upsert=True)
+
+
+def _index_threads(source, batch_size, progress):
+    done = 0
+    query = {"search_indexed": {"$ne": True}}
+    while True:
+        threads = list(source.find(query, {"participants": 1, "messages": 1}).sort("_id", 1).limit(batch_size))
+        if not threads:
+            break
+        thread_ids = [thread["_id"] for thread in threads]
+        # Upserts by message-derived _id: messages sent live meanwhile are neither lost nor doubled
+        ops = [
+            ReplaceOne({"_id": doc["_id"]}, doc, upsert=True)
+            for thread in threads for msg in thread.get("messages") or []
+            if msg.get("message")
+            for doc in [_search_doc(thread["_id"], thread.get("participants", []), msg)]
+        ]
+        if ops:
+            chat_messages_col.bulk_write(ops, ordered=False)
+        source.update_many({"_id": {"$in": thread_ids}}, {"$set": {"search_indexed": True}})
+        done += len(threads)
+        progress(f"Indexed {done} {source.name} threads")
+    return done
+
+
+def backfill_chat_messages(batch_size=200, progress=print):
+    """
+    Copies the messages of threads (hot and archived) created before search existed
+    into `chat_messages`. Resumable: finished threads are flagged `search_indexed`.
+    """
+    return {source.name: _index_threads(source, batch_size, progress) for source in (chats_col, chats_archive_col)}
+
+
+# --- Queries ---
+def _text_query(text, date_field, start=None, end=None, scope=None):
+    query = {"$text": {"$search": text}}
+    if start or end:
+        query[date_field] = {}
+        if start:
+            query[date_field]["$gte"] = datetime.combine(start, day_time.min)
+        if end:
+            query[date_field]["$lte"] = datetime.combine(end, day_time.max)
+    if scope:
+        query.update(scope)
+    return query
+
+
+def _top(collection, query, projection, date_field, limit):
+    projection = dict(projection, score={"$meta": "textScore"})
+    return list(
+        collection.find(query, projection)
+        .sort([("score", {"$meta": "textScore"}), (date_field, -1)])
+        .limit(limit)
+    )
+
+
+def search(text, viewer_id, role, sources=tuple(SOURCES), start=None, end=None, page=0, page_size=PAGE_SIZE):
+    """
+    Ranked matches for `text` visible to the viewer, newest first among equal scores.
+    Returns (results, has_more); each result has kind, score, date, text, employee_id
+    and the source document's id.
+    """
+    text = text.strip()
+    if not text or page >= MAX_PAGES:
+        return [], False
+    privileged = role in PRIVILEGED_ROLES
+    limit = (page + 1) * page_size + 1
+    results = []
+    if "chat" in sources:
+        scope = None if privileged else {"participants": viewer_id}
+        for doc in _top(chat_messages_col, _text_query(text, "timestamp", start, end, scope),
+                        {"thread_id": 1, "participants": 1, "sender_id": 1, "message": 1, "timestamp": 1}, "timestamp", limit):
+            results.append({"kind": "chat", "id": doc["thread_id"], "score": doc["score"], "date": doc.get("timestamp"),
+                            "text": doc.get("message", ""), "employee_id": doc.get("sender_id"),
+                            "participants": doc.get("participants", [])})
+    if "leave" in sources:
+        scope = None if privileged else {"employee_id": viewer_id}
+        for doc in _top(leaves_col, _text_query(text, "applied_at", start, end, scope),
+                        {"employee_id": 1, "reason": 1, "applied_at": 1, "leave_type": 1, "status": 1}, "applied_at", limit):
+            results.append({"kind": "leave", "id": doc["_id"], "score": doc["score"], "date": doc.get("applied_at"),
+                            "text": doc.get("reason", ""), "employee_id": doc.get("employee_id"),
+                            "detail": f"{doc.get('leave_type', '')} leave, {doc.get('status', '')}"})
+    if "announcement" in sources:
+        for doc in _top(announcements_col, _text_query(text, "posted_at", start, end),
+                        {"posted_by": 1, "message": 1, "posted_at": 1}, "posted_at", limit):
+            results.append({"kind": "announcement", "id": doc["_id"], "score": doc["score"], "date": doc.get("posted_at"),
+                            "text": doc.get("message", ""), "employee_id": doc.get("posted_by")})
+
+    results.sort(key=lambda r: (r["score"], r["date"] or datetime.min), reverse=True)
+    offset = page * page_size
+    return results[offset:offset + page_size], len(results) > offset + page_size
+
+
+def snippet(text, query, width=SNIPPET_CHARS):
+    """The part of `text` around the first query term, with the terms in bold."""
+    terms = [re.escape(t) for t in re.findall(r"\w+", query.lower()) if t]
+    if not terms:
+        return text[:width]
+    pattern = re.compile("|".join(terms), re.IGNORECASE)
+    match = pattern.search(text)
+    start = max(0, (match.start() if match else 0) - width // 3)
+    part = text[start:start + width]
+    part = pattern.sub(lambda m: f"**{m.group(0)}**", part)
+    return ("…" if start else "") + part + ("…" if start + width < len(text) else "")
+
+
+# --- Streamlit panel ---
+def show_search_panel(viewer_id, role, key="search"):
+    """Search box with source and date filters, ranked results and paging."""
+    privileged = role in PRIVILEGED_ROLES
+    c1, c2 = st.columns([3, 2])
+    query = c1.text_input(
+        "🔎 Search", key=f"{key}_query",
+        placeholder="e.g. surgery, \"work from home\", -cancelled" if privileged else "Search your messages and leaves"
+    )
+    sources = c2.multiselect("In", options=list(SOURCES), default=list(SOURCES),
+                             format_func=SOURCES.get, key=f"{key}_sources")
+    d1, d2 = st.columns(2)
+    start = d1.date_input("From", value=None, key=f"{key}_from")
+    end = d2.date_input("To", value=None, key=f"{key}_to")
+
+    # A new query or filter starts again at the first page
+    signature = (query, tuple(sources), start, end)
+    if st.session_state.get(f"{key}_signature") != signature:
+        st.session_state[f"{key}_signature"] = signature
+        st.session_state[f"{key}_page"] = 0
+    page = st.session_state[f"{key}_page"]
+
+    if not query.strip():
+        return
+    started = time.perf_counter()
+    results, has_more = search(query, viewer_id, role, sources, start, end, page)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    if not results:
+        st.info("No matches found.")
+        return
+    st.caption(f"Page {page + 1} · {elapsed_ms:.0f} ms")
+
+    employee_ids = {r["employee_id"] for r in results if r.get("employee_id")}
+    names = {u["employee_id"]: u.get("full_name", u["employee_id"])
+             for u in users_col.find({"employee_id": {"$in": list(employee_ids)}}, {"employee_id": 1, "full_name": 1})}
+    for result in results:
+        who = names.get(result.get("employee_id"), result.get("employee_id") or "Unknown")
+        when = result["date"].strftime("%d %b %Y, %H:%M") if isinstance(result["date"], datetime) else ""
+        if result["kind"] == "chat":
+            others = [names.get(p, p) for p in result["participants"] if p != result["employee_id"]]
+            header = f"{SOURCES['chat']} · **{who}** → {', '.join(others)}"
+        elif result["kind"] == "leave":
+            header = f"{SOURCES['leave']} · **{who}** ({result['detail']})"
+        else:
+            header = f"{SOURCES['announcement']} · **{who}**"
+        with st.container(border=True):
+            st.markdown(f"{header} · {when}")
+            st.markdown(snippet(result["text"], query))
+
+    p1, _, p2 = st.columns([1, 3, 1])
+    if page > 0 and p1.button("⬅️ Previous", key=f"{key}_prev"):
+        st.session_state[f"{key}_page"] = page - 1
+        st.rerun()
+    if has_more and page + 1 < MAX_PAGES and p2.button("Next ➡️", key=f"{key}_next"):
+        st.session_state[f"{key}_page"] = page + 1
+        st.rerun()
@@ -0,0 +1,189 @@
+import contextlib
+import contextvars
+import os
+from pymongo import DeleteMany, DeleteOne, InsertOne, ReplaceOne, UpdateMany, UpdateOne
+
+# Multi-tenancy. Every tenant-owned document carries `tenant_id`, and the collection
+# handles exported by db.py are TenantCollection proxies that add the current tenant
+# to every filter, inserted document, upsert and aggregation, so no query path in the
+# modules can read or write another tenant's data.
+#
+# The current tenant is resolved, in order, from:
+#   1. tenant_context(...) on this thread (API requests, background flushes, CLIs)
+#   2. the Streamlit session (st.session_state.tenant_id, set at login)
+#   3. TENANT_ID from the environment (single-tenant installs and scripts)
+
+TENANT_FIELD = "tenant_id"
+DEFAULT_TENANT = os.getenv("TENANT_ID", "default")
+
+_current = contextvars.ContextVar("tenant_id", default=None)
+
+
+def _session_tenant():
+    try:
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+        if get_script_run_ctx() is None:
+            return None
+        import streamlit as st
+        return st.session_state.get("tenant_id")
+    except Exception:
+        return None
+
+
+def current_tenant():
+    """The tenant the calling code is acting for."""
+    return _current.get() or _session_tenant() or DEFAULT_TENANT
+
+
+@contextlib.contextmanager
+def tenant_context(tenant_id):
+    """Runs the enclosed block on behalf of `tenant_id`."""
+    token = _current.set(tenant_id)
+    try:
+        yield tenant_id
+    finally:
+        _current.reset(token)
+
+
+def _scope_filter(filter, tenant_id, field=TENANT_FIELD):
+    return {**(filter or {}), field: tenant_id}
+
+
+def _scope_document(document, tenant_id, field=TENANT_FIELD):
+    # `field` may be a dotted path (e.g. a time-series "meta.tenant_id")
+    *parents, leaf = field.split(".")
+    target = document
+    for key in parents:
+        target = target.setdefault(key, {})
+    target[leaf] = tenant_id
+    return document
+
+
+def _scope_pipeline(pipeline, tenant_id, field=TENANT_FIELD):
+    pipeline = list(pipeline)
+    # Merge into a leading $match so stages that must come first ($text) keep working
+    if pipeline and "$match" in pipeline[0]:
+        return [{"$match": _scope_filter(pipeline[0]["$match"], tenant_id, field)}] + pipeline[1:]
+    return [{"$match": {field: tenant_id}}] + pipeline
+
+
+def _options(op, *names):
+    return {name: getattr(op, f"_{name}") for name in names if getattr(op, f"_{name}", None) is not None}
+
+
+def _scope_op(op, tenant_id, field=TENANT_FIELD):
+    """A new write model equal to `op` but restricted to the tenant (the caller's op is not modified)."""
+    if isinstance(op, InsertOne):
+        return InsertOne(_scope_document(op._doc, tenant_id, field))
+    scoped_filter = _scope_filter(op._filter, tenant_id, field)
+    if isinstance(op, ReplaceOne):
+        return ReplaceOne(scoped_filter, _scope_document(op._doc, tenant_id, field),
+                          **_options(op, "upsert", "collation", "hint"))
+    if isinstance(op, (UpdateOne, UpdateMany)):
+        return type(op)(scoped_filter, op._doc, **_options(op, "upsert", "collation", "array_filters", "hint"))
+    if isinstance(op, (DeleteOne, DeleteMany)):
+        return type(op)(scoped_filter, **_options(op, "collation", "hint"))
+    raise TypeError(f"Unsupported write model: {type(op).__name__}")
+
+
+class TenantCollection:
+    """
+    Tenant-scoped stand-in for a pymongo Collection. `resolve_database(tenant_id)`
+    returns the database holding that tenant's data (shared or dedicated).
+    `tenant_id` pins the handle to one tenant (for background writers),
+    `read_preference` picks the replica set members its reads go to and
+    `tenant_field` is where documents carry their tenant (a dotted path for
+    time-series collections, whose tenant lives in the metaField).
+    """
+
+    def __init__(self, name, resolve_database, tenant_id=None, read_preference=None, tenant_field=TENANT_FIELD):
+        self.name = name
+        self._resolve_database = resolve_database
+        self._tenant_id = tenant_id
+        self.read_preference = read_preference
+        self.tenant_field = tenant_field
+
+    @property
+    def tenant_id(self):
+        return self._tenant_id or current_tenant()
+
+    @property
+    def database(self):
+        return self._resolve_database(self.tenant_id)
+
+    def raw(self):
+        """The underlying pymongo Collection for the current tenant (no scoping)."""
+        collection = self.database[self.name]
+        if self.read_preference is not None:
+            collection = collection.with_options(read_preference=self.read_preference)
+        return collection
+
+    def for_tenant(self, tenant_id):
+        """A handle pinned to one tenant, safe to use from any thread."""
+        return TenantCollection(self.name, self._resolve_database, tenant_id, self.read_preference, self.tenant_field)
+
+    def with_read_preference(self, read_preference):
+        """The same collection, reading from the members selected by `read_preference`."""
+        return TenantCollection(self.name, self._resolve_database, self._tenant_id, read_preference, self.tenant_field)
+
+    def scope(self, filter=None):
+        """`filter` restricted to this handle's tenant, for APIs that take a raw collection."""
+        return _scope_filter(filter, self.tenant_id, self.tenant_field)
+
+    def scope_pipeline(self, pipeline):
+        """`pipeline` restricted to this handle's tenant, for APIs that take a raw collection."""
+        return _scope_pipeline(pipeline, self.tenant_id, self.tenant_field)
+
+    # --- Reads ---
+    def find(self, filter=None, *args, **kwargs):
+        return self.raw().find(_scope_filter(filter, self.tenant_id, self.tenant_field), *args, **kwargs)
+
+    def find_one(self, filter=None, *args, **kwargs):
+        return self.raw().find_one(_scope_filter(filter, self.tenant_id, self.tenant_field), *args, **kwargs)
+
+    def count_documents(self, filter, **kwargs):
+        return self.raw().count_documents(_scope_filter(filter, self.tenant_id, self.tenant_field), **kwargs)
+
+    def estimated_document_count(self, **kwargs):
+        # Collection metadata counts every tenant, so count this tenant's documents instead
+        return self.count_documents({}, **kwargs)
+
+    def distinct(self, key, filter=None, **kwargs):
+        return self.raw().distinct(key, _scope_filter(filter, self.tenant_id, self.tenant_field), **kwargs)
+
+    def aggregate(self, pipeline, **kwargs):
+        return self.raw().aggregate(_scope_pipeline(pipeline, self.tenant_id, self.tenant_field), **kwargs)
+
+    # --- Writes ---
+    def insert_one(self, document, **kwargs):
+        return self.raw().insert_one(_scope_document(document, self.tenant_id, self.tenant_field), **kwargs)
+
+    def insert_many(self, documents, **kwargs):
+        tenant_id = self.tenant_id
+        return self.raw().insert_many([_scope_document(d, tenant_id, self.tenant_field) for d in documents], **kwargs)
+
+    def update_one(self, filter, update, **kwargs):
+        return self.raw().update_one(_scope_filter(filter, self.tenant_id, self.tenant_field), update, **kwargs)
+
+    def update_many(self, filter, update, **kwargs):
+        return self.raw().update_many(_scope_filter(filter, self.tenant_id, self.tenant_field), update, **kwargs)
+
+    def replace_one(self, filter, replacement, **kwargs):
+        tenant_id = self.tenant_id
+        return self.raw().replace_one(
+            _scope_filter(filter, tenant_id, self.tenant_field),
+            _scope_document(replacement, tenant_id, self.tenant_field), **kwargs
+        )
+
+    def find_one_and_update(self, filter, update, **kwargs):
+        return self.raw().find_one_and_update(_scope_filter(filter, self.tenant_id, self.tenant_field), update, **kwargs)
+
+    def delete_one(self, filter, **kwargs):
+        return self.raw().delete_one(_scope_filter(filter, self.tenant_id, self.tenant_field), **kwargs)
+
+    def delete_many(self, filter, **kwargs):
+        return self.raw().delete_many(_scope_filter(filter, self.tenant_id, self.tenant_field), **kwargs)
+
+    def bulk_write(self, requests, **kwargs):
+        tenant_id = self.tenant_id
+        return self.raw().bulk_write([_scope_op(op, tenant_id, self.tenant_field) for op in requests], **kwargs)
@@ -0,0 +1,144 @@
+import re
+from pymongo import UpdateOne
+from db import (
+    users_col, attendance_col, leaves_col, chats_col, leave_ledger_col, leave_balances_col,
+    api_tokens_col, punch_events_col, attendance_archive_col, leaves_archive_col,
+    chats_archive_col, archive_rollups_col, chat_messages_col
+)
+from modules import attachments, audit, employee_search
+from modules.tenancy import current_tenant
+
+# Admin user management: paginated listing with projected columns, staged edits
+# committed as one bulk_write, and bulk delete including the users' related records.
+# Pages are keyset-paginated on (sort field, _id), which the (tenant_id, field, _id)
+# indexes from db.ensure_indexes serve without an in-memory sort, so page cost depends
+# on the page size, not on the headcount or how deep the page is.
+
+PAGE_SIZES = [25, 50, 100]
+GRID_COLUMNS = ["employee_id", "full_name", "username", "email", "role", "department", "job_title"]
+EDITABLE_FIELDS = ["role", "department", "job_title"]
+SORT_FIELDS = ["full_name", "employee_id", "username", "role", "department", "job_title"]
+ROLES = ["employee", "manager", "hr", "admin"]
+
+# Collections holding per-employee records (field = employee_id) removed with the user
+_RELATED_BY_EMPLOYEE_ID = [
+    attendance_col, leaves_col, leave_ledger_col, leave_balances_col,
+    attendance_archive_col, leaves_archive_col
+]
+
+
+def _query(search="", roles=None, department=None):
+    query = {}
+    tokens = search.lower().split()
+    if tokens:
+        query["$and"] = [{"search_keys": {"$regex": f"^{re.escape(token)}"}} for token in tokens]
+    if roles:
+        query["role"] = {"$in": list(roles)}
+    if department and department != "All":
+        query["department"] = department
+    return query
+
+
+def _after(sort_field, ascending, cursor):
+    """Users sorted after `cursor` ((value, _id) of the previous page's last row)."""
+    value, last_id = cursor
+    op = "$gt" if ascending else "$lt"
+    # Missing values sort before every string: first when ascending, last when descending
+    if value is None:
+        clauses = [{sort_field: None, "_id": {op: last_id}}]
+        if ascending:
+            clauses.append({sort_field: {"$ne": None}})
+    else:
+        clauses = [{sort_field: {op: value}}, {sort_field: value, "_id": {op: last_id}}]
+        if not ascending:
+            clauses.append({sort_field: None})
+    return {"$or": clauses}
+
+
+def page_cursor(row, sort_field):
+    """The cursor to pass as `after` for the page following `row`."""
+    return row.get(sort_field), row["_id"]
+
+
+def list_users(search="", roles=None, department=None, sort_field="full_name", ascending=True, after=None, page_size=25):
+    """
+    Returns (rows, total) for one page of users, without password hashes or pictures.
+    `after` is page_cursor() of the previous page's last row (None for the first page).
+    """
+    employee_search.ensure_search_keys()
+    query = _query(search, roles, department)
+    page_query = {"$and": [query, _after(sort_field, ascending, after)]} if after else query
+    direction = 1 if ascending else -1
+    rows = list(
+        users_col.find(page_query, {field: 1 for field in GRID_COLUMNS})
+        .sort([(sort_field, direction), ("_id", direction)])
+        .limit(page_size)
+    )
+    return rows, users_col.count_documents(query)
+
+
+def apply_user_edits(changes, actor_id):
+    """
+    Commits staged edits as one bulk_write. `changes` maps employee_id to
+    {"before": row, "after": row} with the grid's columns. Returns the number of users updated.
+    """
+    ops = []
+    for employee_id, change in changes.items():
+        updates = {f: change["after"].get(f) for f in EDITABLE_FIELDS if change["after"].get(f) != change["before"].get(f)}
+        if not updates:
+            continue
+        updates["search_keys"] = employee_search.search_keys_for(dict(change["before"], **updates))
+        ops.append(UpdateOne({"employee_id": employee_id}, {"$set": updates}))
+    if not ops:
+        return 0
+    result = users_col.bulk_write(ops, ordered=False)
+    employee_search.invalidate()
+    for employee_id, change in changes.items():
+        diff = {f: {"from": change["before"].get(f), "to": change["after"].get(f)}
+                for f in EDITABLE_FIELDS if change["after"].get(f) != change["before"].get(f)}
+        if diff:
+            audit.record(actor_id, "user.update", "user", employee_id, diff)
+    return result.modified_count
+
+
+def delete_users(employee_ids, actor_id):
+    """
+    Deletes users and their related records (attendance, leaves, ledger, balances,
+    tokens, punch events, chats, their search copies, archived copies and the leave
+    attachments no other user's leave still uses). The audit log is kept.
+    Related records go first so an interrupted run can simply be repeated.
+    Returns {collection: documents deleted}.
+    """
+    employee_ids = [e for e in employee_ids if e != actor_id]
+    if not employee_ids:
+        return {}
+    deleted = {}
+    # Collected before their leaves go; deleted after, once unreferenced (files are deduplicated)
+    file_ids = {
+        leave["attachment"]["file_id"]
+        for collection in (leaves_col, leaves_archive_col)
+        for leave in collection.find(
+            {"employee_id": {"$in": employee_ids}, "attachment.file_id": {"$exists": True}}, {"attachment.file_id": 1}
+        )
+    }
+    file_ids |= attachments.uploaded_by(employee_ids)
+    for collection in _RELATED_BY_EMPLOYEE_ID:
+        deleted[collection.name] = collection.delete_many({"employee_id": {"$in": employee_ids}}).deleted_count
+    # Time-series deletes may only filter on the metaField
+    deleted[punch_events_col.name] = punch_events_col.delete_many(
+        {"meta.employee_id": {"$in": employee_ids}}
+    ).deleted_count
+    # Search copies of their chat messages go too, so they no longer show up in HR search
+    for collection in (chats_col, chats_archive_col, chat_messages_col):
+        deleted[collection.name] = collection.delete_many({"participants": {"$in": employee_ids}}).deleted_count
+    deleted[archive_rollups_col.name] = archive_rollups_col.delete_many({"employee_id": {"$in": employee_ids}}).deleted_count
+    # API tokens live in a shared control collection, so scope them explicitly
+    deleted[api_tokens_col.name] = api_tokens_col.delete_many(
+        {"employee_id": {"$in": employee_ids}, "tenant_id": current_tenant()}
+    ).deleted_count
+    deleted["leave_attachments"] = attachments.delete_unreferenced(file_ids)
+    deleted[users_col.name] = users_col.delete_many({"employee_id": {"$in": employee_ids}}).deleted_count
+    employee_search.invalidate()
+    for employee_id in employee_ids:
+        audit.record(actor_id, "user.delete", "user", employee_id, {"bulk": len(employee_ids) > 1})
+    return deleted
@@ -0,0 +1,198 @@
+import time
+from array import array
+from datetime import date, datetime, timedelta
+from pymongo.errors import PyMongoError
+from db import work_calendars_col, users_col
+from modules.tenancy import current_tenant
+
+DEFAULT_LOCATION = "default"
+DEFAULT_WEEKEND_DAYS = [5, 6]  # Saturday, Sunday (date.weekday() numbering)
+
+# Used until a calendar document has been saved for a location.
+DEFAULT_HOLIDAYS = {
+    "2025-11-01": "Diwali",
+    "2025-12-25": "Christmas Day",
+    "2026-01-01": "New Year's Day",
+    "2026-01-26": "Republic Day"
+}
+
+# (tenant, location, year) -> (YearCalendar, calendar updated_at, checked at).
+# Calendars are edited from any process (Streamlit workers, api.py), so a cached
+# year is re-validated against the stored updated_at every CALENDAR_CHECK_SECONDS.
+# The built-in fallback used while the database is unreachable is never cached.
+CALENDAR_CHECK_SECONDS = 30
+_year_cache = {}
+
+
+class YearCalendar:
+    """
+    Precomputed working-day bitmap for one year and location.
+    `prefix[i]` holds the number of working days in days [0, i) of the year,
+    so counting working days in any range is a single subtraction.
+    """
+
+    def __init__(self, year, weekend_days, holidays):
+        self.year = year
+        self.first_day = date(year, 1, 1)
+        num_days = (date(year + 1, 1, 1) - self.first_day).days
+        self.bits = bytearray(num_days)
+        self.prefix = array("H", [0]) * (num_days + 1)
+        for i in range(num_days):
+            day = self.first_day + timedelta(days=i)
+            working = day.weekday() not in weekend_days and day not in holidays
+            self.bits[i] = 1 if working else 0
+            self.prefix[i + 1] = self.prefix[i] + self.bits[i]
+
+    def is_working_day(self, day):
+        return bool(self.bits[(day - self.first_day).days])
+
+    def count(self, start, end):
+        """Working days between start and end (inclusive), both inside this year."""
+        return self.prefix[(end - self.first_day).days + 1] - self.prefix[(start - self.first_day).days]
+
+
+def _to_date(value):
+    return value.date() if isinstance(value, datetime) else value
+
+
+def _find_calendar(location, projection=None):
+    doc = work_calendars_col.find_one({"location": location}, projection)
+    if doc is None and location != DEFAULT_LOCATION:
+        doc = work_calendars_col.find_one({"location": DEFAULT_LOCATION}, projection)
+    return doc
+
+
+def _load_calendar_doc(location):
+    try:
+        doc = _find_calendar(location)
+    except PyMongoError:
+        # Database unreachable: fall back to the built-in calendar (flagged so it is not cached)
+        return dict(_default_calendar(), unavailable=True)
+    return doc or _default_calendar()
+
+
+def _default_calendar():
+    return {
+        "location": DEFAULT_LOCATION,
+        "weekend_days": DEFAULT_WEEKEND_DAYS,
+        "holidays": [{"date": d, "name": n} for d, n in DEFAULT_HOLIDAYS.items()]
+    }
+
+
+def get_holidays(location=DEFAULT_LOCATION):
+    """Returns {date: name} of configured holidays for a location."""
+    doc = _load_calendar_doc(location)
+    return {datetime.strptime(h["date"], "%Y-%m-%d").date(): h["name"] for h in doc.get("holidays", [])}
+
+
+def _still_current(stamp, location):
+    """True if the stored calendar was not edited since `stamp` (or cannot be checked right now)."""
+    try:
+        doc = _find_calendar(location, {"updated_at": 1})
+    except PyMongoError:
+        return True
+    return (doc or {}).get("updated_at") == stamp
+
+
+def get_year_calendar(year, location=DEFAULT_LOCATION):
+    """Returns the cached working-day bitmap for a year, building it on first use or after an edit."""
+    key = (current_tenant(), location, year)
+    cached = _year_cache.get(key)
+    if cached:
+        calendar, stamp, checked_at = cached
+        if time.time() - checked_at < CALENDAR_CHECK_SECONDS:
+            return calendar
+        if _still_current(stamp, location):
+            _year_cache[key] = (calendar, stamp, time.time())
+            return calendar
+    doc = _load_calendar_doc(location)
+    holidays = {datetime.strptime(h["date"], "%Y-%m-%d").date() for h in doc.get("holidays", [])}
+    calendar = YearCalendar(year, set(doc.get("weekend_days", DEFAULT_WEEKEND_DAYS)), holidays)
+    if not doc.get("unavailable"):
+        _year_cache[key] = (calendar, doc.get("updated_at"), time.time())
+    return calendar
+
+
+def is_working_day(day, location=DEFAULT_LOCATION):
+    day = _to_date(day)
+    return get_year_calendar(day.year, location).is_working_day(day)
+
+
+def count_working_days(start, end, location=DEFAULT_LOCATION):
+    """Counts working days between two dates (inclusive)."""
+    start, end = _to_date(start), _to_date(end)
+    if start > end:
+        return 0
+    total = 0
+    for year in range(start.year, end.year + 1):
+        year_start = max(start, date(year, 1, 1))
+        year_end = min(end, date(year, 12, 31))
+        total += get_year_calendar(year, location).count(year_start, year_end)
+    return total
+
+
+def leave_working_days(leave, location=DEFAULT_LOCATION):
+    """Returns the working days a leave consumes, counting half days as 0.5."""
+    start, end = _to_date(leave["start_date"]), _to_date(leave["end_date"])
+    start_half = leave.get("start_day_type", "full day") != "full day"
+    end_half = leave.get("end_day_type", "full day") != "full day"
+
+    total = float(count_working_days(start, end, location))
+    if start == end:
+        return total / 2 if start_half else total
+    if start_half and is_working_day(start, location):
+        total -= 0.5
+    if end_half and is_working_day(end, location):
+        total -= 0.5
+    return total
+
+
+def upcoming_holidays(location=DEFAULT_LOCATION, from_date=None, limit=5):
+    """Returns [(date, name)] of the next holidays on or after from_date."""
+    from_date = _to_date(from_date or date.today())
+    upcoming = sorted((d, n) for d, n in get_holidays(location).items() if d >= from_date)
+    return upcoming[:limit]
+
+
+def get_user_location(employee_id):
+    """Returns the calendar location configured on a user's profile."""
+    try:
+        user = users_col.find_one({"employee_id": employee_id}, {"location": 1})
+    except PyMongoError:
+        user = None
+    return (user or {}).get("location") or DEFAULT_LOCATION
+
+
+# --- Calendar Editing ---
+def save_holiday(holiday_date, name, location=DEFAULT_LOCATION):
+    """Adds or renames a holiday for a location."""
+    day_str = _to_date(holiday_date).strftime("%Y-%m-%d")
+    doc = _load_calendar_doc(location)
+    holidays = [h for h in doc.get("holidays", []) if h["date"] != day_str]
+    holidays.append({"date": day_str, "name": name})
+    _save_calendar(location, doc.get("weekend_days", DEFAULT_WEEKEND_DAYS), holidays)
+
+
+def remove_holiday(holiday_date, location=DEFAULT_LOCATION):
+    day_str = _to_date(holiday_date).strftime("%Y-%m-%d")
+    doc = _load_calendar_doc(location)
+    holidays = [h for h in doc.get("holidays", []) if h["date"] != day_str]
+    _save_calendar(location, doc.get("weekend_days", DEFAULT_WEEKEND_DAYS), holidays)
+
+
+def set_weekend_days(weekend_days, location=DEFAULT_LOCATION):
+    doc = _load_calendar_doc(location)
+    _save_calendar(location, sorted(weekend_days), doc.get("holidays", []))
+
+
+def _save_calendar(location, weekend_days, holidays):
+    work_calendars_col.update_one(
+        {"location": location},
+        {"$set": {
+            "weekend_days": list(weekend_days),
+            "holidays": sorted(holidays, key=lambda h: h["date"]),
+            "updated_at": datetime.now()
+        }},
+        upsert=True
+    )
+    _year_cache.clear()
@@ -0,0 +1,238 @@
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from bson import json_util
+from pymongo import InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError, PyMongoError
+from db import db, db_online, punch_events_col, ensure_indexes, tenant_collection
+from modules.attendance_schema import to_day
+from modules.punch_events import rebuild_daily_records, stored_event
+from modules.punch_queue import get_punch_queue, QueueFullError
+from modules.tenancy import current_tenant, tenant_context
+
+# Local write-ahead journal. Punch events and leave submissions are appended to a SQLite
+# file first and acknowledged straight away; a background thread replays them to
+# Mongo in batches. The journal file is shared by every process on the host (the
+# Streamlit app and api.py), so a batch is claimed under a lease before it is
+# replayed and no two processes replay the same rows. An entry can still be replayed
+# twice (a crash between the write and marking it done, or an expired lease): inserts
+# carry a pre-generated _id, and punch event readers count each _id once because the
+# time-series collection cannot enforce a unique _id.
+
+JOURNAL_PATH = os.getenv("WAL_PATH", "hrms_journal.sqlite3")
+REPLAY_BATCH = 500
+RETRY_SECONDS = 5
+MAX_ATTEMPTS = 10
+TENANT_DEFAULT_FOR_LEGACY = os.getenv("TENANT_ID", "default")  # rows journaled before tenants existed
+DUPLICATE_KEY = 11000
+CLAIM_LEASE_SECONDS = 120  # A claimed batch is released to other processes after this
+
+
+class WriteBuffer:
+    def __init__(self, path=JOURNAL_PATH):
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS journal (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                op_id TEXT UNIQUE NOT NULL,
+                collection TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                employee_id TEXT,
+                day TEXT,
+                payload TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                last_error TEXT,
+                replayed_at REAL
+            )
+        """)
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(journal)")}
+        if "tenant_id" not in columns:
+            self._conn.execute("ALTER TABLE journal ADD COLUMN tenant_id TEXT")
+        if "claimed_by" not in columns:
+            self._conn.execute("ALTER TABLE journal ADD COLUMN claimed_by TEXT")
+            self._conn.execute("ALTER TABLE journal ADD COLUMN claimed_until REAL")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS journal_pending ON journal (replayed_at, seq)")
+        self.online = db_online()
+        threading.Thread(target=self._run, name="journal-replay", daemon=True).start()
+
+    # --- Journal ---
+    def append(self, collection, kind, payload, employee_id=None, day=None):
+        """Durably records a write op locally for the current tenant. Returns its op_id."""
+        op_id = uuid.uuid4().hex
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO journal (op_id, tenant_id, collection, kind, employee_id, day, payload, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (op_id, current_tenant(), collection, kind, employee_id, day, json_util.dumps(payload), time.time())
+            )
+        self._wake.set()
+        return op_id
+
+    def pending(self, employee_id=None, day=None, kind=None):
+        """Returns payloads of the current tenant's not-yet-replayed entries, oldest first."""
+        query = "SELECT kind, payload FROM journal WHERE replayed_at IS NULL AND COALESCE(tenant_id, ?) = ?"
+        params = [TENANT_DEFAULT_FOR_LEGACY, current_tenant()]
+        for column, value in (("employee_id", employee_id), ("day", day), ("kind", kind)):
+            if value is not None:
+                query += f" AND {column} = ?"
+                params.append(value)
+        with self._lock:
+            rows = self._conn.execute(query + " ORDER BY seq", params).fetchall()
+        return [(row_kind, json_util.loads(payload)) for row_kind, payload in rows]
+
+    def stats(self):
+        with self._lock:
+            pending, failed = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(attempts >= ?), 0) FROM journal WHERE replayed_at IS NULL", (MAX_ATTEMPTS,)
+            ).fetchone()
+        return {"pending": pending, "failed": failed, "online": self.online}
+
+    # --- Replay ---
+    def _next_batch(self):
+        """Claims the oldest unclaimed rows for this replay (one UPDATE, atomic across processes) and returns them."""
+        claim = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "UPDATE journal SET claimed_by = ?, claimed_until = ? WHERE seq IN ("
+                "SELECT seq FROM journal WHERE replayed_at IS NULL AND attempts < ? "
+                "AND (claimed_until IS NULL OR claimed_until < ?) ORDER BY seq LIMIT ?)",
+                (claim, now + CLAIM_LEASE_SECONDS, MAX_ATTEMPTS, now, REPLAY_BATCH)
+            )
+            return self._conn.execute(
+                "SELECT seq, COALESCE(tenant_id, ?), collection, kind, payload FROM journal "
+                "WHERE claimed_by = ? AND replayed_at IS NULL ORDER BY seq",
+                (TENANT_DEFAULT_FOR_LEGACY, claim)
+            ).fetchall()
+
+    def _mark(self, done, failed):
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE journal SET replayed_at = ?, claimed_until = NULL WHERE seq = ?", [(now, seq) for seq in done]
+            )
+            self._conn.executemany(
+                "UPDATE journal SET attempts = attempts + 1, last_error = ?, claimed_until = NULL WHERE seq = ?",
+                [(error, seq) for seq, error in failed]
+            )
+
+    def _release(self, seqs):
+        """Hands claimed rows back (e.g. the database went away mid-batch)."""
+        with self._lock:
+            self._conn.executemany("UPDATE journal SET claimed_until = NULL WHERE seq = ?", [(seq,) for seq in seqs])
+
+    def _replay_punch_events(self, rows):
+        """Inserts punch events through the group-commit queue, then re-derives the touched days."""
+        futures = [
+            (seq, get_punch_queue().submit(InsertOne(stored_event(json_util.loads(payload)))))
+            for seq, _, payload in rows
+        ]
+        done, failed = [], []
+        for seq, future in futures:
+            result = future.result()
+            if result["ok"] or result["error"].get("code") == DUPLICATE_KEY:
+                done.append(seq)
+            else:
+                failed.append((seq, result["error"].get("errmsg")))
+        return done, failed
+
+    def _replay_direct(self, collection, rows):
+        try:
+            tenant_collection(collection).bulk_write([_to_op(kind, json_util.loads(payload)) for _, kind, payload in rows], ordered=False)
+            return [seq for seq, _, _ in rows], []
+        except BulkWriteError as e:
+            errors = {
+                err["index"]: err["errmsg"] for err in e.details.get("writeErrors", [])
+                if err.get("code") != DUPLICATE_KEY
+            }
+            done = [seq for i, (seq, _, _) in enumerate(rows) if i not in errors]
+            return done, [(rows[i][0], msg) for i, msg in errors.items()]
+
+    def _replay_once(self):
+        rows = self._next_batch()
+        if not rows:
+            return False
+        groups = {}
+        for seq, tenant_id, collection, kind, payload in rows:
+            groups.setdefault((tenant_id, collection), []).append((seq, kind, payload))
+        unmarked = {seq for seq, *_ in rows}
+        try:
+            for (tenant_id, collection), col_rows in groups.items():
+                with tenant_context(tenant_id):
+                    if collection == punch_events_col.name:
+                        done, failed = self._replay_punch_events(col_rows)
+                        done_seqs = set(done)
+                        rebuild_daily_records({
+                            (event["employee_id"], to_day(event["ts"]))
+                            for seq, _, payload in col_rows if seq in done_seqs
+                            for event in [json_util.loads(payload)]
+                        })
+                    else:
+                        done, failed = self._replay_direct(collection, col_rows)
+                self._mark(done, failed)
+                unmarked.difference_update(done)
+                unmarked.difference_update(seq for seq, _ in failed)
+        finally:
+            # Rows of a group that failed part-way are retried; their events are read once
+            self._release(unmarked)
+        return len(rows) == REPLAY_BATCH
+
+    def _run(self):
+        while True:
+            try:
+                if not self.online:
+                    db.client.admin.command("ping")
+                    ensure_indexes()
+                    self.online = True
+                while self._replay_once():
+                    pass
+            except (PyMongoError, QueueFullError):
+                self.online = False
+                time.sleep(RETRY_SECONDS)
+                continue
+            self._wake.wait(RETRY_SECONDS)
+            self._wake.clear()
+
+
+def _to_op(kind, payload):
+    """Turns a journaled payload into its idempotent pymongo write op."""
+    # punch_in / punch_out: attendance entries journaled before raw punch events existed
+    if kind == "punch_in":
+        return UpdateOne(
+            {"employee_id": payload["employee_id"], "date": payload["date"]},
+            {"$setOnInsert": payload},
+            upsert=True
+        )
+    if kind == "punch_out":
+        when = payload["punch_out"]
+        # worked_hours is computed server-side so it stays correct even if the
+        # punch in was also journaled offline.
+        return UpdateOne(
+            {"employee_id": payload["employee_id"], "date": payload["date"], "punch_out": {"$exists": False}},
+            [{"$set": {
+                "punch_out": when,
+                "worked_hours": {"$round": [{"$divide": [{"$subtract": [when, "$punch_in"]}, 3600000]}, 2]}
+            }}]
+        )
+    if kind == "insert":
+        return InsertOne(payload)
+    raise ValueError(f"Unknown journal entry kind: {kind}")
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_write_buffer():
+    """Returns the process-wide journal, starting the replay thread on first use."""
+    global _buffer
+    with _buffer_lock:
+        if _buffer is None:
+            _buffer = WriteBuffer()
+        return _buffer
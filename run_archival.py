@@ -0,0 +1,16 @@
+import sys
+from db import all_tenants
+from modules.archive import run_archival
+from modules.tenancy import tenant_context
+
+# Usage: python run_archival.py [days]
+# Moves attendance, finished leaves and inactive chats older than `days`
+# (default ARCHIVE_AFTER_DAYS, 365) into the archive collections.
+# Schedule this with cron, e.g. nightly during off-peak hours.
+
+if __name__ == "__main__":
+    days = int(sys.argv[1]) if len(sys.argv) > 1 else None
+    for tenant_id in all_tenants():
+        with tenant_context(tenant_id):
+            moved = run_archival(days)
+        print(f"✅ [{tenant_id}] Archival finished: " + ", ".join(f"{count} {name}" for name, count in moved.items()))
@@ -0,0 +1,26 @@
+import argparse
+from datetime import datetime, timedelta
+from db import all_tenants
+from modules.end_of_day import AUTO_CLOSE_POLICIES, AUTO_CLOSE_POLICY, close_day
+from modules.tenancy import tenant_context
+
+# Closes finished days: auto-closes forgotten punches and writes absent / on_leave /
+# holiday records for every employee. Idempotent, so re-running a day is safe.
+#   python run_end_of_day.py                       # yesterday
+#   python run_end_of_day.py --date 2026-03-02     # a specific day
+#   python run_end_of_day.py --days 7              # catch up on the last week
+# Schedule this with cron shortly after midnight, e.g. "15 0 * * *".
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Close finished attendance days")
+    parser.add_argument("--date", help="Day to close (YYYY-MM-DD), default yesterday")
+    parser.add_argument("--days", type=int, default=1, help="Number of days to close, ending at --date")
+    parser.add_argument("--policy", choices=AUTO_CLOSE_POLICIES, default=AUTO_CLOSE_POLICY)
+    args = parser.parse_args()
+
+    last_day = datetime.strptime(args.date, "%Y-%m-%d") if args.date else datetime.now() - timedelta(days=1)
+    days = [last_day - timedelta(days=offset) for offset in reversed(range(args.days))]
+    for tenant_id in all_tenants():
+        with tenant_context(tenant_id):
+            for day in days:
+                close_day(day, args.policy, progress=lambda message: print(f"✅ [{tenant_id}] {message}"))
@@ -0,0 +1,17 @@
+import sys
+from db import all_tenants
+from modules.leave_ledger import apply_monthly_accrual
+from modules.tenancy import tenant_context
+
+# Usage: python run_monthly_accrual.py [YYYY-MM]
+# Schedule this with cron on the 1st of every month.
+
+if __name__ == "__main__":
+    period = sys.argv[1] if len(sys.argv) > 1 else None
+    for tenant_id in all_tenants():
+        with tenant_context(tenant_id):
+            credited = apply_monthly_accrual(period)
+        if credited:
+            print(f"✅ [{tenant_id}] Monthly leave accrual applied to {credited} employees.")
+        else:
+            print(f"[{tenant_id}] Accrual for this period was already applied (or no employees found). Skipping.")
@@ -0,0 +1,25 @@
+from pymongo.errors import OperationFailure
+from db import db, ensure_indexes, SHARD_KEYS
+
+# Shards the shared database on a sharded cluster (connect through mongos).
+# Shard keys are listed in db.SHARD_KEYS. Run once after migrate_tenants.py;
+# collections that are already sharded are reported and skipped.
+#   MONGO_URI="mongodb://mongos:27017" python shard_collections.py
+
+
+def shard_collections():
+    ensure_indexes()
+    db.client.admin.command("enableSharding", db.name)
+    for name, key in SHARD_KEYS.items():
+        # A shard key needs a supporting index (time-series collections create their own)
+        if name != "punch_events":
+            db[name].create_index(list(key.items()))
+        try:
+            db.client.admin.command("shardCollection", f"{db.name}.{name}", key=key)
+            print(f"✅ {name} sharded on {key}")
+        except OperationFailure as e:
+            print(f"⚠️ {name}: {e}")
+
+
+if __name__ == "__main__":
+    shard_collections()
@@ -0,0 +1,71 @@
+import os
+from datetime import datetime
+
+import pytest
+
+pytest.importorskip("pymongo")
+pytest.importorskip("streamlit")
+os.environ.setdefault("MONGO_URI", "mongodb://localhost:27017/?serverSelectionTimeoutMS=100")
+
+import bson  # noqa: E402
+from bson.objectid import ObjectId  # noqa: E402
+from modules import search  # noqa: E402
+
+
+class FakeMessages:
+    """In-memory stand-in for chat_messages: documents keyed by _id."""
+
+    def __init__(self):
+        self.docs = {}
+
+    def replace_one(self, filter, doc, upsert=False):
+        self.docs[filter["_id"]] = doc
+
+    def bulk_write(self, ops, ordered=True):
+        for op in ops:
+            self.replace_one(op._filter, op._doc, upsert=True)
+
+
+class FakeThreads:
+    name = "chats"
+
+    def __init__(self, threads):
+        self.threads = threads
+
+    def find(self, query, projection=None):
+        pending = [t for t in self.threads if not t.get("search_indexed")]
+        return FakeCursor(pending)
+
+    def update_many(self, filter, update):
+        for thread in self.threads:
+            if thread["_id"] in filter["_id"]["$in"]:
+                thread.update(update["$set"])
+
+
+class FakeCursor(list):
+    def sort(self, *args):
+        return self
+
+    def limit(self, n):
+        return self[:n]
+
+
+def _round_trip(doc):
+    """What MongoDB hands back: datetimes cut to milliseconds."""
+    return bson.decode(bson.encode(doc))
+
+
+@pytest.mark.parametrize("with_id", [True, False])
+def test_live_and_backfill_index_a_message_once(monkeypatch, with_id):
+    messages = FakeMessages()
+    monkeypatch.setattr(search, "chat_messages_col", messages)
+    thread_id = ObjectId()
+    message = {"sender_id": "E002", "message": "Need Friday off", "timestamp": datetime(2026, 10, 19, 9, 30, 0, 123456)}
+    if with_id:
+        message["_id"] = ObjectId()
+
+    search.index_chat_message(thread_id, ["E002", "H001"], message)
+    stored = _round_trip({"_id": thread_id, "participants": ["E002", "H001"], "messages": [message]})
+    search._index_threads(FakeThreads([stored]), batch_size=10, progress=lambda _: None)
+
+    assert len(messages.docs) == 1